@@ -7,10 +7,19 @@ from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import os
 import random
 import string
+import time
+import uuid
+import logging
 
-from models import User, UserCreate, UserLogin, UserResponse, EmailVerification
-from database import find_one, insert_one, update_one
-from email_service import send_verification_email
+from models import User, UserCreate, UserLogin, UserProfile, UserResponse, EmailVerification
+from cache import InflightVersions, TTLCache
+from database import decode_id, find_one, insert_one, update_one
+from outbox import email_outbox
+from hashing import PoolSaturated, password_pool
+from rate_limit import RateLimited, auth_admission
+from revocation import revocation_list
+
+logger = logging.getLogger(__name__)
 
 # Security configurations
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -20,17 +29,67 @@ SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-here")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 1440  # 24 hours
 
+# Validated principals are reused for this long before the user is re-read
+PRINCIPAL_CACHE_TTL = 60.0
+
+def auth_mode() -> str:
+    """`stateful` re-reads the user per request; `stateless` trusts the claims in the token"""
+    return os.getenv("AUTH_MODE", "stateful")
+
 class AuthService:
     def __init__(self):
-        pass
+        # (user_id, token) -> User
+        self.principal_cache = TTLCache(maxsize=4096, ttl=PRINCIPAL_CACHE_TTL)
+        # Keeps a principal read while the user was being written out of the cache
+        self._user_versions = InflightVersions()
+    
+    def invalidate_user(self, user_id: str):
+        """Drop every cached principal of a user; call after any change to the user document"""
+        self._user_versions.bump(user_id)
+        self.principal_cache.invalidate_where(lambda key: key[0] == user_id)
+    
+    async def verify_password(self, plain_password: str, hashed_password: str) -> bool:
+        """Verify a password against its hash on the password pool"""
+        return await self._run_password_work(pwd_context.verify, plain_password, hashed_password)
     
-    def verify_password(self, plain_password: str, hashed_password: str) -> bool:
-        """Verify a password against its hash"""
-        return pwd_context.verify(plain_password, hashed_password)
+    async def get_password_hash(self, password: str) -> str:
+        """Hash a password on the password pool"""
+        return await self._run_password_work(pwd_context.hash, password)
     
-    def get_password_hash(self, password: str) -> str:
-        """Hash a password"""
-        return pwd_context.hash(password)
+    async def _run_password_work(self, fn, *args):
+        """Run bcrypt off the event loop, answering 503 when the pool is saturated"""
+        try:
+            return await password_pool.run(fn, *args)
+        except PoolSaturated as e:
+            raise self._busy_error(e)
+    
+    def _busy_error(self, error: PoolSaturated) -> HTTPException:
+        return HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many sign-in attempts right now, please try again shortly",
+            headers={"Retry-After": str(error.retry_after)}
+        )
+    
+    def admit(self, admit_fn, *args):
+        """Apply login/signup admission control before any lookup or hashing"""
+        try:
+            admit_fn(*args)
+        except RateLimited as e:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many attempts, please try again later",
+                headers={"Retry-After": str(e.retry_after)}
+            )
+        except PoolSaturated as e:
+            raise self._busy_error(e)
+    
+    def admit_login(self, client_ip: str, email: str):
+        """Rate-limit a login by client IP and email, and shed it if bcrypt is saturated"""
+        self.admit(auth_admission.admit_login, client_ip, email)
+    
+    def admit_signup(self, client_ip: str):
+        """Rate-limit a signup by client IP, and shed it if bcrypt is saturated"""
+        self.admit(auth_admission.admit_signup, client_ip)
     
     def generate_verification_code(self) -> str:
         """Generate a 6-digit verification code"""
@@ -48,8 +107,18 @@ class AuthService:
         encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
         return encoded_jwt
     
+    def create_user_token(self, user: User) -> str:
+        """Create an access token carrying the claims handlers need, so stateless mode can skip Mongo"""
+        return self.create_access_token(data={
+            "sub": user.id,
+            "email": user.email,
+            "verified": user.is_verified,
+            "jti": uuid.uuid4().hex,
+            "iat": int(time.time())
+        })
+    
     def verify_token(self, token: str) -> Dict:
-        """Verify and decode a JWT token"""
+        """Verify and decode a JWT token, rejecting revoked ones"""
         try:
             payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
             user_id: str = payload.get("sub")
@@ -58,12 +127,33 @@ class AuthService:
                     status_code=status.HTTP_401_UNAUTHORIZED,
                     detail="Could not validate credentials"
                 )
-            return {"user_id": user_id}
         except JWTError:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Could not validate credentials"
             )
+        
+        if revocation_list.is_revoked(payload.get("jti"), user_id, payload.get("iat")):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Token has been revoked"
+            )
+        return {"user_id": user_id, "claims": payload}
+    
+    async def revoke_token(self, token: str):
+        """Log out a single token"""
+        claims = self.verify_token(token)["claims"]
+        if not claims.get("jti"):
+            # Issued before tokens carried an ID; only revoke_all_tokens can cut it off
+            await self.revoke_all_tokens(claims["sub"])
+            return
+        expires_at = datetime.utcfromtimestamp(claims["exp"])
+        await revocation_list.revoke_token(claims["jti"], claims["sub"], expires_at)
+    
+    async def revoke_all_tokens(self, user_id: str):
+        """Revoke every token issued to a user so far; call after a password change"""
+        await revocation_list.revoke_user(user_id, timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+        self.invalidate_user(user_id)
     
     async def authenticate_user(self, email: str, password: str) -> Optional[User]:
         """Authenticate a user with email and password"""
@@ -72,7 +162,7 @@ class AuthService:
             return None
         
         user = User(**user_dict)
-        if not self.verify_password(password, user.password_hash):
+        if not await self.verify_password(password, user.password_hash):
             return None
         
         return user
@@ -101,7 +191,7 @@ class AuthService:
         # Create user
         user = User(
             email=user_create.email,
-            password_hash=self.get_password_hash(user_create.password),
+            password_hash=await self.get_password_hash(user_create.password),
             verification_code=verification_code,
             verification_code_expires=verification_expires,
             is_verified=False
@@ -113,12 +203,12 @@ class AuthService:
         user_id = await insert_one("users", user_dict)
         user.id = user_id
         
-        # Send verification email
+        # Queue verification email
         try:
-            await send_verification_email(user.email, verification_code)
+            await email_outbox.enqueue("verification", user.email, verification_code=verification_code)
         except Exception as e:
             # Log the error but don't fail user creation
-            print(f"Failed to send verification email: {e}")
+            logger.error(f"Failed to queue verification email: {e}")
         
         return user
     
@@ -160,13 +250,59 @@ class AuthService:
             "verification_code": None,
             "verification_code_expires": None
         })
+        self.invalidate_user(user.id)
         
         return True
     
     async def get_current_user(self, credentials: HTTPAuthorizationCredentials = Depends(security)) -> User:
         """Get the current authenticated user"""
         token_data = self.verify_token(credentials.credentials)
-        user_dict = await find_one("users", {"_id": token_data["user_id"]})
+        if auth_mode() == "stateless" and "email" in token_data["claims"]:
+            return self._principal_from_claims(token_data["claims"])
+        return await self._load_principal(token_data["user_id"], credentials.credentials)
+    
+    async def get_current_user_record(self, credentials: HTTPAuthorizationCredentials = Depends(security)) -> User:
+        """Get the current user as stored, even in stateless mode (for profile reads)"""
+        token_data = self.verify_token(credentials.credentials)
+        return await self._load_principal(token_data["user_id"], credentials.credentials)
+    
+    async def get_current_admin(self, credentials: HTTPAuthorizationCredentials = Depends(security)) -> User:
+        """Get the current user if they are an admin; the flag is always read from the stored user"""
+        user = await self.get_current_user_record(credentials)
+        if not user.is_admin:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Admin access required"
+            )
+        return user
+    
+    def _principal_from_claims(self, claims: Dict) -> User:
+        """Build the user from token claims alone; fields the token doesn't carry keep their defaults"""
+        if not claims.get("verified"):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Please verify your email address"
+            )
+        return User.model_construct(
+            id=claims["sub"],
+            email=claims["email"],
+            password_hash="",
+            is_verified=True,
+            profile=UserProfile()
+        )
+    
+    async def _load_principal(self, user_id: str, token: str) -> User:
+        """Read and validate the user, through the principal cache"""
+        cache_key = (user_id, token)
+        cached = self.principal_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        version = self._user_versions.start(user_id)
+        try:
+            user_dict = await find_one("users", {"_id": decode_id(user_id)})
+        finally:
+            unchanged = self._user_versions.finish(user_id, version)
         
         if user_dict is None:
             raise HTTPException(
@@ -181,6 +317,8 @@ class AuthService:
                 detail="Please verify your email address"
             )
         
+        if unchanged:
+            self.principal_cache.set(cache_key, user)
         return user
     
     async def get_current_user_optional(self, credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)) -> Optional[User]:
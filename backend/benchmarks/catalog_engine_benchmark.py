@@ -0,0 +1,161 @@
+"""Benchmark the in-memory catalog engine against the Mongo listing path.
+
+Usage:
+    python benchmarks/catalog_engine_benchmark.py [--sizes 10000,100000,1000000] [--mongo]
+
+With --mongo, each synthetic catalog is also written to a scratch database
+(`<DB_NAME>_bench`, dropped afterwards) on MONGO_URL and the same listings run
+through the `$facet` aggregation that `get_products` uses.
+
+The engine is also timed answering a query straight after a write, the way a
+listing request lands right after a price edit: each sample upserts one product
+with a new price and then runs the "category, by price" listing.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from bson import ObjectId
+
+from catalog import PRICE_BUCKET_BOUNDARIES, PRICE_BUCKET_OVERFLOW, build_listing_pipeline
+from catalog_engine import CatalogEngine
+from pagination import build_sort
+
+COLORS = ["Black", "White", "Gold", "Red", "Navy", "Silver", "Crystal Clear", "Brown"]
+SIZES = [f"US {size}" for size in range(5, 14)]
+MATERIALS = ["Ceramic", "Crystal", "Bamboo", "Fine Porcelain", "Gold Rim", "Leather", "Suede"]
+CATEGORIES = ["sneakers", "crockery", "accessories", "homeware"]
+
+QUERIES = [
+    ("all, by name", {}, "name", 0),
+    ("category, by price", {"category": "sneakers"}, "price-low", 0),
+    ("price range + colours", {"price": {"$gte": 100.0, "$lte": 300.0}, "colors": {"$in": ["Gold", "Black"]}}, "rating", 0),
+    ("on sale, newest", {"on_sale": True}, "newest", 0),
+    ("deep page", {"category": "crockery"}, "price-high", 5000),
+]
+
+WRITE_LABEL = "query after a price edit"
+
+def synthesize(count: int, seed: int = 42):
+    """Build `count` product documents shaped like the seeded catalog"""
+    rng = random.Random(seed)
+    epoch = datetime(2024, 1, 1)
+    products = []
+    for index in range(count):
+        products.append({
+            "_id": ObjectId(),
+            "name": f"{rng.choice(['Elite', 'Urban', 'Classic', 'Vintage', 'Premium'])} Product {index}",
+            "description": "Synthetic benchmark product",
+            "category": rng.choice(CATEGORIES),
+            "price": float(rng.randint(20, 900)),
+            "colors": rng.sample(COLORS, rng.randint(1, 3)),
+            "sizes": rng.sample(SIZES, rng.randint(0, 5)),
+            "materials": rng.sample(MATERIALS, rng.randint(0, 2)),
+            "on_sale": rng.random() < 0.2,
+            "featured": rng.random() < 0.1,
+            "rating": round(rng.uniform(3.0, 5.0), 1),
+            "reviews_count": rng.randint(0, 500),
+            "created_at": epoch + timedelta(minutes=index),
+        })
+    return products
+
+def summarize(samples):
+    """Median and p99 in milliseconds"""
+    ordered = sorted(samples)
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    return statistics.median(ordered) * 1000, p99 * 1000
+
+def run_query(engine: CatalogEngine, filter_dict, sort_by: str, skip: int):
+    return engine.query(
+        filter_dict, build_sort(sort_by), skip, 20,
+        include_facets=True,
+        price_boundaries=PRICE_BUCKET_BOUNDARIES,
+        price_overflow=PRICE_BUCKET_OVERFLOW
+    )
+
+def bench_engine(products, repeats: int):
+    engine = CatalogEngine()
+    documents = [{**product, "id": str(product["_id"])} for product in products]
+    started = time.perf_counter()
+    engine.load(documents)
+    load_ms = (time.perf_counter() - started) * 1000
+
+    results = {}
+    for label, filter_dict, sort_by, skip in QUERIES:
+        samples = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            run_query(engine, filter_dict, sort_by, skip)
+            samples.append(time.perf_counter() - started)
+        results[label] = summarize(samples)
+
+    rng = random.Random(7)
+    _, filter_dict, sort_by, skip = QUERIES[1]
+    samples = []
+    for _ in range(repeats):
+        edited = {**rng.choice(documents), "price": float(rng.randint(20, 900))}
+        started = time.perf_counter()
+        engine.upsert(edited)
+        run_query(engine, filter_dict, sort_by, skip)
+        samples.append(time.perf_counter() - started)
+    results[WRITE_LABEL] = summarize(samples)
+    return load_ms, results
+
+async def bench_mongo(products, repeats: int):
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    database = client[f"{os.environ.get('DB_NAME', 'luxuryline_db')}_bench"]
+    collection = database.products
+    await collection.drop()
+    for start in range(0, len(products), 10000):
+        await collection.insert_many(products[start:start + 10000], ordered=False)
+    for keys in ([("category", 1)], [("on_sale", 1)], [("price", 1), ("_id", 1)], [("name", 1), ("_id", 1)],
+                 [("rating", -1), ("_id", -1)], [("created_at", -1), ("_id", -1)]):
+        await collection.create_index(keys)
+
+    results = {}
+    try:
+        for label, filter_dict, sort_by, skip in QUERIES:
+            pipeline = build_listing_pipeline(filter_dict, build_sort(sort_by), skip, 20, include_facets=True)
+            samples = []
+            for _ in range(repeats):
+                started = time.perf_counter()
+                await collection.aggregate(pipeline, allowDiskUse=True).to_list(length=None)
+                samples.append(time.perf_counter() - started)
+            results[label] = summarize(samples)
+    finally:
+        await client.drop_database(database.name)
+        client.close()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--repeats", type=int, default=50)
+    parser.add_argument("--mongo", action="store_true", help="also time the Mongo $facet path")
+    args = parser.parse_args()
+
+    for size in (int(value) for value in args.sizes.split(",")):
+        products = synthesize(size)
+        load_ms, engine_results = bench_engine(products, args.repeats)
+        mongo_results = asyncio.run(bench_mongo(products, max(args.repeats // 5, 3))) if args.mongo else {}
+
+        print(f"\n{size:,} products (engine load {load_ms:,.0f}ms)")
+        print(f"  {'query':<24} {'engine p50':>11} {'engine p99':>11} {'mongo p50':>11} {'mongo p99':>11}")
+        for label in engine_results:
+            engine_p50, engine_p99 = engine_results[label]
+            mongo = mongo_results.get(label)
+            mongo_cols = f"{mongo[0]:>9.2f}ms {mongo[1]:>9.2f}ms" if mongo else f"{'-':>11} {'-':>11}"
+            print(f"  {label:<24} {engine_p50:>9.3f}ms {engine_p99:>9.3f}ms {mongo_cols}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Benchmark rendering bulk verification, order-confirmation and price-drop emails.
+
+Usage:
+    python benchmarks/email_templates_benchmark.py [--count 100000]
+
+Each email kind is rendered `--count` times three ways: `str.format_map` on
+the template source (which re-parses it for every email, like building the
+HTML from scratch per call), the compiled template one call at a time, and
+the compiled template's `render_many` over the whole batch.
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from email_service import EMAIL_TEMPLATES, render_emails
+
+def rows_for(kind: str, count: int):
+    if kind == "verification":
+        return [{"email": f"user{index}@example.com", "verification_code": f"{index % 1000000:06d}"} for index in range(count)]
+    if kind == "order_confirmation":
+        return [{"email": f"user{index}@example.com", "order_id": f"{index:024x}", "total": index * 1.37} for index in range(count)]
+    if kind == "price_drop":
+        return [
+            {"email": f"user{index}@example.com", "product_name": f"Product {index % 500}",
+             "old_price": 100 + index % 400, "new_price": 80 + index % 400}
+            for index in range(count)
+        ]
+    raise ValueError(f"No sample rows for email kind {kind!r}")
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - started, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=100000)
+    args = parser.parse_args()
+
+    print(f"{args.count:,} emails per kind")
+    print(f"  {'kind':<20} {'method':<22} {'total':>9} {'per email':>10} {'emails/s':>11}")
+    for kind, (subject, html) in EMAIL_TEMPLATES.items():
+        rows = rows_for(kind, args.count)
+        source = html.source
+        methods = (
+            ("format_map per email", lambda: [source.format_map(row) for row in rows]),
+            ("compiled, per email", lambda: [html.render(**row) for row in rows]),
+            ("compiled, render_many", lambda: html.render_many(rows)),
+            ("subject + html batch", lambda: render_emails(kind, rows)),
+        )
+        for label, fn in methods:
+            seconds, rendered = timed(fn)
+            assert len(rendered) == args.count
+            print(f"  {kind:<20} {label:<22} {seconds * 1000:>7.0f}ms {seconds / args.count * 1e6:>8.2f}us {args.count / seconds:>11,.0f}")
+
+if __name__ == "__main__":
+    main()
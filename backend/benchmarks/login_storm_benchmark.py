@@ -0,0 +1,96 @@
+"""Benchmark catalog latency while a burst of logins runs bcrypt.
+
+Usage:
+    python benchmarks/login_storm_benchmark.py [--seconds 3] [--logins 32] [--products 10000]
+
+A steady stream of catalog listings (answered by the in-memory catalog
+engine, so Mongo is out of the picture) is timed from the moment each request
+was due, which captures time spent waiting for a blocked event loop. The same
+stream runs three times: alone, next to `--logins` concurrent clients hashing
+passwords inline on the event loop, and next to the same clients going through
+the bounded password pool.
+"""
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from auth import pwd_context
+from catalog_engine import CatalogEngine
+from hashing import BoundedPool, PoolSaturated
+from pagination import build_sort
+
+from catalog_engine_benchmark import summarize, synthesize
+
+# One catalog request every this many seconds
+REQUEST_INTERVAL = 0.005
+
+async def catalog_stream(engine: CatalogEngine, seconds: float):
+    """Issue listings on a fixed schedule and return each one's latency"""
+    loop = asyncio.get_running_loop()
+    samples = []
+    started = loop.time()
+    due = started
+    while due - started < seconds:
+        await asyncio.sleep(max(0.0, due - loop.time()))
+        engine.query({"category": "sneakers"}, build_sort("price-low"), 0, 20)
+        samples.append(loop.time() - due)
+        due += REQUEST_INTERVAL
+    return samples
+
+async def login_storm(clients: int, seconds: float, password_hash: str, pool=None):
+    """Run `clients` login loops until the deadline; return (verified, rejected)"""
+    deadline = time.monotonic() + seconds
+    counts = {"verified": 0, "rejected": 0}
+
+    async def client():
+        while time.monotonic() < deadline:
+            if pool is None:
+                pwd_context.verify("correct horse", password_hash)
+                await asyncio.sleep(0)
+            else:
+                try:
+                    await pool.run(pwd_context.verify, "correct horse", password_hash)
+                except PoolSaturated as e:
+                    counts["rejected"] += 1
+                    await asyncio.sleep(min(e.retry_after, 0.05))
+                    continue
+            counts["verified"] += 1
+
+    await asyncio.gather(*(client() for _ in range(clients)))
+    return counts["verified"], counts["rejected"]
+
+async def run_phase(engine: CatalogEngine, seconds: float, clients: int, password_hash: str, mode: str):
+    if mode == "idle":
+        samples = await catalog_stream(engine, seconds)
+        return samples, (0, 0)
+    pool = BoundedPool("bench-bcrypt") if mode == "pool" else None
+    samples, logins = await asyncio.gather(
+        catalog_stream(engine, seconds),
+        login_storm(clients, seconds, password_hash, pool)
+    )
+    return samples, logins
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--logins", type=int, default=32, help="concurrent login clients")
+    parser.add_argument("--products", type=int, default=10000)
+    args = parser.parse_args()
+
+    engine = CatalogEngine()
+    engine.load([{**product, "id": str(product["_id"])} for product in synthesize(args.products)])
+    password_hash = pwd_context.hash("correct horse")
+
+    print(f"{args.products:,} products, {args.logins} login clients, {args.seconds:.0f}s per phase")
+    print(f"  {'phase':<22} {'catalog p50':>12} {'catalog p99':>12} {'requests':>9} {'logins':>7} {'503s':>6}")
+    for label, mode in (("no logins", "idle"), ("bcrypt on event loop", "inline"), ("bcrypt on pool", "pool")):
+        samples, (verified, rejected) = asyncio.run(run_phase(engine, args.seconds, args.logins, password_hash, mode))
+        p50, p99 = summarize(samples)
+        print(f"  {label:<22} {p50:>10.2f}ms {p99:>10.2f}ms {len(samples):>9} {verified:>7} {rejected:>6}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Benchmark the in-memory search engine against the Mongo `$text` path.
+
+Usage:
+    python benchmarks/search_engine_benchmark.py [--sizes 10000,100000] [--mongo]
+
+Without --mongo only the engine's own ranking (`SearchEngine.search`) is timed.
+With --mongo, each synthetic catalog is also written to a scratch database
+(`<DB_NAME>_bench`, dropped afterwards) on MONGO_URL with the same text index
+`create_indexes` builds, and three ways of serving a 20-product search page
+are timed:
+
+- `$text`: a `$text` search sorted by text score, what runs without the engine
+- `shipped`: the listing query the API runs with SEARCH_ENGINE=memory, paged
+  inside the engine and fetched from Mongo by ID
+- `+category`: the same with a category filter, which sends every hit to
+  Mongo as an `$in` list ranked with `$indexOfArray`
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import catalog
+import database
+from catalog_engine_benchmark import CATEGORIES, summarize, synthesize
+from search_engine import SearchEngine, search_engine
+
+QUERIES = ["gold sneakers", "porcelain tea set", "vintage crystal", "premium leathr", "urban runner black"]
+
+DESCRIPTION_WORDS = (
+    "premium leather sneakers gold accents comfort handcrafted porcelain tea set crystal teacups "
+    "vintage ceramic cups dinner plates bone china serving tray bamboo matte runner urban court classic"
+).split()
+
+def with_descriptions(products, seed: int = 7):
+    """Give synthetic products varied descriptions so ranking has work to do"""
+    rng = random.Random(seed)
+    for product in products:
+        product["description"] = " ".join(rng.choices(DESCRIPTION_WORDS, k=rng.randint(8, 20)))
+    return products
+
+def bench_engine(products, repeats: int):
+    engine = SearchEngine()
+    documents = [{**product, "id": str(product["_id"])} for product in products]
+    started = time.perf_counter()
+    engine.load(documents)
+    load_ms = (time.perf_counter() - started) * 1000
+
+    results = {}
+    for query in QUERIES:
+        samples = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            engine.search(query, limit=20)
+            samples.append(time.perf_counter() - started)
+        results[query] = summarize(samples)
+    return load_ms, results
+
+async def time_async(fn, repeats: int):
+    samples = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        await fn()
+        samples.append(time.perf_counter() - started)
+    return summarize(samples)
+
+async def bench_mongo(products, repeats: int):
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    bench_database = client[f"{os.environ.get('DB_NAME', 'luxuryline_db')}_bench"]
+    collection = bench_database.products
+    await collection.drop()
+    for start in range(0, len(products), 10000):
+        await collection.insert_many(products[start:start + 10000], ordered=False)
+    await collection.create_index([("name", "text"), ("description", "text")])
+
+    # The listing query reads through the `database` module and the global engine
+    database.db.client, database.db.database = client, bench_database
+    search_engine.load([{**product, "id": str(product["_id"])} for product in products])
+
+    def text_search(query):
+        cursor = collection.find({"$text": {"$search": query}}, {"score": {"$meta": "textScore"}})
+        return cursor.sort([("score", {"$meta": "textScore"})]).limit(20).to_list(length=None)
+
+    def shipped(query, **filters):
+        return catalog._query_listing(
+            {"$text": {"$search": query}, **filters}, catalog.RELEVANCE_SORT, 0, 20,
+            include_facets=False, total_mode="exact", projection=None
+        )
+
+    results = {}
+    try:
+        for query in QUERIES:
+            results[query] = (
+                await time_async(lambda: text_search(query), repeats),
+                await time_async(lambda: shipped(query), repeats),
+                await time_async(lambda: shipped(query, category=CATEGORIES[0]), repeats)
+            )
+    finally:
+        await client.drop_database(bench_database.name)
+        client.close()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000")
+    parser.add_argument("--repeats", type=int, default=50)
+    parser.add_argument("--mongo", action="store_true", help="also time the Mongo $text and shipped listing paths")
+    args = parser.parse_args()
+
+    for size in (int(value) for value in args.sizes.split(",")):
+        products = with_descriptions(synthesize(size))
+        load_ms, engine_results = bench_engine(products, args.repeats)
+        mongo_results = asyncio.run(bench_mongo(products, max(args.repeats // 5, 3))) if args.mongo else {}
+
+        print(f"\n{size:,} products (index build {load_ms:,.0f}ms), p50 / p99")
+        print(f"  {'query':<22} {'engine only':>19} {'$text':>19} {'shipped':>19} {'+category':>19}")
+        for query in QUERIES:
+            columns = [engine_results[query], *mongo_results.get(query, ())]
+            cells = [f"{p50:>7.2f} / {p99:>6.2f}ms" for p50, p99 in columns]
+            cells += [f"{'-':>19}"] * (4 - len(cells))
+            print(f"  {query:<22} {' '.join(cells)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Benchmark flash-sale checkouts racing for a hot product, and check for oversells.
+
+Usage:
+    python benchmarks/stock_reservation_benchmark.py [--checkouts 5000] [--stock 500] [--shards 16]
+
+Needs a MongoDB server (MONGO_URL, default mongodb://localhost:27017). It
+works in a throwaway `stock_reservation_benchmark` database, which is dropped
+afterwards. `--checkouts` concurrent checkouts each try to reserve one or two
+units of a hot product, plus one unit of a plentiful one, through
+`InventoryService.reserve`. This runs twice: with the hot product's stock in
+its own document, and split over `--shards` counters. Each run verifies that
+units reserved + units left == starting stock, that no counter went
+negative, and that every successful checkout holds exactly one reservation.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import database
+from catalog import invalidate_all_products
+from inventory import SHARDS_COLLECTION, InsufficientStock, InventoryService
+
+from catalog_engine_benchmark import summarize
+
+DATABASE_NAME = "stock_reservation_benchmark"
+
+async def setup(stock: int, shards: int, service: InventoryService):
+    """Fresh hot and plentiful products; returns their IDs"""
+    await database.db.database.products.drop()
+    await database.db.database[SHARDS_COLLECTION].drop()
+    await database.db.database.stock_reservations.drop()
+    hot = await database.insert_one("products", {"name": "Hot drop", "price": 500.0, "stock_quantity": stock})
+    plenty = await database.insert_one("products", {"name": "Socks", "price": 20.0, "stock_quantity": 10 ** 9})
+    if shards:
+        await service.shard_product(hot, shards)
+    invalidate_all_products()
+    return hot, plenty
+
+async def checkout(service: InventoryService, index: int, hot: str, plenty: str, latencies: list):
+    quantity = random.choice((1, 1, 1, 2))
+    started = time.perf_counter()
+    try:
+        await service.reserve(f"user-{index}", [
+            {"product_id": hot, "quantity": quantity},
+            {"product_id": plenty, "quantity": 1}
+        ])
+        return quantity
+    except InsufficientStock:
+        return 0
+    finally:
+        latencies.append(time.perf_counter() - started)
+
+async def run_scenario(label: str, checkouts: int, stock: int, shards: int):
+    service = InventoryService()
+    hot, plenty = await setup(stock, shards, service)
+    latencies = []
+
+    started = time.perf_counter()
+    reserved = await asyncio.gather(*(checkout(service, index, hot, plenty, latencies) for index in range(checkouts)))
+    elapsed = time.perf_counter() - started
+
+    units = sum(reserved)
+    left = await service.available(hot)
+    counters = [
+        doc["stock"] async for doc in database.db.database[SHARDS_COLLECTION].find({"product_id": hot})
+    ] or [left]
+    plenty_left = await service.available(plenty)
+    held = await database.db.database.stock_reservations.count_documents({"status": "held"})
+    winners = sum(1 for quantity in reserved if quantity)
+
+    assert units + left == stock, f"{label}: reserved {units} + left {left} != stock {stock}"
+    assert min(counters) >= 0, f"{label}: a stock counter went negative: {counters}"
+    assert plenty_left == 10 ** 9 - winners, f"{label}: plentiful product stock out of step with reservations"
+    assert held == winners, f"{label}: {held} reservations held for {winners} successful checkouts"
+
+    p50, p99 = summarize(latencies)
+    print(f"  {label:<14} {checkouts / elapsed:>8,.0f} checkouts/s   p50 {p50:7.1f}ms   p99 {p99:7.1f}ms")
+    print(f"  {'':<14} {winners:,} checkouts reserved {units:,} of {stock:,} units, {left:,} left, "
+          f"{service.counters['shard_retries']:,} shard retries, oversold: 0")
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--checkouts", type=int, default=5000)
+    parser.add_argument("--stock", type=int, default=500)
+    parser.add_argument("--shards", type=int, default=16)
+    args = parser.parse_args()
+
+    database.db.client = AsyncIOMotorClient(os.getenv("MONGO_URL", "mongodb://localhost:27017"), maxPoolSize=200)
+    database.db.database = database.db.client[DATABASE_NAME]
+    try:
+        print(f"{args.checkouts:,} concurrent checkouts for {args.stock:,} units")
+        await run_scenario("single doc", args.checkouts, args.stock, 0)
+        await run_scenario(f"{args.shards} shards", args.checkouts, args.stock, args.shards)
+    finally:
+        await database.db.client.drop_database(DATABASE_NAME)
+        database.db.client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,251 @@
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+class TTLCache:
+    """Size-bounded LRU cache whose entries expire after a fixed TTL"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return a fresh cached value, or `default` if missing or expired"""
+        entry = self._entries.get(key, _MISSING)
+        if entry is _MISSING:
+            self.counters["misses"] += 1
+            return default
+
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.counters["misses"] += 1
+            return default
+
+        self._entries.move_to_end(key)
+        self.counters["hits"] += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Store a value, evicting the least recently used entry when full"""
+        self._entries[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    def invalidate(self, key: Hashable) -> bool:
+        """Drop a single entry"""
+        return self._entries.pop(key, _MISSING) is not _MISSING
+
+    def invalidate_where(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Drop every entry whose key matches `predicate`; a scan, so for small caches"""
+        keys = [key for key in self._entries if predicate(key)]
+        for key in keys:
+            del self._entries[key]
+        return len(keys)
+
+    def clear(self):
+        """Drop every entry"""
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters plus current size and hit rate"""
+        lookups = self.counters["hits"] + self.counters["misses"]
+        return {
+            **self.counters,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hit_rate": round(self.counters["hits"] / lookups, 4) if lookups else 0.0
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+class InflightVersions:
+    """Write counters for keys whose cache fill is still running
+
+    A fill calls `start(key)` before loading and caches its result only if
+    `finish(key, version)` reports that no `bump(key)` (a write) happened in
+    between. Counters exist only while a fill for the key is in flight, so
+    memory is bounded by concurrent fills rather than by every key ever
+    written. `finish` must run even when the load fails.
+    """
+
+    def __init__(self):
+        # key -> [fills in flight, writes seen while they ran]
+        self._entries: Dict[Hashable, List[int]] = {}
+
+    def start(self, key: Hashable) -> int:
+        """Register a fill; returns the version to hand to `finish`"""
+        entry = self._entries.setdefault(key, [0, 0])
+        entry[0] += 1
+        return entry[1]
+
+    def bump(self, key: Hashable):
+        """Record a write, spoiling any fill of the key now in flight"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry[1] += 1
+
+    def finish(self, key: Hashable, version: int) -> bool:
+        """End a fill; True if no write happened since its `start`"""
+        entry = self._entries[key]
+        entry[0] -= 1
+        if entry[0] == 0:
+            del self._entries[key]
+        return entry[1] == version
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+class ReadThroughCache:
+    """Async read-through LRU cache with TTL and stale-while-revalidate
+
+    Entries are fresh for `ttl` seconds. Until `stale_ttl` they are still served
+    immediately while a background task reloads them. Past that the loader is
+    awaited; if it fails or exceeds `load_timeout`, a value no older than
+    `max_stale` is served instead of failing the caller.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        ttl: float = 30.0,
+        stale_ttl: float = 300.0,
+        max_stale: float = 3600.0,
+        load_timeout: float = 1.0
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_stale = max_stale
+        self.load_timeout = load_timeout
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._refreshing: Dict[Hashable, asyncio.Task] = {}
+        # Bumped by every invalidation so loads that started earlier are discarded
+        self._generation = 0
+        self.counters = {
+            "hits": 0,
+            "stale_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "invalidations": 0,
+            "refreshes": 0,
+            "load_errors": 0,
+            "stale_on_error": 0
+        }
+
+    async def get(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """Return the cached value for `key`, loading it through `loader` when needed"""
+        entry = self._entries.get(key)
+        now = time.monotonic()
+
+        if entry is not None:
+            value, loaded_at = entry
+            age = now - loaded_at
+            self._entries.move_to_end(key)
+            if age < self.ttl:
+                self.counters["hits"] += 1
+                return value
+            if age < self.stale_ttl:
+                self.counters["stale_hits"] += 1
+                self._schedule_refresh(key, loader)
+                return value
+
+        self.counters["misses"] += 1
+        generation = self._generation
+        fallback = entry is not None and now - entry[1] < self.max_stale
+        try:
+            if fallback:
+                value = await asyncio.wait_for(loader(), timeout=self.load_timeout)
+            else:
+                value = await loader()
+        except Exception as e:
+            self.counters["load_errors"] += 1
+            if fallback:
+                logger.warning(f"Serving stale cache entry for {key!r}: {e!r}")
+                self.counters["stale_on_error"] += 1
+                return entry[0]
+            raise
+
+        if generation == self._generation:
+            self.set(key, value)
+        return value
+
+    def peek(self, key: Hashable) -> Any:
+        """Return the value for `key` if it is fresh, else None, without loading it"""
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() - entry[1] >= self.ttl:
+            self.counters["misses"] += 1
+            return None
+        self._entries.move_to_end(key)
+        self.counters["hits"] += 1
+        return entry[0]
+
+    @property
+    def generation(self) -> int:
+        """Changes on every invalidation; compare before and after a bulk load"""
+        return self._generation
+
+    def set(self, key: Hashable, value: Any):
+        """Store a freshly loaded value; `None` (not found) is never cached"""
+        if value is None:
+            self._entries.pop(key, None)
+            return
+        self._entries[key] = (value, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    def invalidate(self, key: Hashable) -> bool:
+        """Drop a single entry so the next read goes to the loader"""
+        self._generation += 1
+        self.counters["invalidations"] += 1
+        return self._entries.pop(key, None) is not None
+
+    def clear(self):
+        """Drop every entry"""
+        self._generation += 1
+        self.counters["invalidations"] += len(self._entries)
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters plus current size and hit rate"""
+        lookups = self.counters["hits"] + self.counters["stale_hits"] + self.counters["misses"]
+        served = self.counters["hits"] + self.counters["stale_hits"]
+        return {
+            **self.counters,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hit_rate": round(served / lookups, 4) if lookups else 0.0
+        }
+
+    def _schedule_refresh(self, key: Hashable, loader: Callable[[], Awaitable[Any]]):
+        """Reload an entry in the background, at most once at a time per key"""
+        if key in self._refreshing:
+            return
+        self._refreshing[key] = asyncio.get_running_loop().create_task(self._refresh(key, loader))
+
+    async def _refresh(self, key: Hashable, loader: Callable[[], Awaitable[Any]]):
+        generation = self._generation
+        try:
+            value = await asyncio.wait_for(loader(), timeout=self.load_timeout)
+            # An invalidation during the reload already dropped the entry; don't resurrect it
+            if generation == self._generation:
+                self.set(key, value)
+            self.counters["refreshes"] += 1
+        except Exception as e:
+            self.counters["load_errors"] += 1
+            logger.warning(f"Background refresh failed for {key!r}: {e!r}")
+        finally:
+            self._refreshing.pop(key, None)
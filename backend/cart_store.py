@@ -0,0 +1,402 @@
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import argparse
+import asyncio
+import logging
+import os
+
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from cache import InflightVersions, TTLCache
+from catalog import CART_PRODUCT_PROJECTION, get_products_by_ids
+from database import (
+    apply_update, decode_id, delete_many, delete_one, encode_id, find_many_by_ids, get_collection, lookup_by_id
+)
+
+logger = logging.getLogger(__name__)
+
+CARTS_COLLECTION = "carts"
+
+# Users written per bulk write during migration
+MIGRATION_BATCH = 500
+
+# A write through another worker can leave this process's summary stale for at most this long
+SUMMARY_TTL = 15.0
+
+def _line_identity(product_id: str, selected_size: Optional[str], selected_color: Optional[str]) -> Dict:
+    return {"product_id": product_id, "selected_size": selected_size, "selected_color": selected_color}
+
+def _snapshot(product: Dict) -> Dict:
+    """The product fields a cart line displays"""
+    images = product.get("images") or []
+    return {"name": product["name"], "price": product["price"], "image": images[0] if images else ""}
+
+class CartSummaries:
+    """Per-user item count and subtotal for the navbar badge
+
+    Summaries are cached per user and invalidated by every cart write made
+    through a store, so repeated polls are answered from memory. A summary
+    computed while a write was in flight is not cached, through the same
+    in-flight version check the principal cache uses.
+    """
+
+    def __init__(self, ttl: float = SUMMARY_TTL):
+        self.cache = TTLCache(maxsize=65536, ttl=ttl)
+        self._versions = InflightVersions()
+
+    def invalidate(self, user_id: str):
+        """Drop a user's summary; call after any change to their cart"""
+        self._versions.bump(user_id)
+        self.cache.invalidate(user_id)
+
+    async def get(self, user_id: str, store) -> Dict[str, Any]:
+        """The cached summary, or one computed by `store`"""
+        cached = self.cache.get(user_id)
+        if cached is not None:
+            return cached
+        version = self._versions.start(user_id)
+        try:
+            summary = await store.summarize(user_id)
+        finally:
+            unchanged = self._versions.finish(user_id, version)
+        if unchanged:
+            self.cache.set(user_id, summary)
+        return summary
+
+    def stats(self) -> Dict[str, Any]:
+        """Cache counters"""
+        return self.cache.stats()
+
+# Create summaries instance
+cart_summaries = CartSummaries()
+
+def _summary(quantities_and_prices) -> Dict[str, Any]:
+    total_items = 0
+    subtotal = 0.0
+    for quantity, price in quantities_and_prices:
+        total_items += quantity
+        subtotal += price * quantity
+    return {"total_items": total_items, "subtotal": subtotal}
+
+class ItemCartStore:
+    """Cart lines as separate `cart_items` documents, joined to products on read"""
+
+    async def lines(self, user_id: str) -> List[Dict]:
+        """The user's cart lines with current product details, newest first"""
+        pipeline = [
+            {"$match": {"user_id": user_id}},
+            lookup_by_id("products", "product_id", "product", CART_PRODUCT_PROJECTION),
+            {"$unwind": "$product"},
+            {"$sort": {"added_at": -1}}
+        ]
+        cart_items = await get_collection("cart_items").aggregate(pipeline).to_list(length=None)
+        return [
+            {
+                "id": encode_id(item["_id"]),
+                "product_id": encode_id(item["product"]["_id"]),
+                **_snapshot(item["product"]),
+                "quantity": item["quantity"],
+                "selected_size": item.get("selected_size"),
+                "selected_color": item.get("selected_color")
+            }
+            for item in cart_items
+        ]
+
+    async def checkout_lines(self, user_id: str) -> List[Dict]:
+        """Lines to price an order from; these are always current"""
+        return await self.lines(user_id)
+
+    async def summarize(self, user_id: str) -> Dict[str, Any]:
+        """Item count and subtotal from line quantities and cached product prices, without the join"""
+        cart_items = await get_collection("cart_items").find(
+            {"user_id": user_id}, {"_id": 0, "product_id": 1, "quantity": 1}
+        ).to_list(length=None)
+        prices = {
+            product["id"]: product["price"]
+            for product in await get_products_by_ids([item["product_id"] for item in cart_items], {"price": 1})
+        }
+        return _summary(
+            (item["quantity"], prices[item["product_id"]]) for item in cart_items if item["product_id"] in prices
+        )
+
+    async def add(self, user_id: str, product: Dict, quantity: int, selected_size: Optional[str], selected_color: Optional[str]):
+        """Add to the matching cart line, creating it if needed, in one write"""
+        now = datetime.utcnow()
+        line = {"user_id": user_id, **_line_identity(product["id"], selected_size, selected_color)}
+        update = {"$inc": {"quantity": quantity}, "$set": {"updated_at": now}, "$setOnInsert": {"added_at": now}}
+        try:
+            await apply_update("cart_items", line, update, upsert=True)
+        except DuplicateKeyError:
+            # A concurrent add created the line first; add to it instead
+            await apply_update("cart_items", line, update)
+        cart_summaries.invalidate(user_id)
+
+    async def merge(self, user_id: str, entries: List[Dict]) -> int:
+        """Add `{product, quantity, selected_size, selected_color}` entries in one bulk write"""
+        if not entries:
+            return 0
+        now = datetime.utcnow()
+
+        def add_line(entry: Dict, upsert: bool) -> UpdateOne:
+            return UpdateOne(
+                {"user_id": user_id, **_line_identity(entry["product"]["id"], entry["selected_size"], entry["selected_color"])},
+                {"$inc": {"quantity": entry["quantity"]}, "$set": {"updated_at": now}, "$setOnInsert": {"added_at": now}},
+                upsert=upsert
+            )
+
+        collection = get_collection("cart_items")
+        try:
+            await collection.bulk_write([add_line(entry, True) for entry in entries], ordered=False)
+        except BulkWriteError as e:
+            # Lines created concurrently make their upsert fail; add to them instead
+            errors = e.details.get("writeErrors", [])
+            if any(error["code"] != 11000 for error in errors):
+                raise
+            await collection.bulk_write([add_line(entries[error["index"]], False) for error in errors], ordered=False)
+        cart_summaries.invalidate(user_id)
+        return len(entries)
+
+    async def set_quantity(self, user_id: str, line_id: str, quantity: int) -> bool:
+        """Set a line's quantity; False if the user has no such line"""
+        result = await apply_update(
+            "cart_items",
+            {"_id": decode_id(line_id), "user_id": user_id},
+            {"$set": {"quantity": quantity, "updated_at": datetime.utcnow()}}
+        )
+        cart_summaries.invalidate(user_id)
+        return result.matched_count > 0
+
+    async def remove(self, user_id: str, line_id: str) -> bool:
+        """Remove a line; False if the user has no such line"""
+        removed = await delete_one("cart_items", {"_id": decode_id(line_id), "user_id": user_id})
+        cart_summaries.invalidate(user_id)
+        return removed
+
+    async def clear(self, user_id: str) -> int:
+        """Remove every line and return how many there were"""
+        deleted = await delete_many("cart_items", {"user_id": user_id})
+        cart_summaries.invalidate(user_id)
+        return deleted
+
+class EmbeddedCartStore:
+    """One `carts` document per user, keyed by user ID, with the lines embedded
+
+    Each line carries a snapshot of the product's name, price and image taken
+    when it was last added to, so showing the cart is a single primary-key
+    read. Mutations are positional array updates on that one document.
+    Snapshots can fall behind the catalog, so checkout re-reads the products
+    (from the product cache) before pricing an order.
+    """
+
+    async def lines(self, user_id: str) -> List[Dict]:
+        """The user's cart lines as last snapshotted, newest first"""
+        cart = await get_collection(CARTS_COLLECTION).find_one({"_id": user_id}, {"lines": 1})
+        lines = [{key: value for key, value in line.items() if key != "added_at"} for line in (cart or {}).get("lines", [])]
+        lines.reverse()
+        return lines
+
+    async def checkout_lines(self, user_id: str) -> List[Dict]:
+        """Lines with current product details; lines for deleted products are dropped"""
+        lines = await self.lines(user_id)
+        products = {
+            product["id"]: product
+            for product in await get_products_by_ids([line["product_id"] for line in lines], {"name": 1, "price": 1, "images": 1})
+        }
+        return [{**line, **_snapshot(products[line["product_id"]])} for line in lines if line["product_id"] in products]
+
+    async def summarize(self, user_id: str) -> Dict[str, Any]:
+        """Item count and subtotal from the line snapshots"""
+        cart = await get_collection(CARTS_COLLECTION).find_one(
+            {"_id": user_id}, {"lines.quantity": 1, "lines.price": 1}
+        )
+        return _summary((line["quantity"], line["price"]) for line in (cart or {}).get("lines", []))
+
+    async def add(self, user_id: str, product: Dict, quantity: int, selected_size: Optional[str], selected_color: Optional[str]):
+        """Add to the matching line, or push a new one, without reading the cart first"""
+        identity = _line_identity(product["id"], selected_size, selected_color)
+        snapshot = _snapshot(product)
+        while True:
+            now = datetime.utcnow()
+            result = await apply_update(
+                CARTS_COLLECTION,
+                {"_id": user_id, "lines": {"$elemMatch": identity}},
+                {
+                    "$inc": {"lines.$.quantity": quantity},
+                    "$set": {**{f"lines.$.{key}": value for key, value in snapshot.items()}, "updated_at": now}
+                }
+            )
+            if result.matched_count:
+                break
+            try:
+                # Only matches while the line is still absent; a cart that doesn't exist yet is created
+                await apply_update(
+                    CARTS_COLLECTION,
+                    {"_id": user_id, "lines": {"$not": {"$elemMatch": identity}}},
+                    {
+                        "$push": {"lines": {
+                            "id": encode_id(ObjectId()), **identity, **snapshot, "quantity": quantity, "added_at": now
+                        }},
+                        "$set": {"updated_at": now}
+                    },
+                    upsert=True
+                )
+                break
+            except DuplicateKeyError:
+                # The line was added concurrently, so the cart exists; increment it instead
+                continue
+        cart_summaries.invalidate(user_id)
+
+    async def merge(self, user_id: str, entries: List[Dict]) -> int:
+        """Add `{product, quantity, selected_size, selected_color}` entries in one ordered bulk write
+
+        The cart is created if needed, then each entry pushes an empty line
+        only if it's absent and increments the line, which by then exists
+        whoever pushed it.
+        """
+        if not entries:
+            return 0
+        now = datetime.utcnow()
+        operations = [UpdateOne({"_id": user_id}, {"$setOnInsert": {"lines": []}}, upsert=True)]
+        for entry in entries:
+            identity = _line_identity(entry["product"]["id"], entry["selected_size"], entry["selected_color"])
+            snapshot = _snapshot(entry["product"])
+            operations.append(UpdateOne(
+                {"_id": user_id, "lines": {"$not": {"$elemMatch": identity}}},
+                {"$push": {"lines": {"id": encode_id(ObjectId()), **identity, **snapshot, "quantity": 0, "added_at": now}}}
+            ))
+            operations.append(UpdateOne(
+                {"_id": user_id, "lines": {"$elemMatch": identity}},
+                {
+                    "$inc": {"lines.$.quantity": entry["quantity"]},
+                    "$set": {**{f"lines.$.{key}": value for key, value in snapshot.items()}, "updated_at": now}
+                }
+            ))
+        await get_collection(CARTS_COLLECTION).bulk_write(operations, ordered=True)
+        cart_summaries.invalidate(user_id)
+        return len(entries)
+
+    async def set_quantity(self, user_id: str, line_id: str, quantity: int) -> bool:
+        """Set a line's quantity; False if the user has no such line"""
+        result = await apply_update(
+            CARTS_COLLECTION,
+            {"_id": user_id, "lines.id": line_id},
+            {"$set": {"lines.$.quantity": quantity, "updated_at": datetime.utcnow()}}
+        )
+        cart_summaries.invalidate(user_id)
+        return result.matched_count > 0
+
+    async def remove(self, user_id: str, line_id: str) -> bool:
+        """Remove a line; False if the user has no such line"""
+        result = await apply_update(
+            CARTS_COLLECTION,
+            {"_id": user_id, "lines.id": line_id},
+            {"$pull": {"lines": {"id": line_id}}, "$set": {"updated_at": datetime.utcnow()}}
+        )
+        cart_summaries.invalidate(user_id)
+        return result.matched_count > 0
+
+    async def clear(self, user_id: str) -> int:
+        """Empty the cart and return how many lines it had"""
+        cart = await get_collection(CARTS_COLLECTION).find_one_and_update(
+            {"_id": user_id}, {"$set": {"lines": [], "updated_at": datetime.utcnow()}}, projection={"lines": 1}
+        )
+        cart_summaries.invalidate(user_id)
+        return len(cart.get("lines", [])) if cart else 0
+
+# Create store instances
+item_cart_store = ItemCartStore()
+embedded_cart_store = EmbeddedCartStore()
+
+def get_cart_store():
+    """The store selected by CART_STORAGE: `items` (default) or `embedded`"""
+    if os.getenv("CART_STORAGE", "items") == "embedded":
+        return embedded_cart_store
+    return item_cart_store
+
+async def get_cart_summary(user_id: str) -> Dict[str, Any]:
+    """A user's cart item count and subtotal, cached until their cart changes"""
+    return await cart_summaries.get(user_id, get_cart_store())
+
+def _migrated_lines(items: List[Dict], products: Dict[str, Dict]) -> List[Dict]:
+    """Embedded lines for one user's `cart_items`, oldest first, folding repeated identities"""
+    lines: Dict[tuple, Dict] = {}
+    for item in items:
+        product = products.get(item["product_id"])
+        if product is None:
+            continue
+        identity = _line_identity(item["product_id"], item.get("selected_size"), item.get("selected_color"))
+        key = tuple(identity.values())
+        if key in lines:
+            lines[key]["quantity"] += item["quantity"]
+            continue
+        lines[key] = {
+            "id": encode_id(item["_id"]),
+            **identity,
+            **_snapshot(product),
+            "quantity": item["quantity"],
+            "added_at": item.get("added_at") or datetime.utcnow()
+        }
+    return list(lines.values())
+
+async def migrate_cart_items() -> int:
+    """Copy `cart_items` into embedded `carts` documents; returns how many carts were created
+
+    Lines are read in user order and handled MIGRATION_BATCH users at a time:
+    one query for the batch's products, then one bulk write of a `$setOnInsert`
+    upsert per cart. Lines for deleted products are dropped. Users who already
+    have a `carts` document are left alone, so the migration can be re-run
+    safely. `cart_items` is not modified, which keeps switching CART_STORAGE
+    back an option.
+    """
+    cursor = get_collection("cart_items").find({}).sort([("user_id", 1), ("added_at", 1)])
+    created = 0
+    batch: Dict[str, List[Dict]] = {}
+
+    async def flush():
+        nonlocal created
+        product_ids = {item["product_id"] for items in batch.values() for item in items}
+        products = {
+            product["id"]: product
+            for product in await find_many_by_ids("products", product_ids, {"name": 1, "price": 1, "images": 1})
+        }
+        now = datetime.utcnow()
+        operations = []
+        for user_id, items in batch.items():
+            lines = _migrated_lines(items, products)
+            if lines:
+                operations.append(UpdateOne({"_id": user_id}, {"$setOnInsert": {"lines": lines, "updated_at": now}}, upsert=True))
+        if operations:
+            result = await get_collection(CARTS_COLLECTION).bulk_write(operations, ordered=False)
+            created += result.upserted_count
+        batch.clear()
+
+    async for item in cursor:
+        if item["user_id"] not in batch and len(batch) >= MIGRATION_BATCH:
+            await flush()
+        batch.setdefault(item["user_id"], []).append(item)
+    if batch:
+        await flush()
+    return created
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from database import close_mongo_connection, connect_to_mongo
+
+    parser = argparse.ArgumentParser(description="Cart storage maintenance")
+    parser.add_argument("command", choices=["migrate"], help="migrate: copy cart_items into embedded carts")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv(Path(__file__).parent / '.env')
+
+    async def main():
+        await connect_to_mongo()
+        try:
+            logger.info(f"Created {await migrate_cart_items()} embedded carts")
+        finally:
+            await close_mongo_connection()
+
+    asyncio.run(main())
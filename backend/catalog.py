@@ -0,0 +1,438 @@
+from typing import Dict, List, Optional
+import asyncio
+import logging
+import os
+
+from bson import json_util
+
+from cache import ReadThroughCache, TTLCache
+from catalog_engine import catalog_engine
+from search_engine import search_engine
+from suggestions import suggest_index
+from database import (
+    aggregate, decode_id, decode_ids, estimated_document_count, find_many, find_many_by_ids, find_one,
+    serialize_document
+)
+from models import Product
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Every write to the products collection must be followed by `invalidate_product(product_id)`
+# (or `invalidate_all_products()` for bulk loads). That is what drops the product cache entry,
+# bumps the listing generation and refreshes the in-memory engines; a write that skips it is
+# served stale until the caches expire, and forever by the engines. Writes that only move
+# stock (checkout reservations, releases, sharding) call `invalidate_product_stock` instead,
+# which leaves the listing generation alone.
+
+# Most product IDs a single batch request may name
+MAX_BATCH_IDS = 50
+
+# Price buckets for the Shop sidebar; anything above the last boundary lands in "500+"
+PRICE_BUCKET_BOUNDARIES = [0, 100, 200, 300, 400, 500]
+PRICE_BUCKET_OVERFLOW = "500+"
+
+# Totals for listings served with total_mode="cached", keyed by the normalized filter
+listing_totals = TTLCache(maxsize=2048, ttl=60.0)
+
+# Listing pages and category counts, keyed by catalog generation plus the normalized query.
+# Product writes bump the generation, which orphans older entries until LRU/TTL drops them;
+# the TTL also bounds staleness for writes made by other worker processes.
+listing_cache = TTLCache(maxsize=1024, ttl=30.0)
+catalog_generation = 0
+
+# Identical catalog reads that arrive while one is already running share its result
+catalog_flights = SingleFlight()
+
+# Full product documents by ID for the single-product read paths
+product_cache = ReadThroughCache(maxsize=4096, ttl=30.0, stale_ttl=300.0, load_timeout=0.5)
+
+# Sort used for `sort_by=relevance` on searches; the Mongo fallback ranks by $text score
+RELEVANCE_SORT = {"score": {"$meta": "textScore"}, "_id": 1}
+
+# Fields a client may ask for through `fields=`; `id` is always returned
+PRODUCT_FIELDS = frozenset(Product.model_fields) - {"id"}
+
+# Product fields the cart and wishlist pages render, first image only
+CART_PRODUCT_PROJECTION = {"name": 1, "price": 1, "images": {"$slice": ["$images", 1]}}
+WISHLIST_PRODUCT_PROJECTION = {
+    **CART_PRODUCT_PROJECTION,
+    "original_price": 1,
+    "on_sale": 1,
+    "rating": 1,
+    "category": 1
+}
+
+class InvalidFields(ValueError):
+    """Raised when `fields=` names something that is not a product field"""
+
+def parse_fields(fields: Optional[str], required: tuple = ()) -> Optional[Dict]:
+    """Turn a comma-separated `fields=` value into a projection
+
+    Returns None (every field) when no fields were asked for. `required` names
+    fields the caller needs regardless, such as the active sort key.
+    """
+    if not fields:
+        return None
+
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    requested.discard("id")
+    unknown = requested - PRODUCT_FIELDS
+    if unknown:
+        raise InvalidFields(f"Unknown product fields: {', '.join(sorted(unknown))}")
+
+    return {field: 1 for field in sorted(requested.union(required))} or {"_id": 1}
+
+def normalize_filter(value):
+    """Canonicalize a filter so equivalent queries share a cache key
+
+    `$in` lists are order-insensitive, so they are deduplicated and sorted.
+    """
+    if isinstance(value, dict):
+        return {
+            key: sorted(set(item), key=str) if key == "$in" else normalize_filter(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [normalize_filter(item) for item in value]
+    return value
+
+def filter_key(filter_dict: Dict) -> str:
+    """Serialize a filter into a stable cache key"""
+    return json_util.dumps(normalize_filter(filter_dict), sort_keys=True)
+
+def bump_catalog_generation():
+    """Invalidate every cached listing and category count"""
+    global catalog_generation
+    catalog_generation += 1
+
+def build_listing_pipeline(
+    filter_dict: Dict,
+    sort_dict: Dict,
+    skip: int,
+    limit: int,
+    include_total: bool = True,
+    include_facets: bool = False,
+    projection: Optional[Dict] = None,
+    rank_ids: Optional[List] = None
+) -> List[Dict]:
+    """Build one $facet aggregation returning a page, its total and facet counts
+
+    `rank_ids` orders the matches by their position in that list (search
+    relevance from the in-memory engine) instead of by `sort_dict`.
+    """
+    facets: Dict[str, List[Dict]] = {
+        "items": [{"$skip": skip}, {"$limit": limit}]
+    }
+    if projection:
+        facets["items"].append({"$project": projection})
+    elif rank_ids is not None:
+        facets["items"].append({"$project": {"_rank": 0}})
+    if include_total:
+        facets["total"] = [{"$count": "count"}]
+    if include_facets:
+        for field in ("colors", "sizes", "materials"):
+            facets[field] = [
+                {"$unwind": f"${field}"},
+                {"$group": {"_id": f"${field}", "count": {"$sum": 1}}},
+                {"$sort": {"count": -1, "_id": 1}}
+            ]
+        facets["price_ranges"] = [
+            {"$bucket": {
+                "groupBy": "$price",
+                "boundaries": PRICE_BUCKET_BOUNDARIES,
+                "default": PRICE_BUCKET_OVERFLOW,
+                "output": {"count": {"$sum": 1}}
+            }}
+        ]
+
+    if rank_ids is not None:
+        return [
+            {"$match": filter_dict},
+            {"$addFields": {"_rank": {"$indexOfArray": [rank_ids, "$_id"]}}},
+            {"$sort": {"_rank": 1}},
+            {"$facet": facets}
+        ]
+
+    # Match and sort ahead of $facet so both can still use indexes
+    return [
+        {"$match": filter_dict},
+        {"$sort": sort_dict},
+        {"$facet": facets}
+    ]
+
+def _format_price_ranges(buckets: List[Dict]) -> List[Dict]:
+    """Turn $bucket output into {min, max, count} ranges"""
+    upper_bounds = dict(zip(PRICE_BUCKET_BOUNDARIES, PRICE_BUCKET_BOUNDARIES[1:]))
+    ranges = []
+    for bucket in buckets:
+        if bucket["_id"] == PRICE_BUCKET_OVERFLOW:
+            ranges.append({"min": PRICE_BUCKET_BOUNDARIES[-1], "max": None, "count": bucket["count"]})
+        else:
+            ranges.append({"min": bucket["_id"], "max": upper_bounds[bucket["_id"]], "count": bucket["count"]})
+    return ranges
+
+async def list_products(
+    filter_dict: Dict,
+    sort_dict: Dict,
+    skip: int,
+    limit: int,
+    include_facets: bool = False,
+    total_mode: str = "exact",
+    projection: Optional[Dict] = None
+) -> Dict:
+    """Fetch a page of products, the total and optional facets in one round trip
+
+    When the in-memory catalog engine is loaded and understands the filter it
+    answers directly. Otherwise results come from the listing cache while the
+    catalog generation is unchanged. With total_mode="cached" the total is
+    reused for a minute per filter, and an unfiltered listing is counted from
+    collection metadata.
+    """
+    if catalog_engine.ready and catalog_engine.supports(filter_dict, sort_dict):
+        result = catalog_engine.query(
+            filter_dict, sort_dict, skip, limit,
+            include_facets=include_facets,
+            price_boundaries=PRICE_BUCKET_BOUNDARIES,
+            price_overflow=PRICE_BUCKET_OVERFLOW
+        )
+        items = [project_document(doc, projection) for doc in result["items"]]
+        return _format_listing(result, items, result["total"][0]["count"], include_facets)
+
+    cache_key = (
+        "listing",
+        catalog_generation,
+        filter_key(filter_dict),
+        filter_key(sort_dict),
+        skip,
+        limit,
+        include_facets,
+        total_mode,
+        filter_key(projection or {})
+    )
+    listing = listing_cache.get(cache_key)
+    if listing is None:
+        listing = await catalog_flights.do(
+            cache_key,
+            lambda: _query_listing(filter_dict, sort_dict, skip, limit, include_facets, total_mode, projection)
+        )
+        listing_cache.set(cache_key, listing)
+    return listing
+
+async def seek_products(filter_dict: Dict, sort_dict: Dict, limit: int, projection: Optional[Dict] = None) -> List[Dict]:
+    """Fetch one keyset page, coalescing identical concurrent requests"""
+    flight_key = ("seek", filter_key(filter_dict), filter_key(sort_dict), limit, filter_key(projection or {}))
+    return await catalog_flights.do(
+        flight_key,
+        lambda: find_many("products", filter_dict, sort_dict, 0, limit, projection)
+    )
+
+async def _query_listing(
+    filter_dict: Dict,
+    sort_dict: Dict,
+    skip: int,
+    limit: int,
+    include_facets: bool,
+    total_mode: str,
+    projection: Optional[Dict]
+) -> Dict:
+    """Run the listing aggregation against Mongo
+
+    With the in-memory search engine loaded, `$text` is swapped for the
+    engine's hits. A plain relevance-ordered search is paged inside the engine,
+    which also knows the exact total, so Mongo only fetches that page. When
+    other filters, another sort or facets are involved, every hit goes to Mongo
+    as an `$in` list, so filtered matches ranked low are still found and the
+    total stays exact.
+    """
+    key = (catalog_generation, filter_key(filter_dict))
+    rank_ids = None
+    total: Optional[int] = None
+    search_text = (filter_dict.get("$text") or {}).get("$search")
+    if search_text and search_engine.ready:
+        ranked = search_engine.search(search_text)
+        filter_dict = {field: value for field, value in filter_dict.items() if field != "$text"}
+        if not filter_dict and "score" in sort_dict and not include_facets:
+            rank_ids = decode_ids(product_id for product_id, _ in ranked[skip:skip + limit])
+            filter_dict = {"_id": {"$in": rank_ids}}
+            total = len(ranked)
+            skip = 0
+        else:
+            candidate_ids = decode_ids(product_id for product_id, _ in ranked)
+            filter_dict["_id"] = {"$in": candidate_ids}
+            if "score" in sort_dict:
+                rank_ids = candidate_ids
+
+    if total is None and total_mode == "cached":
+        total = listing_totals.get(key)
+        if total is None and not filter_dict:
+            total = await estimated_document_count("products")
+            listing_totals.set(key, total)
+
+    pipeline = build_listing_pipeline(
+        filter_dict, sort_dict, skip, limit,
+        include_total=total is None,
+        include_facets=include_facets,
+        projection=projection,
+        rank_ids=rank_ids
+    )
+    results = await aggregate("products", pipeline)
+    result = results[0] if results else {}
+
+    if total is None:
+        counted = result.get("total") or []
+        total = counted[0]["count"] if counted else 0
+        if total_mode == "cached":
+            listing_totals.set(key, total)
+
+    items = [serialize_document(doc) for doc in result.get("items", [])]
+    return _format_listing(result, items, total, include_facets)
+
+def _format_listing(result: Dict, items: List[Dict], total: int, include_facets: bool) -> Dict:
+    """Shape a `$facet`-style result into the listing returned to the API"""
+    listing = {
+        "products": items,
+        "total": total
+    }
+    if include_facets:
+        listing["facets"] = {
+            field: [{"value": entry["_id"], "count": entry["count"]} for entry in result.get(field, [])]
+            for field in ("colors", "sizes", "materials")
+        }
+        listing["facets"]["price_ranges"] = _format_price_ranges(result.get("price_ranges", []))
+    return listing
+
+def project_document(document: Dict, projection: Optional[Dict]) -> Dict:
+    """Apply an inclusion projection from `parse_fields` to a cached document"""
+    if not projection:
+        return dict(document)
+    projected = {field: document[field] for field in projection if field in document}
+    projected["id"] = document["id"]
+    return projected
+
+async def get_product_by_id(product_id: str, projection: Optional[Dict] = None) -> Optional[Dict]:
+    """Fetch a product through the product cache; returns None if it does not exist"""
+    product = await product_cache.get(
+        product_id,
+        lambda: catalog_flights.do(("product", product_id), lambda: find_one("products", {"_id": decode_id(product_id)}))
+    )
+    if product is None:
+        return None
+    return project_document(product, projection)
+
+async def get_products_by_ids(product_ids: List[str], projection: Optional[Dict] = None) -> List[Dict]:
+    """Fetch several products in request order: fresh cache entries first, the rest in one query"""
+    product_ids = list(dict.fromkeys(product_ids))
+    products = {product_id: product_cache.peek(product_id) for product_id in product_ids}
+    missing = [product_id for product_id, product in products.items() if product is None]
+    if missing:
+        generation = product_cache.generation
+        for product in await find_many_by_ids("products", missing):
+            products[product["id"]] = product
+            # Skip caching if something was invalidated while the query ran
+            if generation == product_cache.generation:
+                product_cache.set(product["id"], product)
+    return [project_document(products[product_id], projection) for product_id in product_ids if products.get(product_id)]
+
+async def list_categories() -> List[Dict]:
+    """Get every category with its product count, cached per catalog generation"""
+    cache_key = ("categories", catalog_generation)
+    categories = listing_cache.get(cache_key)
+    if categories is None:
+        categories = await catalog_flights.do(cache_key, _query_categories)
+        listing_cache.set(cache_key, categories)
+    return categories
+
+async def _query_categories() -> List[Dict]:
+    """Group products by category in Mongo"""
+    pipeline = [
+        {"$group": {"_id": "$category", "count": {"$sum": 1}}},
+        {"$sort": {"_id": 1}}
+    ]
+    return [
+        {
+            "name": item["_id"].title(),
+            "slug": item["_id"],
+            "product_count": item["count"]
+        }
+        for item in await aggregate("products", pipeline)
+    ]
+
+def invalidate_product(product_id: str):
+    """Drop a product from every catalog cache after it has been written"""
+    product_cache.invalidate(product_id)
+    bump_catalog_generation()
+    if any(engine.ready for engine in PRODUCT_INDEXES):
+        _spawn(refresh_engine_product(product_id))
+
+def invalidate_product_stock(product_id: str):
+    """Drop a product's cached copy after a write that only changed its stock
+
+    Stock is never filtered, sorted or searched on, so listings keep their
+    generation and show stock at most one listing TTL old. That keeps a
+    flash sale's checkouts from emptying the listing cache. Only the catalog
+    engine, which serves whole documents, re-reads the product.
+    """
+    product_cache.invalidate(product_id)
+    if catalog_engine.ready:
+        _spawn(refresh_engine_product(product_id, (catalog_engine,)))
+
+def invalidate_all_products():
+    """Drop every cached product and listing, e.g. after a bulk load"""
+    product_cache.clear()
+    bump_catalog_generation()
+    if any(engine.ready for engine in PRODUCT_INDEXES):
+        _spawn(load_product_indexes())
+
+# ========================================
+# IN-MEMORY CATALOG AND SEARCH ENGINES
+# ========================================
+
+# Every in-process index kept in sync with the products collection
+PRODUCT_INDEXES = (catalog_engine, search_engine, suggest_index)
+
+_background_tasks = set()
+
+def _spawn(coroutine):
+    """Run a refresh in the background, keeping a reference until it finishes"""
+    task = asyncio.get_running_loop().create_task(coroutine)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+def _enabled_engines() -> list:
+    """The typeahead index, plus engines switched on through CATALOG_ENGINE / SEARCH_ENGINE=memory"""
+    engines = [suggest_index]
+    if catalog_engine.ready or os.getenv("CATALOG_ENGINE", "mongo") == "memory":
+        engines.append(catalog_engine)
+    if search_engine.ready or os.getenv("SEARCH_ENGINE", "mongo") == "memory":
+        engines.append(search_engine)
+    return engines
+
+async def load_product_indexes():
+    """(Re)load every product into the enabled in-memory engines"""
+    engines = _enabled_engines()
+    products = await find_many("products")
+    for engine in engines:
+        engine.load(products)
+
+async def refresh_engine_product(product_id: str, engines=PRODUCT_INDEXES):
+    """Re-read one product from Mongo into the in-memory engines"""
+    try:
+        product = await find_one("products", {"_id": decode_id(product_id)})
+        for engine in engines:
+            if not engine.ready:
+                continue
+            if product is None:
+                engine.remove(product_id)
+            else:
+                engine.upsert(product)
+    except Exception as e:
+        logger.error(f"Engine refresh failed for {product_id}: {e}")
+
+async def start_product_indexes():
+    """Load the enabled in-memory engines at startup"""
+    try:
+        await load_product_indexes()
+    except Exception as e:
+        # Listings and search keep working from Mongo; the engines just stay unused
+        logger.error(f"Error loading in-memory product indexes: {e}")
@@ -0,0 +1,365 @@
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+import logging
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FACET_FIELDS = ("category", "colors", "sizes", "materials")
+FLAG_FIELDS = ("on_sale", "featured")
+NUMERIC_FIELDS = ("price", "rating", "created_at")
+SORT_FIELDS = ("name",) + NUMERIC_FIELDS
+
+def _as_number(value: Any) -> float:
+    """Convert a sortable value to a float column entry, NaN when missing"""
+    if value is None:
+        return np.nan
+    if isinstance(value, datetime):
+        return value.timestamp()
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+def _as_values(value: Any) -> Iterable:
+    """Facet fields may hold a single value or a list of values"""
+    if value is None:
+        return ()
+    if isinstance(value, (list, tuple, set)):
+        return value
+    return (value,)
+
+class CatalogEngine:
+    """In-process product index answering catalog listings without Mongo
+
+    Rows are held in a columnar, array-backed store: one boolean bitmap per
+    facet value (category, colours, sizes, materials) and per flag, float
+    columns for the numeric sort keys, and one ascending permutation per sort
+    field (descending sorts walk it backwards) that also serves price range
+    filters. A load sorts everything once; single-product writes move just
+    that row within each permutation by binary search. It understands
+    the subset of Mongo filters that `get_products` builds; anything else
+    (text search, keyset filters) should go to Mongo.
+    """
+
+    def __init__(self, initial_capacity: int = 1024):
+        self.ready = False
+        self.counters = {"queries": 0, "upserts": 0, "removals": 0, "rebuilds": 0}
+        self.last_load_ms = 0.0
+        self.last_rebuild_ms = 0.0
+        self._reset(initial_capacity)
+
+    # ------------------------------------------------------------------
+    # Loading and incremental updates
+    # ------------------------------------------------------------------
+
+    def _reset(self, capacity: int):
+        self._capacity = max(capacity, 16)
+        self._size = 0
+        self._docs: List[Optional[Dict]] = []
+        self._row_of: Dict[str, int] = {}
+        self._alive = np.zeros(self._capacity, dtype=bool)
+        self._flags = {field: np.zeros(self._capacity, dtype=bool) for field in FLAG_FIELDS}
+        self._bitmaps: Dict[str, Dict[Any, np.ndarray]] = {field: {} for field in FACET_FIELDS}
+        self._numbers = {field: np.full(self._capacity, np.nan) for field in NUMERIC_FIELDS}
+        self._orders: Dict[str, np.ndarray] = {field: np.zeros(0, dtype=np.int64) for field in SORT_FIELDS}
+        self._sort_keys: Dict[str, np.ndarray] = {
+            field: np.zeros(0, dtype=object if field == "name" else float) for field in SORT_FIELDS
+        }
+        self._sort_ids: Dict[str, np.ndarray] = {field: np.zeros(0, dtype=object) for field in SORT_FIELDS}
+
+    def load(self, documents: Sequence[Dict]):
+        """Replace the whole index with `documents` (serialized, with string `id`)"""
+        started = time.perf_counter()
+        self._reset(int(len(documents) * 1.25) + 1)
+        for document in documents:
+            self._upsert(document)
+        self._rebuild()
+        self.ready = True
+        self.last_load_ms = (time.perf_counter() - started) * 1000
+        logger.info(f"Catalog engine loaded {len(documents)} products in {self.last_load_ms:.1f}ms")
+
+    def upsert(self, document: Dict):
+        """Insert or replace one product"""
+        row = self._row_of.get(document["id"])
+        if row is None:
+            self._sort_in(self._upsert(document))
+        else:
+            positions = {field: self._position(field, row) for field in SORT_FIELDS}
+            self._upsert(document)
+            self._resort(row, positions)
+        self.counters["upserts"] += 1
+
+    def remove(self, product_id: str) -> bool:
+        """Drop one product from the index"""
+        row = self._row_of.pop(product_id, None)
+        if row is None:
+            return False
+        self._unsort(row)
+        self._clear_row(row)
+        self._docs[row] = None
+        self._alive[row] = False
+        self.counters["removals"] += 1
+        return True
+
+    def _upsert(self, document: Dict) -> int:
+        row = self._row_of.get(document["id"])
+        if row is None:
+            row = self._size
+            if row == self._capacity:
+                self._grow(self._capacity * 2)
+            self._size += 1
+            self._docs.append(None)
+            self._row_of[document["id"]] = row
+        else:
+            self._clear_row(row)
+
+        self._docs[row] = document
+        self._alive[row] = True
+        for field in FLAG_FIELDS:
+            self._flags[field][row] = bool(document.get(field, False))
+        for field in NUMERIC_FIELDS:
+            self._numbers[field][row] = _as_number(document.get(field))
+        for field in FACET_FIELDS:
+            bitmaps = self._bitmaps[field]
+            for value in _as_values(document.get(field)):
+                bitmap = bitmaps.get(value)
+                if bitmap is None:
+                    bitmap = bitmaps[value] = np.zeros(self._capacity, dtype=bool)
+                bitmap[row] = True
+        return row
+
+    def _clear_row(self, row: int):
+        """Unset the facet bits the row's current document contributed"""
+        document = self._docs[row]
+        if document is None:
+            return
+        for field in FACET_FIELDS:
+            for value in _as_values(document.get(field)):
+                bitmap = self._bitmaps[field].get(value)
+                if bitmap is not None:
+                    bitmap[row] = False
+
+    def _grow(self, capacity: int):
+        """Resize every column to `capacity` rows"""
+        def resized(array: np.ndarray, fill) -> np.ndarray:
+            grown = np.full(capacity, fill, dtype=array.dtype)
+            grown[:len(array)] = array
+            return grown
+
+        self._alive = resized(self._alive, False)
+        self._flags = {field: resized(column, False) for field, column in self._flags.items()}
+        self._numbers = {field: resized(column, np.nan) for field, column in self._numbers.items()}
+        self._bitmaps = {
+            field: {value: resized(bitmap, False) for value, bitmap in bitmaps.items()}
+            for field, bitmaps in self._bitmaps.items()
+        }
+        self._capacity = capacity
+
+    def _rebuild(self):
+        """Sort every live row into the per-field permutations"""
+        started = time.perf_counter()
+        rows = np.flatnonzero(self._alive[:self._size])
+        ids = np.array([self._docs[row]["id"] for row in rows], dtype=object)
+        id_rank = np.empty(len(rows), dtype=np.int64)
+        id_rank[np.argsort(ids, kind="stable")] = np.arange(len(rows))
+
+        names = np.array([str(self._docs[row].get("name", "")) for row in rows], dtype=object)
+        name_rank = np.unique(names, return_inverse=True)[1] if len(rows) else np.zeros(0, dtype=np.int64)
+
+        # Match Mongo's ordering: missing values first ascending, with the
+        # `_id` tiebreaker; a descending sort is exactly this order reversed
+        for field in SORT_FIELDS:
+            if field == "name":
+                keys, primary = names, name_rank
+            else:
+                values = self._numbers[field][rows]
+                keys = primary = np.where(np.isnan(values), -np.inf, values)
+            positions = np.lexsort((id_rank, primary))
+            self._orders[field] = rows[positions]
+            self._sort_keys[field] = keys[positions]
+            self._sort_ids[field] = ids[positions]
+
+        self.counters["rebuilds"] += 1
+        self.last_rebuild_ms = (time.perf_counter() - started) * 1000
+
+    def _sort_key(self, field: str, row: int):
+        """The row's ascending sort key for `field`, as stored in `_sort_keys`"""
+        if field == "name":
+            return str(self._docs[row].get("name", ""))
+        value = self._numbers[field][row]
+        return -np.inf if np.isnan(value) else value
+
+    def _position(self, field: str, row: int) -> int:
+        """Binary-search where the row sorts within `field`'s permutation, by key then ID"""
+        keys, ids = self._sort_keys[field], self._sort_ids[field]
+        key = self._sort_key(field, row)
+        low = np.searchsorted(keys, key, side="left")
+        high = np.searchsorted(keys, key, side="right")
+        return low + int(np.searchsorted(ids[low:high], self._docs[row]["id"]))
+
+    def _unsort(self, row: int):
+        """Take a row out of every sort permutation, before its columns change"""
+        for field in SORT_FIELDS:
+            position = self._position(field, row)
+            self._orders[field] = np.delete(self._orders[field], position)
+            self._sort_keys[field] = np.delete(self._sort_keys[field], position)
+            self._sort_ids[field] = np.delete(self._sort_ids[field], position)
+
+    def _resort(self, row: int, positions: Dict[str, int]):
+        """Shift a rewritten row from its old permutation slots to where its new keys sort
+
+        Only the entries between the old and new slot move, in place, so a
+        write that leaves the sort keys alone (a stock change) costs nothing.
+        """
+        for field in SORT_FIELDS:
+            old = positions[field]
+            # The stale entry still sits at `old`, in order, so it can't mislead the search
+            new = self._position(field, row)
+            new = new - 1 if new > old else new
+            if new == old:
+                continue
+            values = (row, self._sort_key(field, row), self._docs[row]["id"])
+            for array, value in zip((self._orders[field], self._sort_keys[field], self._sort_ids[field]), values):
+                if new > old:
+                    array[old:new] = array[old + 1:new + 1]
+                else:
+                    array[new + 1:old + 1] = array[new:old]
+                array[new] = value
+
+    def _sort_in(self, row: int):
+        """Insert a row into every sort permutation at its binary-searched position"""
+        for field in SORT_FIELDS:
+            position = self._position(field, row)
+            self._orders[field] = np.insert(self._orders[field], position, row)
+            self._sort_keys[field] = np.insert(self._sort_keys[field], position, self._sort_key(field, row))
+            self._sort_ids[field] = np.insert(self._sort_ids[field], position, self._docs[row]["id"])
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def supports(filter_dict: Dict, sort_dict: Dict) -> bool:
+        """Whether a Mongo filter and sort built by `get_products` can be answered here"""
+        sort_fields = [field for field in sort_dict if field != "_id"]
+        if len(sort_fields) != 1 or sort_fields[0] not in SORT_FIELDS:
+            return False
+
+        for key, condition in filter_dict.items():
+            if key == "category":
+                if not isinstance(condition, str):
+                    return False
+            elif key in ("colors", "sizes", "materials"):
+                if not isinstance(condition, dict) or set(condition) != {"$in"}:
+                    return False
+            elif key == "price":
+                if not isinstance(condition, dict) or not set(condition) <= {"$gte", "$lte"}:
+                    return False
+            elif key in FLAG_FIELDS:
+                if not isinstance(condition, bool):
+                    return False
+            else:
+                return False
+        return True
+
+    def match(self, filter_dict: Dict) -> np.ndarray:
+        """Boolean mask of live rows matching a supported filter"""
+        n = self._size
+        mask = self._alive[:n].copy()
+        for key, condition in filter_dict.items():
+            if key == "category":
+                bitmap = self._bitmaps["category"].get(condition)
+                if bitmap is None:
+                    return np.zeros(n, dtype=bool)
+                mask &= bitmap[:n]
+            elif key in ("colors", "sizes", "materials"):
+                union = np.zeros(n, dtype=bool)
+                for value in condition["$in"]:
+                    bitmap = self._bitmaps[key].get(value)
+                    if bitmap is not None:
+                        union |= bitmap[:n]
+                mask &= union
+            elif key == "price":
+                # Missing prices sort first as -inf and never match a range
+                prices = self._sort_keys["price"]
+                if "$gte" in condition:
+                    low = np.searchsorted(prices, condition["$gte"], side="left")
+                else:
+                    low = np.searchsorted(prices, -np.inf, side="right")
+                high = np.searchsorted(prices, condition.get("$lte", np.inf), side="right")
+                in_range = np.zeros(n, dtype=bool)
+                in_range[self._orders["price"][low:high]] = True
+                mask &= in_range
+            elif key in FLAG_FIELDS:
+                flag = self._flags[key][:n]
+                mask &= flag if condition else ~flag
+        return mask
+
+    def query(
+        self,
+        filter_dict: Dict,
+        sort_dict: Dict,
+        skip: int,
+        limit: int,
+        include_total: bool = True,
+        include_facets: bool = False,
+        price_boundaries: Sequence[float] = (),
+        price_overflow: Any = None
+    ) -> Dict:
+        """Answer a listing in the same shape as the `$facet` aggregation result"""
+        self.counters["queries"] += 1
+        mask = self.match(filter_dict)
+
+        field = next(key for key in sort_dict if key != "_id")
+        order = self._orders[field] if sort_dict[field] == 1 else self._orders[field][::-1]
+        positions = np.flatnonzero(mask[order])
+        rows = order[positions[skip:skip + limit]]
+
+        result: Dict[str, Any] = {"items": [self._docs[row] for row in rows]}
+        if include_total:
+            result["total"] = [{"count": int(len(positions))}]
+        if include_facets:
+            for facet in ("colors", "sizes", "materials"):
+                counts = [
+                    {"_id": value, "count": int(np.count_nonzero(bitmap[:self._size] & mask))}
+                    for value, bitmap in self._bitmaps[facet].items()
+                ]
+                result[facet] = sorted(
+                    (entry for entry in counts if entry["count"]),
+                    key=lambda entry: (-entry["count"], str(entry["_id"]))
+                )
+            result["price_ranges"] = self._price_buckets(mask, price_boundaries, price_overflow)
+        return result
+
+    def _price_buckets(self, mask: np.ndarray, boundaries: Sequence[float], overflow: Any) -> List[Dict]:
+        """Count matching prices per [lower, upper) bucket, like Mongo's `$bucket`"""
+        prices = self._numbers["price"][:self._size][mask]
+        buckets = []
+        in_any = np.zeros(len(prices), dtype=bool)
+        for lower, upper in zip(boundaries, boundaries[1:]):
+            in_bucket = (prices >= lower) & (prices < upper)
+            in_any |= in_bucket
+            count = int(np.count_nonzero(in_bucket))
+            if count:
+                buckets.append({"_id": lower, "count": count})
+        overflow_count = int(len(prices) - np.count_nonzero(in_any))
+        if overflow_count:
+            buckets.append({"_id": overflow, "count": overflow_count})
+        return buckets
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters and index size"""
+        return {
+            **self.counters,
+            "ready": self.ready,
+            "products": len(self._row_of),
+            "rows": self._size,
+            "last_load_ms": round(self.last_load_ms, 2),
+            "last_rebuild_ms": round(self.last_rebuild_ms, 2)
+        }
+
+# Create engine instance
+catalog_engine = CatalogEngine()
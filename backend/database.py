@@ -1,5 +1,7 @@
 from motor.motor_asyncio import AsyncIOMotorClient
-from typing import Optional, List, Dict
+from bson import ObjectId
+from pymongo import DeleteMany, UpdateOne
+from typing import Any, Iterable, Optional, List, Dict
 import os
 from datetime import datetime, timedelta
 import logging
@@ -49,18 +51,44 @@ async def create_indexes():
         await db.database.products.create_index("featured")
         await db.database.products.create_index("on_sale")
         await db.database.products.create_index("price")
-        
-        # Cart collection indexes
-        await db.database.cart_items.create_index([("user_id", 1), ("product_id", 1)])
-        
+
+        # Keyset pagination indexes: one per sort option, with the _id tiebreaker
+        await db.database.products.create_index([("name", 1), ("_id", 1)])
+        await db.database.products.create_index([("price", 1), ("_id", 1)])
+        await db.database.products.create_index([("rating", -1), ("_id", -1)])
+        await db.database.products.create_index([("created_at", -1), ("_id", -1)])
+
+        # Price alerts read products changed since their checkpoint
+        await db.database.products.create_index([("updated_at", 1), ("_id", 1)])
+
         # Wishlist collection indexes
         await db.database.wishlist_items.create_index([("user_id", 1), ("product_id", 1)], unique=True)
+        await db.database.wishlist_items.create_index([("product_id", 1), ("user_id", 1)])
         
         # Orders collection indexes
         await db.database.orders.create_index("user_id")
         await db.database.orders.create_index("status")
         await db.database.orders.create_index("created_at")
         
+        # Revoked tokens expire together with the tokens they revoke
+        await db.database.revoked_tokens.create_index("expires_at", expireAfterSeconds=0)
+        await db.database.revoked_tokens.create_index("created_at")
+        
+        # Merged guest carts are remembered only as long as their tokens stay valid
+        await db.database.merged_guest_carts.create_index("expires_at", expireAfterSeconds=0)
+        
+        # Email outbox: workers look up due messages and their own claims
+        await db.database.email_outbox.create_index([("status", 1), ("next_attempt_at", 1)])
+        await db.database.email_outbox.create_index("claim", sparse=True)
+        
+        # Stock reservations: the sweeper looks up expired holds, each user has one active reservation;
+        # shards are summed per product
+        await db.database.stock_reservations.create_index([("status", 1), ("expires_at", 1)])
+        await db.database.stock_reservations.create_index(
+            "user_id", unique=True, partialFilterExpression={"active": True}
+        )
+        await db.database.stock_shards.create_index("product_id")
+        
         # Reviews collection indexes
         await db.database.reviews.create_index([("product_id", 1), ("user_id", 1)], unique=True)
         
@@ -68,6 +96,45 @@ async def create_indexes():
         
     except Exception as e:
         logger.error(f"Error creating indexes: {e}")
+    
+    # Cart collection: one line per product, size and color, so concurrent adds upsert the same line.
+    # Cart writes are only atomic with this index, so failing to build it fails startup
+    await merge_duplicate_cart_lines()
+    await db.database.cart_items.create_index(
+        [("user_id", 1), ("product_id", 1), ("selected_size", 1), ("selected_color", 1)], unique=True
+    )
+
+async def merge_duplicate_cart_lines() -> int:
+    """Fold cart lines written before the unique cart index into one line each
+
+    Duplicates keep the oldest line with their quantities summed. Returns how
+    many lines were deleted.
+    """
+    pipeline = [
+        {"$sort": {"_id": 1}},
+        {"$group": {
+            "_id": {
+                "user_id": "$user_id",
+                "product_id": "$product_id",
+                "selected_size": {"$ifNull": ["$selected_size", None]},
+                "selected_color": {"$ifNull": ["$selected_color", None]}
+            },
+            "ids": {"$push": "$_id"},
+            "quantity": {"$sum": "$quantity"},
+            "count": {"$sum": 1}
+        }},
+        {"$match": {"count": {"$gt": 1}}}
+    ]
+    operations = []
+    async for group in db.database.cart_items.aggregate(pipeline, allowDiskUse=True):
+        keep, *duplicates = group["ids"]
+        operations.append(UpdateOne({"_id": keep}, {"$set": {"quantity": group["quantity"], "updated_at": datetime.utcnow()}}))
+        operations.append(DeleteMany({"_id": {"$in": duplicates}}))
+    if not operations:
+        return 0
+    result = await db.database.cart_items.bulk_write(operations, ordered=False)
+    logger.warning(f"Merged {result.deleted_count} duplicate cart lines before creating the unique cart index")
+    return result.deleted_count
 
 # Helper functions for database operations
 def get_collection(collection_name: str):
@@ -80,19 +147,49 @@ async def insert_one(collection_name: str, document: dict) -> str:
     result = await collection.insert_one(document)
     return str(result.inserted_id)
 
-async def find_one(collection_name: str, filter_dict: dict) -> dict:
-    """Find a single document"""
-    collection = get_collection(collection_name)
-    document = await collection.find_one(filter_dict)
-    if document:
-        document['id'] = str(document['_id'])
-        del document['_id']
+# ID codec: documents are keyed by ObjectId, the API and stored references use its hex string
+def encode_id(value: Any) -> str:
+    """Convert a document `_id` to the string the API exposes"""
+    return str(value)
+
+def decode_id(value: Any) -> Any:
+    """Convert an API ID string to the ObjectId it was encoded from; anything else passes through"""
+    if isinstance(value, str) and ObjectId.is_valid(value):
+        return ObjectId(value)
+    return value
+
+def decode_ids(values: Iterable[Any]) -> List[Any]:
+    """Decode several API IDs, dropping duplicates but keeping their order"""
+    return [decode_id(value) for value in dict.fromkeys(values)]
+
+def lookup_by_id(from_collection: str, local_field: str, as_field: str, projection: dict = None) -> dict:
+    """`$lookup` stage joining a stored string reference to the `_id` of another collection"""
+    pipeline = [{"$match": {"$expr": {"$eq": ["$_id", "$$ref_id"]}}}]
+    if projection:
+        pipeline.append({"$project": projection})
+    return {"$lookup": {
+        "from": from_collection,
+        "let": {"ref_id": {"$convert": {"input": f"${local_field}", "to": "objectId", "onError": None, "onNull": None}}},
+        "pipeline": pipeline,
+        "as": as_field
+    }}
+
+def serialize_document(document: dict) -> dict:
+    """Replace a document's ObjectId `_id` with a string `id`"""
+    if document and '_id' in document:
+        document['id'] = encode_id(document.pop('_id'))
     return document
 
-async def find_many(collection_name: str, filter_dict: dict = None, sort_dict: dict = None, skip: int = 0, limit: int = 0) -> List[dict]:
-    """Find multiple documents"""
+async def find_one(collection_name: str, filter_dict: dict, projection: dict = None) -> dict:
+    """Find a single document, optionally limited to the projected fields"""
     collection = get_collection(collection_name)
-    cursor = collection.find(filter_dict or {})
+    document = await collection.find_one(filter_dict, projection)
+    return serialize_document(document)
+
+async def find_many(collection_name: str, filter_dict: dict = None, sort_dict: dict = None, skip: int = 0, limit: int = 0, projection: dict = None) -> List[dict]:
+    """Find multiple documents, optionally limited to the projected fields"""
+    collection = get_collection(collection_name)
+    cursor = collection.find(filter_dict or {}, projection)
     
     if sort_dict:
         cursor = cursor.sort(list(sort_dict.items()))
@@ -105,11 +202,21 @@ async def find_many(collection_name: str, filter_dict: dict = None, sort_dict: d
     
     # Convert _id to id for all documents
     for doc in documents:
-        doc['id'] = str(doc['_id'])
-        del doc['_id']
+        serialize_document(doc)
     
     return documents
 
+async def find_many_by_ids(collection_name: str, ids: Iterable[str], projection: dict = None) -> List[dict]:
+    """Fetch documents by API ID in one `$in` query, in the order requested; unknown IDs are skipped"""
+    object_ids = decode_ids(ids)
+    if not object_ids:
+        return []
+    found = {
+        document["id"]: document
+        for document in await find_many(collection_name, {"_id": {"$in": object_ids}}, projection=projection)
+    }
+    return [found[encode_id(object_id)] for object_id in object_ids if encode_id(object_id) in found]
+
 async def update_one(collection_name: str, filter_dict: dict, update_dict: dict) -> bool:
     """Update a single document"""
     collection = get_collection(collection_name)
@@ -117,6 +224,11 @@ async def update_one(collection_name: str, filter_dict: dict, update_dict: dict)
     result = await collection.update_one(filter_dict, {"$set": update_dict})
     return result.modified_count > 0
 
+async def apply_update(collection_name: str, filter_dict: dict, update: dict, upsert: bool = False):
+    """Apply an update document with its own operators, e.g. `$inc` with `upsert`, and return the raw result"""
+    collection = get_collection(collection_name)
+    return await collection.update_one(filter_dict, update, upsert=upsert)
+
 async def delete_one(collection_name: str, filter_dict: dict) -> bool:
     """Delete a single document"""
     collection = get_collection(collection_name)
@@ -132,4 +244,14 @@ async def delete_many(collection_name: str, filter_dict: dict) -> int:
 async def count_documents(collection_name: str, filter_dict: dict = None) -> int:
     """Count documents matching filter"""
     collection = get_collection(collection_name)
-    return await collection.count_documents(filter_dict or {})
\ No newline at end of file
+    return await collection.count_documents(filter_dict or {})
+
+async def estimated_document_count(collection_name: str) -> int:
+    """Count all documents in a collection from its metadata, without a scan"""
+    collection = get_collection(collection_name)
+    return await collection.estimated_document_count()
+
+async def aggregate(collection_name: str, pipeline: List[dict]) -> List[dict]:
+    """Run an aggregation pipeline and return every result document"""
+    collection = get_collection(collection_name)
+    return await collection.aggregate(pipeline).to_list(length=None)
@@ -1,7 +1,12 @@
 import os
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 import logging
 
+from email_templates import (
+    ORDER_CONFIRMATION_HTML, ORDER_CONFIRMATION_SUBJECT, PRICE_DROP_HTML, PRICE_DROP_SUBJECT, VERIFICATION_HTML,
+    VERIFICATION_SUBJECT
+)
+
 logger = logging.getLogger(__name__)
 
 # This is a mock email service - replace with SendGrid when you have the API key
@@ -11,18 +16,11 @@ class MockEmailService:
         self.sender_email = os.getenv('SENDER_EMAIL', 'noreply@luxuryline.com')
     
     async def send_email(self, to_email: str, subject: str, html_content: str) -> bool:
-        """Mock email sending - logs email instead of sending"""
+        """Mock email sending - logs a one-line summary instead of sending"""
         try:
-            # In development, just log the email
-            print(f"\n{'='*50}")
-            print(f"📧 MOCK EMAIL SERVICE")
-            print(f"{'='*50}")
-            print(f"To: {to_email}")
-            print(f"From: {self.sender_email}")
-            print(f"Subject: {subject}")
-            print(f"Content:")
-            print(html_content)
-            print(f"{'='*50}\n")
+            # In development, just log the email (the HTML body is only logged at DEBUG)
+            logger.info(f"Mock email to {to_email} from {self.sender_email}: {subject!r} ({len(html_content)} bytes)")
+            logger.debug(html_content)
             
             # TODO: Replace with actual SendGrid implementation
             # from sendgrid import SendGridAPIClient
@@ -44,118 +42,60 @@ class MockEmailService:
             logger.error(f"Error sending email: {e}")
             return False
 
+class InMemoryEmailTransport:
+    """Stand-in transport that keeps sent messages in memory, for tests and local runs
+
+    `fail_next(n)` makes the next `n` sends fail, to exercise retries.
+    """
+    
+    def __init__(self):
+        self.sent: List[Dict] = []
+        self._failures = 0
+    
+    def fail_next(self, count: int = 1):
+        self._failures += count
+    
+    async def send_email(self, to_email: str, subject: str, html_content: str) -> bool:
+        if self._failures:
+            self._failures -= 1
+            raise ConnectionError("Simulated transport failure")
+        self.sent.append({"to": to_email, "subject": subject, "html": html_content})
+        return True
+
 # Create service instance
 email_service = MockEmailService()
 
+def render_verification_email(email: str, verification_code: str) -> Tuple[str, str]:
+    """Render the verification email as (subject, html)"""
+    return render_email("verification", {"email": email, "verification_code": verification_code})
+
+def render_order_confirmation_email(email: str, order_id: str, total: float) -> Tuple[str, str]:
+    """Render the order confirmation email as (subject, html)"""
+    return render_email("order_confirmation", {"email": email, "order_id": order_id, "total": total})
+
+# (subject, html) templates by outbox email kind; values are the enqueued params plus `email`
+EMAIL_TEMPLATES = {
+    "verification": (VERIFICATION_SUBJECT, VERIFICATION_HTML),
+    "order_confirmation": (ORDER_CONFIRMATION_SUBJECT, ORDER_CONFIRMATION_HTML),
+    "price_drop": (PRICE_DROP_SUBJECT, PRICE_DROP_HTML)
+}
+
+def render_email(kind: str, values: Dict) -> Tuple[str, str]:
+    """Render one email of `kind` as (subject, html)"""
+    subject, html = EMAIL_TEMPLATES[kind]
+    return subject.render(**values), html.render(**values)
+
+def render_emails(kind: str, rows: List[Dict]) -> List[Tuple[str, str]]:
+    """Render many emails of one kind, each template making a single pass over the rows"""
+    subject, html = EMAIL_TEMPLATES[kind]
+    return list(zip(subject.render_many(rows), html.render_many(rows)))
+
 async def send_verification_email(email: str, verification_code: str) -> bool:
     """Send email verification code"""
-    subject = "Verify Your LuxuryLine Account"
-    
-    html_content = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <meta charset="utf-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1">
-        <title>Verify Your Account</title>
-        <style>
-            body {{ font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif; margin: 0; padding: 0; background-color: #f5f5f5; }}
-            .container {{ max-width: 600px; margin: 0 auto; background-color: #ffffff; }}
-            .header {{ background: linear-gradient(135deg, #000000 0%, #333333 100%); padding: 40px 20px; text-align: center; }}
-            .logo {{ color: #FFD700; font-size: 32px; font-weight: bold; margin: 0; }}
-            .tagline {{ color: #cccccc; font-size: 14px; margin: 5px 0 0 0; }}
-            .content {{ padding: 40px 20px; }}
-            .title {{ color: #333333; font-size: 24px; font-weight: bold; margin: 0 0 20px 0; text-align: center; }}
-            .message {{ color: #666666; font-size: 16px; line-height: 1.5; margin: 0 0 30px 0; }}
-            .code-container {{ background-color: #f8f9fa; border: 2px dashed #FFD700; border-radius: 10px; padding: 30px; text-align: center; margin: 30px 0; }}
-            .verification-code {{ font-size: 36px; font-weight: bold; color: #000000; letter-spacing: 8px; margin: 0; }}
-            .code-label {{ color: #666666; font-size: 14px; margin: 10px 0 0 0; }}
-            .footer {{ background-color: #f8f9fa; padding: 30px 20px; text-align: center; border-top: 1px solid #eeeeee; }}
-            .footer-text {{ color: #999999; font-size: 14px; margin: 0; }}
-            .button {{ display: inline-block; background: linear-gradient(135deg, #FFD700 0%, #FFA500 100%); color: #000000; text-decoration: none; padding: 15px 30px; border-radius: 25px; font-weight: bold; margin: 20px 0; }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <div class="header">
-                <h1 class="logo">LUXURYLINE</h1>
-                <p class="tagline">Where Elegance Meets Function</p>
-            </div>
-            
-            <div class="content">
-                <h2 class="title">Welcome to LuxuryLine!</h2>
-                
-                <p class="message">
-                    Thank you for creating your account with us. To complete your registration and start shopping our luxury collection, please verify your email address using the code below:
-                </p>
-                
-                <div class="code-container">
-                    <p class="verification-code">{verification_code}</p>
-                    <p class="code-label">Enter this 6-digit code to verify your account</p>
-                </div>
-                
-                <p class="message">
-                    This verification code will expire in 24 hours. If you didn't create this account, please ignore this email.
-                </p>
-                
-                <p class="message">
-                    Once verified, you'll have access to:
-                    <br>• Exclusive luxury sneakers and crockery
-                    <br>• Personalized recommendations
-                    <br>• Special member pricing
-                    <br>• Priority customer support
-                </p>
-            </div>
-            
-            <div class="footer">
-                <p class="footer-text">
-                    LuxuryLine | Premium E-commerce Experience<br>
-                    This email was sent to {email}
-                </p>
-            </div>
-        </div>
-    </body>
-    </html>
-    """
-    
+    subject, html_content = render_verification_email(email, verification_code)
     return await email_service.send_email(email, subject, html_content)
 
 async def send_order_confirmation_email(email: str, order_id: str, total: float) -> bool:
     """Send order confirmation email"""
-    subject = f"Order Confirmation #{order_id} - LuxuryLine"
-    
-    html_content = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <meta charset="utf-8">
-        <title>Order Confirmation</title>
-        <style>
-            body {{ font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif; margin: 0; padding: 0; background-color: #f5f5f5; }}
-            .container {{ max-width: 600px; margin: 0 auto; background-color: #ffffff; }}
-            .header {{ background: linear-gradient(135deg, #000000 0%, #333333 100%); padding: 40px 20px; text-align: center; }}
-            .logo {{ color: #FFD700; font-size: 32px; font-weight: bold; margin: 0; }}
-            .content {{ padding: 40px 20px; }}
-            .order-number {{ background-color: #f8f9fa; padding: 20px; border-radius: 10px; text-align: center; margin: 20px 0; }}
-            .total {{ font-size: 24px; font-weight: bold; color: #000000; }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <div class="header">
-                <h1 class="logo">LUXURYLINE</h1>
-            </div>
-            <div class="content">
-                <h2>Thank you for your order!</h2>
-                <div class="order-number">
-                    <p><strong>Order #{order_id}</strong></p>
-                    <p class="total">Total: ${total:.2f}</p>
-                </div>
-                <p>We'll send you shipping updates as your order progresses.</p>
-            </div>
-        </div>
-    </body>
-    </html>
-    """
-    
+    subject, html_content = render_order_confirmation_email(email, order_id, total)
     return await email_service.send_email(email, subject, html_content)
\ No newline at end of file
@@ -0,0 +1,194 @@
+from html import escape
+from string import Formatter
+from typing import Any, Callable, Dict, Iterable, List, Mapping
+
+class TemplateError(ValueError):
+    """Raised for template syntax this layer doesn't support"""
+
+class Template:
+    """A `str.format`-style template parsed and compiled once
+
+    The source is split into static chunks and `{field}` / `{field:spec}`
+    placeholders when the template is created, then turned into a single
+    generated function that concatenates the chunks with the formatted
+    values, so rendering never re-parses the source or copies the static
+    parts more than once. Values are HTML-escaped unless `escape_html` is off
+    (e.g. for subjects). Literal braces are written `{{` and `}}`.
+    """
+
+    def __init__(self, name: str, source: str, escape_html: bool = True):
+        self.name = name
+        self.source = source
+        self.fields: List[str] = []
+        namespace: Dict[str, Any] = {"_escape": escape if escape_html else str, "_format": format}
+        parts = []
+        for index, (literal, field, spec, conversion) in enumerate(Formatter().parse(source)):
+            if literal:
+                namespace[f"_s{index}"] = literal
+                parts.append(f"_s{index}")
+            if field is None:
+                continue
+            if not field.isidentifier() or conversion:
+                raise TemplateError(f"{name}: unsupported placeholder {{{field}}}")
+            if "{" in (spec or ""):
+                raise TemplateError(f"{name}: nested format specs are not supported")
+            if field not in self.fields:
+                self.fields.append(field)
+            value = f"values[{field!r}]"
+            formatted = f"_format({value}, {spec!r})" if spec else f"str({value})"
+            parts.append(f"_escape({formatted})")
+
+        exec(f"def _render(values):\n    return ''.join(({', '.join(parts)},))\n", namespace)
+        self._render: Callable[[Mapping[str, Any]], str] = namespace["_render"]
+
+    def render(self, **values) -> str:
+        """Render one document"""
+        return self._render(values)
+
+    def render_many(self, rows: Iterable[Mapping[str, Any]]) -> List[str]:
+        """Render one document per mapping of values"""
+        render = self._render
+        return [render(row) for row in rows]
+
+_BASE_STYLE = """
+            body {{ font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif; margin: 0; padding: 0; background-color: #f5f5f5; }}
+            .container {{ max-width: 600px; margin: 0 auto; background-color: #ffffff; }}
+            .header {{ background: linear-gradient(135deg, #000000 0%, #333333 100%); padding: 40px 20px; text-align: center; }}
+            .logo {{ color: #FFD700; font-size: 32px; font-weight: bold; margin: 0; }}"""
+
+VERIFICATION_SUBJECT = Template("verification_subject", "Verify Your LuxuryLine Account", escape_html=False)
+
+VERIFICATION_HTML = Template("verification_html", """
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <meta charset="utf-8">
+        <meta name="viewport" content="width=device-width, initial-scale=1">
+        <title>Verify Your Account</title>
+        <style>""" + _BASE_STYLE + """
+            .tagline {{ color: #cccccc; font-size: 14px; margin: 5px 0 0 0; }}
+            .content {{ padding: 40px 20px; }}
+            .title {{ color: #333333; font-size: 24px; font-weight: bold; margin: 0 0 20px 0; text-align: center; }}
+            .message {{ color: #666666; font-size: 16px; line-height: 1.5; margin: 0 0 30px 0; }}
+            .code-container {{ background-color: #f8f9fa; border: 2px dashed #FFD700; border-radius: 10px; padding: 30px; text-align: center; margin: 30px 0; }}
+            .verification-code {{ font-size: 36px; font-weight: bold; color: #000000; letter-spacing: 8px; margin: 0; }}
+            .code-label {{ color: #666666; font-size: 14px; margin: 10px 0 0 0; }}
+            .footer {{ background-color: #f8f9fa; padding: 30px 20px; text-align: center; border-top: 1px solid #eeeeee; }}
+            .footer-text {{ color: #999999; font-size: 14px; margin: 0; }}
+            .button {{ display: inline-block; background: linear-gradient(135deg, #FFD700 0%, #FFA500 100%); color: #000000; text-decoration: none; padding: 15px 30px; border-radius: 25px; font-weight: bold; margin: 20px 0; }}
+        </style>
+    </head>
+    <body>
+        <div class="container">
+            <div class="header">
+                <h1 class="logo">LUXURYLINE</h1>
+                <p class="tagline">Where Elegance Meets Function</p>
+            </div>
+
+            <div class="content">
+                <h2 class="title">Welcome to LuxuryLine!</h2>
+
+                <p class="message">
+                    Thank you for creating your account with us. To complete your registration and start shopping our luxury collection, please verify your email address using the code below:
+                </p>
+
+                <div class="code-container">
+                    <p class="verification-code">{verification_code}</p>
+                    <p class="code-label">Enter this 6-digit code to verify your account</p>
+                </div>
+
+                <p class="message">
+                    This verification code will expire in 24 hours. If you didn't create this account, please ignore this email.
+                </p>
+
+                <p class="message">
+                    Once verified, you'll have access to:
+                    <br>• Exclusive luxury sneakers and crockery
+                    <br>• Personalized recommendations
+                    <br>• Special member pricing
+                    <br>• Priority customer support
+                </p>
+            </div>
+
+            <div class="footer">
+                <p class="footer-text">
+                    LuxuryLine | Premium E-commerce Experience<br>
+                    This email was sent to {email}
+                </p>
+            </div>
+        </div>
+    </body>
+    </html>
+    """)
+
+ORDER_CONFIRMATION_SUBJECT = Template(
+    "order_confirmation_subject", "Order Confirmation #{order_id} - LuxuryLine", escape_html=False
+)
+
+ORDER_CONFIRMATION_HTML = Template("order_confirmation_html", """
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <meta charset="utf-8">
+        <title>Order Confirmation</title>
+        <style>""" + _BASE_STYLE + """
+            .content {{ padding: 40px 20px; }}
+            .order-number {{ background-color: #f8f9fa; padding: 20px; border-radius: 10px; text-align: center; margin: 20px 0; }}
+            .total {{ font-size: 24px; font-weight: bold; color: #000000; }}
+        </style>
+    </head>
+    <body>
+        <div class="container">
+            <div class="header">
+                <h1 class="logo">LUXURYLINE</h1>
+            </div>
+            <div class="content">
+                <h2>Thank you for your order!</h2>
+                <div class="order-number">
+                    <p><strong>Order #{order_id}</strong></p>
+                    <p class="total">Total: ${total:.2f}</p>
+                </div>
+                <p>We'll send you shipping updates as your order progresses.</p>
+            </div>
+        </div>
+    </body>
+    </html>
+    """)
+
+PRICE_DROP_SUBJECT = Template(
+    "price_drop_subject", "Price drop: {product_name} is now ${new_price:.2f} - LuxuryLine", escape_html=False
+)
+
+PRICE_DROP_HTML = Template("price_drop_html", """
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <meta charset="utf-8">
+        <title>Price Drop</title>
+        <style>""" + _BASE_STYLE + """
+            .content {{ padding: 40px 20px; }}
+            .price-box {{ background-color: #f8f9fa; padding: 20px; border-radius: 10px; text-align: center; margin: 20px 0; }}
+            .old-price {{ color: #999999; text-decoration: line-through; margin: 0; }}
+            .new-price {{ font-size: 24px; font-weight: bold; color: #000000; margin: 5px 0 0 0; }}
+            .footer-text {{ color: #999999; font-size: 14px; text-align: center; padding: 20px; }}
+        </style>
+    </head>
+    <body>
+        <div class="container">
+            <div class="header">
+                <h1 class="logo">LUXURYLINE</h1>
+            </div>
+            <div class="content">
+                <h2>An item on your wishlist just got cheaper</h2>
+                <div class="price-box">
+                    <p><strong>{product_name}</strong></p>
+                    <p class="old-price">${old_price:.2f}</p>
+                    <p class="new-price">${new_price:.2f}</p>
+                </div>
+                <p>Prices can change again at any time, so don't wait too long.</p>
+            </div>
+            <p class="footer-text">You are receiving this because the item is on the wishlist of {email}</p>
+        </div>
+    </body>
+    </html>
+    """)
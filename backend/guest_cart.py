@@ -0,0 +1,184 @@
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+import hashlib
+import json
+import time
+import uuid
+
+from pymongo.errors import DuplicateKeyError
+
+from cart_store import get_cart_store
+from catalog import get_products_by_ids
+from database import get_collection
+from signing import InvalidSignature, sign_payload, verify_payload
+
+# Limits that keep a token small enough for a request header
+MAX_GUEST_LINES = 50
+MAX_LINE_QUANTITY = 99
+
+# A guest cart is dropped if it hasn't changed for this long
+GUEST_CART_TTL = timedelta(days=30)
+
+TOKEN_VERSION = 1
+SIGNING_PURPOSE = "guest-cart"
+
+# IDs of guest carts already merged into a user cart, kept until their tokens expire
+MERGED_COLLECTION = "merged_guest_carts"
+
+class InvalidGuestCart(ValueError):
+    """Raised for a tampered, expired or over-limit guest cart"""
+
+def line_id(product_id: str, selected_size: Optional[str], selected_color: Optional[str]) -> str:
+    """Stable ID of a guest cart line, derived from its product, size and color"""
+    identity = json.dumps([product_id, selected_size, selected_color], separators=(",", ":"))
+    return hashlib.sha1(identity.encode()).hexdigest()[:12]
+
+class GuestCart:
+    """A cart for anonymous shoppers that lives entirely in a signed token
+
+    The client keeps the token (e.g. in localStorage) and sends it in the
+    X-Guest-Cart header, and every change returns a new token. The server
+    stores nothing, so browsing visitors never cause a database write. The
+    token is compact JSON of (product, size, color, quantity) lines plus an
+    issue time, with a truncated HMAC-SHA256 signature. It is merged into the
+    user's cart when they log in, after which the client should discard it.
+
+    Every token of one cart carries the same random cart ID, which is recorded
+    when the cart is merged, so replaying that token (or an older one of the
+    same cart) at a later login merges nothing.
+    """
+
+    def __init__(self, lines: Optional[List[Dict[str, Any]]] = None, cart_id: Optional[str] = None):
+        self.lines: List[Dict[str, Any]] = lines or []
+        self.cart_id = cart_id or uuid.uuid4().hex[:16]
+
+    @classmethod
+    def decode(cls, token: Optional[str]) -> "GuestCart":
+        """Verify and unpack a token; a missing token is an empty cart"""
+        if not token:
+            return cls()
+        try:
+            data = verify_payload(token, SIGNING_PURPOSE)
+            if data["v"] != TOKEN_VERSION:
+                raise InvalidGuestCart("Unsupported guest cart version")
+            if data["iat"] + GUEST_CART_TTL.total_seconds() < time.time():
+                raise InvalidGuestCart("Guest cart has expired")
+            return cls([
+                {"product_id": product_id, "selected_size": size, "selected_color": color, "quantity": quantity}
+                for product_id, size, color, quantity in data["l"]
+            ], data.get("c") or hashlib.sha1(token.encode()).hexdigest()[:16])
+        except InvalidSignature as e:
+            raise InvalidGuestCart(f"Invalid guest cart: {e}")
+        except InvalidGuestCart:
+            raise
+        except Exception:
+            raise InvalidGuestCart("Malformed guest cart")
+
+    def encode(self) -> str:
+        """Sign the cart into a token"""
+        data = {
+            "v": TOKEN_VERSION,
+            "c": self.cart_id,
+            "iat": int(time.time()),
+            "l": [
+                [line["product_id"], line["selected_size"], line["selected_color"], line["quantity"]]
+                for line in self.lines
+            ]
+        }
+        return sign_payload(data, SIGNING_PURPOSE)
+
+    def _find(self, item_id: str) -> Optional[Dict[str, Any]]:
+        for line in self.lines:
+            if line_id(line["product_id"], line["selected_size"], line["selected_color"]) == item_id:
+                return line
+        return None
+
+    def add(self, product_id: str, quantity: int, selected_size: Optional[str], selected_color: Optional[str]):
+        """Add to the matching line or append a new one"""
+        if quantity < 1:
+            raise InvalidGuestCart("Quantity must be at least 1")
+        line = self._find(line_id(product_id, selected_size, selected_color))
+        if line is None:
+            if len(self.lines) >= MAX_GUEST_LINES:
+                raise InvalidGuestCart(f"A guest cart can hold at most {MAX_GUEST_LINES} items")
+            line = {"product_id": product_id, "selected_size": selected_size, "selected_color": selected_color, "quantity": 0}
+            self.lines.append(line)
+        line["quantity"] = min(MAX_LINE_QUANTITY, line["quantity"] + quantity)
+
+    def set_quantity(self, item_id: str, quantity: int) -> bool:
+        """Set a line's quantity; False if there is no such line"""
+        if quantity < 1:
+            raise InvalidGuestCart("Quantity must be at least 1")
+        line = self._find(item_id)
+        if line is None:
+            return False
+        line["quantity"] = min(MAX_LINE_QUANTITY, quantity)
+        return True
+
+    def remove(self, item_id: str) -> bool:
+        """Remove a line; False if there is no such line"""
+        line = self._find(item_id)
+        if line is None:
+            return False
+        self.lines.remove(line)
+        return True
+
+    async def products(self) -> Dict[str, Dict[str, Any]]:
+        """The products in the cart that still exist, by ID, through the product cache"""
+        return {
+            product["id"]: product
+            for product in await get_products_by_ids(
+                [line["product_id"] for line in self.lines], {"name": 1, "price": 1, "images": 1}
+            )
+        }
+
+    async def priced_lines(self) -> List[Dict[str, Any]]:
+        """Lines with current product details, newest first, in the shape of user cart lines"""
+        products = await self.products()
+        lines = []
+        for line in reversed(self.lines):
+            product = products.get(line["product_id"])
+            if product is None:
+                continue
+            lines.append({
+                "id": line_id(line["product_id"], line["selected_size"], line["selected_color"]),
+                "product_id": line["product_id"],
+                "name": product["name"],
+                "price": product["price"],
+                "image": product["images"][0] if product.get("images") else "",
+                "quantity": line["quantity"],
+                "selected_size": line["selected_size"],
+                "selected_color": line["selected_color"]
+            })
+        return lines
+
+async def merge_guest_cart(user_id: str, token: Optional[str]) -> int:
+    """Move a guest cart into the user's cart at login; returns how many lines were merged
+
+    A cart that was merged before is ignored. The cart is recorded first, so
+    two logins racing with the same token can't both merge it, and the record
+    is dropped again if the merge fails.
+    """
+    cart = GuestCart.decode(token)
+    if not cart.lines:
+        return 0
+    merged = get_collection(MERGED_COLLECTION)
+    try:
+        await merged.insert_one({
+            "_id": cart.cart_id,
+            "user_id": user_id,
+            "expires_at": datetime.utcnow() + GUEST_CART_TTL
+        })
+    except DuplicateKeyError:
+        return 0
+    try:
+        products = await cart.products()
+        entries = [
+            {"product": products[line["product_id"]], **{key: line[key] for key in ("quantity", "selected_size", "selected_color")}}
+            for line in cart.lines
+            if line["product_id"] in products
+        ]
+        return await get_cart_store().merge(user_id, entries)
+    except Exception:
+        await merged.delete_one({"_id": cart.cart_id})
+        raise
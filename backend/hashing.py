@@ -0,0 +1,115 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+import asyncio
+import logging
+import math
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Latency samples kept for the percentile metrics
+LATENCY_SAMPLES = 1000
+
+class PoolSaturated(Exception):
+    """Raised instead of queueing when the hashing pool is already full"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Password hashing pool is saturated; retry after {retry_after}s")
+        self.retry_after = retry_after
+
+def _percentile(samples, fraction: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+class BoundedPool:
+    """Thread pool for CPU-heavy calls with a hard cap on queued work
+
+    bcrypt releases the GIL, so hashing in worker threads keeps the event loop
+    free for other requests. At most `workers + max_queue` calls may be pending;
+    beyond that `run` raises `PoolSaturated` straight away rather than letting
+    requests pile up behind a backlog they would time out in anyway.
+
+    Sizes come from PASSWORD_HASH_WORKERS and PASSWORD_HASH_QUEUE and are read
+    on first use, after the environment has been loaded.
+    """
+
+    def __init__(self, name: str, workers: Optional[int] = None, max_queue: Optional[int] = None):
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending = 0
+        self._queue_waits = deque(maxlen=LATENCY_SAMPLES)
+        self._run_times = deque(maxlen=LATENCY_SAMPLES)
+        self.counters = {"submitted": 0, "completed": 0, "rejected": 0, "errors": 0, "max_pending": 0}
+
+    def _ensure_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            if self.workers is None:
+                self.workers = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+            if self.max_queue is None:
+                self.max_queue = int(os.getenv("PASSWORD_HASH_QUEUE", "32"))
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+        return self._executor
+
+    def has_capacity(self) -> bool:
+        """Whether `run` would currently accept another call"""
+        self._ensure_executor()
+        return self._pending < self.workers + self.max_queue
+
+    def retry_after(self) -> int:
+        """Seconds until the current backlog should have drained"""
+        average = sum(self._run_times) / len(self._run_times) if self._run_times else 0.1
+        return max(1, math.ceil(self._pending * average / (self.workers or 1)))
+
+    async def run(self, fn: Callable[..., Any], *args) -> Any:
+        """Run `fn(*args)` on the pool, or raise `PoolSaturated` if the queue is full"""
+        executor = self._ensure_executor()
+        if self._pending >= self.workers + self.max_queue:
+            self.counters["rejected"] += 1
+            raise PoolSaturated(self.retry_after())
+
+        self._pending += 1
+        self.counters["submitted"] += 1
+        self.counters["max_pending"] = max(self.counters["max_pending"], self._pending)
+        submitted = time.perf_counter()
+
+        def timed():
+            started = time.perf_counter()
+            self._queue_waits.append(started - submitted)
+            try:
+                return fn(*args)
+            finally:
+                self._run_times.append(time.perf_counter() - started)
+
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(executor, timed)
+            self.counters["completed"] += 1
+            return result
+        except Exception:
+            self.counters["errors"] += 1
+            raise
+        finally:
+            self._pending -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters, current depth and queue-wait / run-time percentiles in ms"""
+        queue_waits = list(self._queue_waits)
+        run_times = list(self._run_times)
+        return {
+            **self.counters,
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "pending": self._pending,
+            "queue_wait_p50_ms": round(_percentile(queue_waits, 0.5) * 1000, 2),
+            "queue_wait_p99_ms": round(_percentile(queue_waits, 0.99) * 1000, 2),
+            "run_p50_ms": round(_percentile(run_times, 0.5) * 1000, 2),
+            "run_p99_ms": round(_percentile(run_times, 0.99) * 1000, 2)
+        }
+
+# Create pool instance
+password_pool = BoundedPool("bcrypt")
@@ -0,0 +1,395 @@
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+import asyncio
+import logging
+import os
+import random
+import uuid
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from catalog import get_products_by_ids, invalidate_product_stock
+from database import decode_id, get_collection
+
+logger = logging.getLogger(__name__)
+
+RESERVATIONS_COLLECTION = "stock_reservations"
+SHARDS_COLLECTION = "stock_shards"
+
+DUPLICATE_KEY = 11000
+
+# A reservation still `pending` this long after creation was interrupted mid-write
+PENDING_GRACE = timedelta(minutes=5)
+
+# (product ID, quantity, shard index or None for the product's own stock_quantity)
+Target = Tuple[str, int, Optional[int]]
+
+class InsufficientStock(Exception):
+    """Raised when some cart lines can't be reserved; nothing is held when it is raised"""
+
+    def __init__(self, product_ids: Sequence[str]):
+        super().__init__(f"Insufficient stock for {', '.join(product_ids)}")
+        self.product_ids = list(product_ids)
+
+class ReservationInProgress(Exception):
+    """Raised when the user's previous reservation is still being made"""
+
+def shard_id(product_id: str, index: int) -> str:
+    return f"{product_id}:{index}"
+
+def reservation_ttl() -> timedelta:
+    """How long checkout holds stock, from STOCK_RESERVATION_MINUTES"""
+    return timedelta(minutes=float(os.getenv("STOCK_RESERVATION_MINUTES", "15")))
+
+class InventoryService:
+    """Stock reservations built on conditional atomic decrements
+
+    Every product in a checkout is decremented in one unordered bulk write
+    of `{_id, stock_quantity: {$gte: qty}}` -> `$inc: -qty` updates, so stock
+    can never go negative however many checkouts race. Each update is an
+    upsert: when the stock check fails, the upsert tries to insert a second
+    document with the product's `_id` and gets a duplicate-key error. That
+    way the single bulk result reports exactly which lines failed, and those
+    that succeeded are given back before `InsufficientStock` is raised. An
+    upsert that actually inserts means the product (or shard) is gone; that
+    line fails too and the stray document is deleted again.
+
+    Stock is held in a `stock_reservations` document until the order commits
+    it, checkout releases it, or it expires and the sweeper returns it. A user
+    has at most one active (pending or held) reservation: a new one releases
+    the old hold first, and a unique partial index on `user_id` over
+    `active: true` documents settles concurrent attempts, so one account
+    can't pile up holds on a scarce product.
+
+    Hot products can be split into `stock_shards` documents (`shard_product`),
+    so concurrent checkouts update different documents instead of queueing on
+    one. A line tries its shards in random order. When too little stock is
+    left in any one shard for a line, the line fails even if the shards add
+    up to enough, so sharding suits drops sold one or two at a time.
+    """
+
+    def __init__(self):
+        self.counters = {
+            "reserved": 0, "rejected": 0, "committed": 0, "released": 0, "expired": 0,
+            "abandoned": 0, "shard_retries": 0
+        }
+
+    # ------------------------------------------------------------------
+    # Stock writes
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _stock_update(target: Target) -> Tuple[str, UpdateOne]:
+        product_id, quantity, shard = target
+        if shard is None:
+            return "products", UpdateOne(
+                {"_id": decode_id(product_id), "stock_quantity": {"$gte": quantity}},
+                {"$inc": {"stock_quantity": -quantity}},
+                upsert=True
+            )
+        return SHARDS_COLLECTION, UpdateOne(
+            {"_id": shard_id(product_id, shard), "stock": {"$gte": quantity}},
+            {"$inc": {"stock": -quantity}},
+            upsert=True
+        )
+
+    async def _decrement(self, targets: List[Target]) -> List[bool]:
+        """Try every decrement at once; returns per target whether it took stock"""
+        by_collection: Dict[str, List[Tuple[int, UpdateOne]]] = {}
+        for index, target in enumerate(targets):
+            collection, operation = self._stock_update(target)
+            by_collection.setdefault(collection, []).append((index, operation))
+
+        async def write(collection: str, operations: List[Tuple[int, UpdateOne]]) -> List[Tuple[int, bool, Any]]:
+            failed: Dict[int, Any] = {}
+            try:
+                result = await get_collection(collection).bulk_write(
+                    [operation for _, operation in operations], ordered=False
+                )
+                upserted = result.upserted_ids or {}
+            except BulkWriteError as e:
+                failed = {error["index"]: error for error in e.details.get("writeErrors", [])}
+                upserted = {entry["index"]: entry["_id"] for entry in e.details.get("upserted", [])}
+            if upserted:
+                await self._delete_strays(collection, list(upserted.values()))
+            return [
+                (index, position not in failed and position not in upserted, failed.get(position))
+                for position, (index, _) in enumerate(operations)
+            ]
+
+        taken = [False] * len(targets)
+        unexpected = None
+        for results in await asyncio.gather(*(write(name, ops) for name, ops in by_collection.items())):
+            for index, succeeded, error in results:
+                taken[index] = succeeded
+                if error is not None and error["code"] != DUPLICATE_KEY:
+                    unexpected = error
+        self._invalidate(target for target, ok in zip(targets, taken) if ok)
+        if unexpected is not None:
+            await self._restore([target for target, ok in zip(targets, taken) if ok])
+            raise RuntimeError(f"Stock update failed: {unexpected.get('errmsg')}")
+        return taken
+
+    @staticmethod
+    def _invalidate(targets: Iterable[Target]):
+        """Drop cached copies of products whose own stock_quantity was written"""
+        for product_id in {product_id for product_id, _, shard in targets if shard is None}:
+            invalidate_product_stock(product_id)
+
+    @staticmethod
+    async def _delete_strays(collection: str, ids: List[Any]):
+        """Delete documents upserted for a product or shard that doesn't exist"""
+        marker = "name" if collection == "products" else "product_id"
+        await get_collection(collection).delete_many({"_id": {"$in": ids}, marker: {"$exists": False}})
+        logger.warning(f"Deleted {len(ids)} stock documents upserted into {collection} for missing products")
+
+    async def _restore(self, targets: List[Target]):
+        """Give reserved stock back"""
+        by_collection: Dict[str, List[UpdateOne]] = {}
+        for product_id, quantity, shard in targets:
+            if shard is None:
+                by_collection.setdefault("products", []).append(
+                    UpdateOne({"_id": decode_id(product_id)}, {"$inc": {"stock_quantity": quantity}})
+                )
+            else:
+                by_collection.setdefault(SHARDS_COLLECTION, []).append(
+                    UpdateOne({"_id": shard_id(product_id, shard)}, {"$inc": {"stock": quantity}})
+                )
+        await asyncio.gather(*(
+            get_collection(name).bulk_write(operations, ordered=False) for name, operations in by_collection.items()
+        ))
+        self._invalidate(targets)
+
+    # ------------------------------------------------------------------
+    # Reservations
+    # ------------------------------------------------------------------
+
+    async def reserve(self, user_id: str, lines: List[Dict], ttl: Optional[timedelta] = None) -> Dict:
+        """Hold stock for `{product_id, quantity}` lines; raises `InsufficientStock` if any can't be held
+
+        Raises ValueError for a line quantity below 1, which would otherwise
+        add stock or offset another line of the same product.
+        """
+        quantities: Dict[str, int] = {}
+        for line in lines:
+            if line["quantity"] < 1:
+                raise ValueError(f"Invalid quantity {line['quantity']} for {line['product_id']}")
+            quantities[line["product_id"]] = quantities.get(line["product_id"], 0) + line["quantity"]
+        shards = {
+            product["id"]: product.get("stock_shards") or 0
+            for product in await get_products_by_ids(list(quantities), {"stock_shards": 1})
+        }
+        missing = [product_id for product_id in quantities if product_id not in shards]
+        if missing:
+            self.counters["rejected"] += 1
+            raise InsufficientStock(missing)
+
+        # Replace the user's previous hold rather than stacking another on it
+        collection = get_collection(RESERVATIONS_COLLECTION)
+        for previous in await collection.find({"user_id": user_id, "status": "held"}, {"_id": 1}).to_list(length=None):
+            await self.release(previous["_id"], {"user_id": user_id})
+
+        # Record the reservation first, so an interrupted one can be found by the sweeper
+        now = datetime.utcnow()
+        reservation = {
+            "_id": uuid.uuid4().hex,
+            "user_id": user_id,
+            "status": "pending",
+            "active": True,
+            "lines": [],
+            "created_at": now,
+            "expires_at": now + (ttl or reservation_ttl())
+        }
+        try:
+            await collection.insert_one(reservation)
+        except DuplicateKeyError:
+            self.counters["rejected"] += 1
+            raise ReservationInProgress(f"A reservation is already being made for {user_id}")
+
+        # Shard order per product; sharded lines move on to their next shard until one has enough
+        shard_orders = {
+            product_id: random.sample(range(count), count) for product_id, count in shards.items() if count
+        }
+        pending: List[Target] = [
+            (product_id, quantity, shard_orders[product_id][0] if product_id in shard_orders else None)
+            for product_id, quantity in quantities.items()
+        ]
+        taken: List[Target] = []
+        short: List[str] = []
+        attempt = 0
+        while pending:
+            retry: List[Target] = []
+            for target, ok in zip(pending, await self._decrement(pending)):
+                product_id, quantity, shard = target
+                if ok:
+                    taken.append(target)
+                elif shard is not None and attempt + 1 < len(shard_orders[product_id]):
+                    retry.append((product_id, quantity, shard_orders[product_id][attempt + 1]))
+                    self.counters["shard_retries"] += 1
+                else:
+                    short.append(product_id)
+            pending = retry
+            attempt += 1
+
+        if short:
+            await self._restore(taken)
+            await collection.delete_one({"_id": reservation["_id"]})
+            self.counters["rejected"] += 1
+            raise InsufficientStock(short)
+
+        reservation["lines"] = [
+            {"product_id": product_id, "quantity": quantity, "shard": shard} for product_id, quantity, shard in taken
+        ]
+        reservation["status"] = "held"
+        await collection.update_one(
+            {"_id": reservation["_id"]}, {"$set": {"status": "held", "lines": reservation["lines"]}}
+        )
+        self.counters["reserved"] += 1
+        return reservation
+
+    @staticmethod
+    def covers(reservation: Dict, lines: List[Dict]) -> bool:
+        """Whether a reservation holds exactly the quantities of `{product_id, quantity}` lines"""
+        wanted: Dict[str, int] = {}
+        for line in lines:
+            wanted[line["product_id"]] = wanted.get(line["product_id"], 0) + line["quantity"]
+        held: Dict[str, int] = {}
+        for line in reservation["lines"]:
+            held[line["product_id"]] = held.get(line["product_id"], 0) + line["quantity"]
+        return wanted == held
+
+    async def get_reservation(self, reservation_id: str, user_id: str) -> Optional[Dict]:
+        """A user's reservation that is still holding stock"""
+        return await get_collection(RESERVATIONS_COLLECTION).find_one(
+            {"_id": reservation_id, "user_id": user_id, "status": "held"}
+        )
+
+    async def commit(self, reservation_id: str, order_id: str) -> bool:
+        """Turn held stock into sold stock; False if the reservation was already released"""
+        result = await get_collection(RESERVATIONS_COLLECTION).update_one(
+            {"_id": reservation_id, "status": "held"},
+            {"$set": {"status": "committed", "order_id": order_id, "committed_at": datetime.utcnow()},
+             "$unset": {"active": ""}}
+        )
+        if result.matched_count:
+            self.counters["committed"] += 1
+        return result.matched_count > 0
+
+    async def release(self, reservation_id: str, filter_dict: Optional[Dict] = None, status: str = "held") -> bool:
+        """Return the stock of a reservation in `status`; False if it wasn't in that status
+
+        The status flips before the stock is returned, so a crash in between
+        loses the stock (undersells) rather than returning it twice.
+        """
+        reservation = await get_collection(RESERVATIONS_COLLECTION).find_one_and_update(
+            {**(filter_dict or {}), "_id": reservation_id, "status": status},
+            {"$set": {"status": "released", "released_at": datetime.utcnow()}, "$unset": {"active": ""}}
+        )
+        if reservation is None:
+            return False
+        await self._restore([(line["product_id"], line["quantity"], line.get("shard")) for line in reservation["lines"]])
+        self.counters["released"] += 1
+        return True
+
+    async def sweep_expired(self, limit: int = 500) -> int:
+        """Release expired reservations; returns how many were released"""
+        collection = get_collection(RESERVATIONS_COLLECTION)
+        now = datetime.utcnow()
+        expired = await collection.find(
+            {"status": "held", "expires_at": {"$lte": now}}, {"_id": 1}
+        ).limit(limit).to_list(length=None)
+        released = 0
+        for reservation in expired:
+            # Re-checking expiry keeps a concurrent commit or release from being undone
+            if await self.release(reservation["_id"], {"expires_at": {"$lte": now}}):
+                released += 1
+        self.counters["expired"] += released
+
+        # A reservation stuck in `pending` may or may not have taken stock; leave the stock alone
+        abandoned = await collection.update_many(
+            {"status": "pending", "created_at": {"$lte": now - PENDING_GRACE}},
+            {"$set": {"status": "abandoned"}, "$unset": {"active": ""}}
+        )
+        if abandoned.modified_count:
+            self.counters["abandoned"] += abandoned.modified_count
+            logger.warning(f"Marked {abandoned.modified_count} interrupted stock reservations abandoned")
+        return released
+
+    async def run_sweeper(self):
+        """Sweep now and then every STOCK_SWEEP_SECONDS"""
+        interval = float(os.getenv("STOCK_SWEEP_SECONDS", "30"))
+        while True:
+            try:
+                await self.sweep_expired()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error sweeping stock reservations: {e}")
+            await asyncio.sleep(interval)
+
+    # ------------------------------------------------------------------
+    # Sharded counters
+    # ------------------------------------------------------------------
+
+    async def shard_product(self, product_id: str, shards: int):
+        """Move a product's stock into `shards` counters, spread as evenly as possible"""
+        product = await get_collection("products").find_one_and_update(
+            {"_id": decode_id(product_id), "stock_shards": {"$in": [None, 0]}},
+            {"$set": {"stock_quantity": 0, "stock_shards": shards, "updated_at": datetime.utcnow()}}
+        )
+        if product is None:
+            raise ValueError(f"Product {product_id} does not exist or is already sharded")
+        stock = product.get("stock_quantity", 0)
+        await get_collection(SHARDS_COLLECTION).bulk_write([
+            UpdateOne(
+                {"_id": shard_id(product_id, index)},
+                {"$inc": {"stock": stock // shards + (1 if index < stock % shards else 0)},
+                 "$set": {"product_id": product_id}},
+                upsert=True
+            )
+            for index in range(shards)
+        ], ordered=False)
+        invalidate_product_stock(product_id)
+
+    async def unshard_product(self, product_id: str) -> int:
+        """Fold a product's shards back into `stock_quantity`; returns the stock moved
+
+        Shard documents are zeroed rather than deleted, so a checkout that
+        still sees the product as sharded fails its stock check instead of
+        upserting a fresh shard.
+        """
+        product = await get_collection("products").find_one_and_update(
+            {"_id": decode_id(product_id), "stock_shards": {"$gt": 0}},
+            {"$set": {"stock_shards": 0, "updated_at": datetime.utcnow()}}
+        )
+        if product is None:
+            return 0
+        moved = 0
+        for index in range(product["stock_shards"]):
+            shard = await get_collection(SHARDS_COLLECTION).find_one_and_update(
+                {"_id": shard_id(product_id, index)}, {"$set": {"stock": 0}}
+            )
+            moved += shard["stock"] if shard else 0
+        await get_collection("products").update_one({"_id": decode_id(product_id)}, {"$inc": {"stock_quantity": moved}})
+        invalidate_product_stock(product_id)
+        return moved
+
+    async def available(self, product_id: str) -> int:
+        """Unreserved stock of a product, summed over its shards if it has any"""
+        product = await get_collection("products").find_one(
+            {"_id": decode_id(product_id)}, {"stock_quantity": 1, "stock_shards": 1}
+        )
+        if product is None:
+            return 0
+        if not product.get("stock_shards"):
+            return product.get("stock_quantity", 0)
+        shards = await get_collection(SHARDS_COLLECTION).find({"product_id": product_id}, {"stock": 1}).to_list(length=None)
+        return sum(shard["stock"] for shard in shards)
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters"""
+        return dict(self.counters)
+
+# Create inventory instance
+inventory = InventoryService()
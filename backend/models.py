@@ -22,6 +22,7 @@ class User(BaseModel):
     email: EmailStr
     password_hash: str
     is_verified: bool = False
+    is_admin: bool = False
     verification_code: Optional[str] = None
     verification_code_expires: Optional[datetime] = None
     profile: UserProfile = UserProfile()
@@ -62,6 +63,8 @@ class Product(BaseModel):
     sizes: List[str] = []
     materials: List[str] = []
     stock_quantity: int = 0
+    stock_shards: int = 0
+    waiting_room: bool = False
     featured: bool = False
     on_sale: bool = False
     rating: float = 0.0
@@ -96,12 +99,12 @@ class CartItem(BaseModel):
 
 class CartItemCreate(BaseModel):
     product_id: str
-    quantity: int = 1
+    quantity: int = Field(1, ge=1)
     selected_size: Optional[str] = None
     selected_color: Optional[str] = None
 
 class CartItemUpdate(BaseModel):
-    quantity: int
+    quantity: int = Field(..., ge=1)
 
 class CartResponse(BaseModel):
     items: List[Dict]
@@ -156,6 +159,7 @@ class OrderCreate(BaseModel):
     shipping_address: Address
     billing_address: Optional[Address] = None
     payment_method: str
+    reservation_id: Optional[str] = None
 
 # Review Models
 class Review(BaseModel):
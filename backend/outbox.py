@@ -0,0 +1,234 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple, Union
+import asyncio
+import logging
+import os
+import random
+import uuid
+
+from database import get_collection
+from email_service import EMAIL_TEMPLATES, InMemoryEmailTransport, email_service, render_email, render_emails
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_COLLECTION = "email_outbox"
+
+# Messages claimed per batch, and how long a claim lasts before another worker may retry it
+BATCH_SIZE = 50
+LEASE = timedelta(seconds=60)
+
+# A send still running after this counts as failed, so a batch settles well inside its lease
+SEND_TIMEOUT = 20.0
+
+# Retry schedule: 2s, 4s, 8s, ... capped at 15 minutes, then dead-lettered
+MAX_ATTEMPTS = 6
+BACKOFF_BASE = 2.0
+BACKOFF_CAP = 900.0
+
+def backoff(attempts: int) -> timedelta:
+    """Delay before retry number `attempts`, with jitter so failed batches spread out"""
+    delay = min(BACKOFF_CAP, BACKOFF_BASE ** attempts)
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+def build_message(kind: str, to: str, params: Dict[str, Any], not_before: Optional[datetime] = None) -> Dict:
+    """Outbox document for one email; it is rendered when sent, so only the params are stored"""
+    if kind not in EMAIL_TEMPLATES:
+        raise ValueError(f"Unknown email kind: {kind}")
+    now = datetime.utcnow()
+    return {
+        "kind": kind,
+        "to": to,
+        "params": params,
+        "status": "pending",
+        "attempts": 0,
+        "next_attempt_at": not_before or now,
+        "created_at": now
+    }
+
+class EmailOutbox:
+    """Durable email queue in Mongo, drained by a pool of background workers
+
+    Request handlers only insert a document. Workers claim due messages in
+    batches (a claim is a lease, so messages held by a crashed worker become
+    due again), render and send them, and record the outcome: `sent`, back
+    to `pending` with exponential backoff, or `dead` after MAX_ATTEMPTS.
+    The attempt is counted when the message is claimed, so a message that
+    keeps crashing its worker is dead-lettered too, and the outcome is only
+    recorded while the claim is still ours.
+    An enqueue wakes the local workers immediately; otherwise they poll.
+    """
+
+    def __init__(self):
+        self._wakeup = asyncio.Event()
+        self._workers: List[asyncio.Task] = []
+        self.transport = email_service
+        self.counters = {"enqueued": 0, "batches": 0, "sent": 0, "retried": 0, "dead": 0}
+
+    # ------------------------------------------------------------------
+    # Producing
+    # ------------------------------------------------------------------
+
+    async def enqueue(self, kind: str, to: str, **params) -> str:
+        """Queue one email and return its outbox ID"""
+        result = await get_collection(OUTBOX_COLLECTION).insert_one(build_message(kind, to, params))
+        self.counters["enqueued"] += 1
+        self._wakeup.set()
+        return str(result.inserted_id)
+
+    async def enqueue_many(self, messages: List[Dict]) -> int:
+        """Queue documents from `build_message` in one write"""
+        if not messages:
+            return 0
+        await get_collection(OUTBOX_COLLECTION).insert_many(messages, ordered=False)
+        self.counters["enqueued"] += len(messages)
+        self._wakeup.set()
+        return len(messages)
+
+    # ------------------------------------------------------------------
+    # Consuming
+    # ------------------------------------------------------------------
+
+    async def claim_batch(self, limit: int = BATCH_SIZE) -> List[Dict]:
+        """Lease up to `limit` due messages to this caller"""
+        collection = get_collection(OUTBOX_COLLECTION)
+        now = datetime.utcnow()
+
+        # Leases that ran out on the last allowed attempt: the worker died every time
+        abandoned = await collection.update_many(
+            {"status": "sending", "locked_until": {"$lte": now}, "attempts": {"$gte": MAX_ATTEMPTS}},
+            {"$set": {"status": "dead", "last_error": "Worker lease expired on every attempt"},
+             "$unset": {"claim": "", "locked_until": ""}}
+        )
+        if abandoned.modified_count:
+            self.counters["dead"] += abandoned.modified_count
+            logger.error(f"Dead-lettered {abandoned.modified_count} emails whose workers never finished")
+
+        claimable = {"$or": [
+            {"status": "pending", "next_attempt_at": {"$lte": now}},
+            {"status": "sending", "locked_until": {"$lte": now}, "attempts": {"$lt": MAX_ATTEMPTS}}
+        ]}
+        candidates = await collection.find(claimable, {"_id": 1}).sort("next_attempt_at", 1).limit(limit).to_list(length=None)
+        if not candidates:
+            return []
+
+        # Re-checking `claimable` in the update makes each claim atomic against other workers
+        claim = uuid.uuid4().hex
+        await collection.update_many(
+            {"$and": [{"_id": {"$in": [doc["_id"] for doc in candidates]}}, claimable]},
+            {"$set": {"status": "sending", "claim": claim, "locked_until": now + LEASE}, "$inc": {"attempts": 1}}
+        )
+        return await collection.find({"claim": claim, "status": "sending"}).to_list(length=None)
+
+    @staticmethod
+    def render_batch(batch: List[Dict]) -> List[Union[Tuple[str, str], Exception]]:
+        """(subject, html) per message, rendering each kind's messages in one pass"""
+        rendered: List[Union[Tuple[str, str], Exception]] = [None] * len(batch)
+        by_kind = defaultdict(list)
+        for index, message in enumerate(batch):
+            by_kind[message["kind"]].append(index)
+        for kind, indexes in by_kind.items():
+            rows = [{**batch[index]["params"], "email": batch[index]["to"]} for index in indexes]
+            try:
+                results = render_emails(kind, rows)
+            except Exception:
+                # Find the bad rows one by one so they don't fail the rest
+                results = []
+                for row in rows:
+                    try:
+                        results.append(render_email(kind, row))
+                    except Exception as e:
+                        results.append(e)
+            for index, result in zip(indexes, results):
+                rendered[index] = result
+        return rendered
+
+    async def deliver(self, message: Dict, rendered: Union[Tuple[str, str], Exception]) -> Optional[str]:
+        """Send one rendered message; returns an error string on failure"""
+        try:
+            if isinstance(rendered, Exception):
+                raise rendered
+            subject, html_content = rendered
+            if await asyncio.wait_for(self.transport.send_email(message["to"], subject, html_content), SEND_TIMEOUT):
+                return None
+            return "Transport reported failure"
+        except asyncio.TimeoutError:
+            return f"Send timed out after {SEND_TIMEOUT:g}s"
+        except Exception as e:
+            return repr(e)
+
+    async def process_batch(self, limit: int = BATCH_SIZE) -> int:
+        """Claim, send and settle one batch; returns how many messages it handled"""
+        batch = await self.claim_batch(limit)
+        if not batch:
+            return 0
+        self.counters["batches"] += 1
+
+        rendered = self.render_batch(batch)
+        errors = await asyncio.gather(*(self.deliver(message, result) for message, result in zip(batch, rendered)))
+        collection = get_collection(OUTBOX_COLLECTION)
+        now = datetime.utcnow()
+        claim = batch[0]["claim"]
+        sent_ids = [message["_id"] for message, error in zip(batch, errors) if error is None]
+        if sent_ids:
+            # A message whose lease ran out and was claimed again belongs to that claim now
+            result = await collection.update_many(
+                {"_id": {"$in": sent_ids}, "claim": claim},
+                {"$set": {"status": "sent", "sent_at": now}, "$unset": {"claim": "", "locked_until": ""}}
+            )
+            self.counters["sent"] += result.modified_count
+
+        for message, error in zip(batch, errors):
+            if error is None:
+                continue
+            attempts = message["attempts"]
+            update = {"last_error": error[:500]}
+            if attempts >= MAX_ATTEMPTS:
+                update["status"] = "dead"
+                self.counters["dead"] += 1
+                logger.error(f"Dead-lettered {message['kind']} email to {message['to']}: {error}")
+            else:
+                update["status"] = "pending"
+                update["next_attempt_at"] = now + backoff(attempts)
+                self.counters["retried"] += 1
+            await collection.update_one(
+                {"_id": message["_id"], "claim": claim},
+                {"$set": update, "$unset": {"claim": "", "locked_until": ""}}
+            )
+        return len(batch)
+
+    async def _work(self, poll_interval: float):
+        while True:
+            try:
+                if await self.process_batch():
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Email outbox worker error: {e}")
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        """Start OUTBOX_WORKERS workers; EMAIL_TRANSPORT=memory swaps in the in-memory transport"""
+        if os.getenv("EMAIL_TRANSPORT", "log") == "memory":
+            self.transport = InMemoryEmailTransport()
+        workers = int(os.getenv("OUTBOX_WORKERS", "2"))
+        poll_interval = float(os.getenv("OUTBOX_POLL_SECONDS", "1"))
+        self._workers = [asyncio.create_task(self._work(poll_interval)) for _ in range(workers)]
+
+    def stop(self):
+        """Cancel the workers; claimed messages are retried once their lease runs out"""
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters and worker count"""
+        return {**self.counters, "workers": len(self._workers)}
+
+# Create outbox instance
+email_outbox = EmailOutbox()
@@ -0,0 +1,79 @@
+import base64
+import binascii
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from bson import json_util
+
+from database import decode_id
+
+# Sort options accepted by GET /api/products, mapped to the field and direction
+# they order by. Every sort gets an `_id` tiebreaker so keyset pages are stable.
+PRODUCT_SORTS: Dict[str, Tuple[str, int]] = {
+    "name": ("name", 1),
+    "price-low": ("price", 1),
+    "price-high": ("price", -1),
+    "rating": ("rating", -1),
+    "newest": ("created_at", -1),
+}
+DEFAULT_PRODUCT_SORT = "name"
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor cannot be decoded or does not fit the query"""
+
+def resolve_sort(sort_by: Optional[str]) -> Tuple[str, str, int]:
+    """Return (sort_by, field, direction), falling back to the default sort"""
+    if sort_by not in PRODUCT_SORTS:
+        sort_by = DEFAULT_PRODUCT_SORT
+    field, direction = PRODUCT_SORTS[sort_by]
+    return sort_by, field, direction
+
+def build_sort(sort_by: Optional[str]) -> Dict[str, int]:
+    """Build the sort spec for a sort option, including the `_id` tiebreaker"""
+    _, field, direction = resolve_sort(sort_by)
+    return {field: direction, "_id": direction}
+
+def encode_cursor(sort_by: str, value: Any, document_id: str) -> str:
+    """Encode the position after a document as an opaque, URL-safe cursor"""
+    payload = json_util.dumps([sort_by, value, document_id])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, sort_by: str) -> Tuple[Any, Any]:
+    """Decode a cursor into (sort value, _id) for the given sort option"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        cursor_sort, value, document_id = json_util.loads(base64.urlsafe_b64decode(padded))
+    except (binascii.Error, ValueError, TypeError, UnicodeDecodeError, json.JSONDecodeError):
+        raise InvalidCursor("Malformed cursor")
+
+    if cursor_sort != sort_by:
+        raise InvalidCursor("Cursor was issued for a different sort order")
+
+    return value, decode_id(document_id)
+
+def build_keyset_filter(sort_by: str, value: Any, document_id: Any) -> Dict:
+    """Build the filter selecting documents strictly after (value, _id) in sort order"""
+    _, field, direction = resolve_sort(sort_by)
+    after = "$gt" if direction == 1 else "$lt"
+
+    if value is None:
+        # Missing values sort before everything ascending and after everything
+        # descending, so only the null run itself can still follow an ascending
+        # null, and only more nulls can follow a descending one.
+        same_value = {field: None, "_id": {after: document_id}}
+        if direction == 1:
+            return {"$or": [same_value, {field: {"$ne": None}}]}
+        return same_value
+
+    branches: List[Dict] = [
+        {field: {after: value}},
+        {field: value, "_id": {after: document_id}},
+    ]
+    if direction == -1:
+        branches.append({field: None})
+    return {"$or": branches}
+
+def next_cursor(sort_by: str, last_document: Dict) -> str:
+    """Build the cursor that continues after the last document of a page"""
+    _, field, _ = resolve_sort(sort_by)
+    return encode_cursor(sort_by, last_document.get(field), last_document["id"])
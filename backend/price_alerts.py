@@ -0,0 +1,235 @@
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+import asyncio
+import logging
+import os
+import uuid
+
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from database import decode_ids, encode_id, get_collection
+from outbox import build_message, email_outbox
+
+logger = logging.getLogger(__name__)
+
+PRICE_STATE_COLLECTION = "product_price_state"
+CHECKPOINT_COLLECTION = "job_checkpoints"
+CHECKPOINT_ID = "price_alerts"
+
+# Changed products handled per page, and how far behind the checkpoint each run starts again
+SCAN_BATCH = 500
+SCAN_OVERLAP = timedelta(seconds=5)
+
+# How long a run may hold the job before another worker may take over
+LEASE = timedelta(minutes=5)
+
+def numeric_price(product: Dict) -> Optional[float]:
+    """A product's price, or None if it is missing or not a number"""
+    price = product.get("price")
+    if isinstance(price, bool) or not isinstance(price, (int, float)):
+        return None
+    return price
+
+class PriceAlertEngine:
+    """Incremental price-drop detection and wishlist fan-out
+
+    Each run reads only products whose `updated_at` moved past the stored
+    checkpoint, on the (updated_at, _id) index, and compares their price with
+    the last one recorded in `product_price_state`. A product seen for the
+    first time only records its price. For the products that got cheaper, the
+    wishlist's product_id index is streamed in batches, and each batch's
+    verified users are fetched in one query. Emails go into the outbox in
+    batches of PRICE_ALERT_BATCH, scheduled PRICE_ALERT_BATCH_INTERVAL seconds apart, so a
+    drop on a popular item can't flood the mail provider. The schedule is kept
+    with the checkpoint, so consecutive runs and workers share one send rate.
+
+    The price state is only written after the emails are queued, so a crashed
+    run repeats its last page: alerts are delivered at least once.
+    """
+
+    def __init__(self):
+        self.counters = {
+            "runs": 0, "skipped_locked": 0, "products_scanned": 0, "price_drops": 0,
+            "alerts_enqueued": 0, "errors": 0
+        }
+        self.last_checkpoint: Optional[datetime] = None
+
+    # ------------------------------------------------------------------
+    # Job lease and checkpoint
+    # ------------------------------------------------------------------
+
+    async def _acquire(self, owner: str) -> Optional[Dict]:
+        """Take the job lease; returns the checkpoint document, or None if another run holds it"""
+        now = datetime.utcnow()
+        try:
+            return await get_collection(CHECKPOINT_COLLECTION).find_one_and_update(
+                {"_id": CHECKPOINT_ID, "$or": [{"locked_until": {"$lte": now}}, {"locked_until": {"$exists": False}}]},
+                {"$set": {"owner": owner, "locked_until": now + LEASE}},
+                upsert=True,
+                return_document=True
+            )
+        except DuplicateKeyError:
+            return None
+
+    async def _save(self, owner: str, fields: Dict):
+        await get_collection(CHECKPOINT_COLLECTION).update_one(
+            {"_id": CHECKPOINT_ID, "owner": owner}, {"$set": fields}
+        )
+
+    # ------------------------------------------------------------------
+    # Detection and fan-out
+    # ------------------------------------------------------------------
+
+    async def _changed_products(self, since: Optional[datetime], after: Optional[tuple]) -> List[Dict]:
+        """The next page of products ordered by (updated_at, _id)"""
+        # Products never written through `update_one` may lack a timestamp; they are picked up once they change
+        filter_dict: Dict[str, Any] = {"updated_at": {"$type": "date"}}
+        if after is not None:
+            updated_at, last_id = after
+            filter_dict["$or"] = [
+                {"updated_at": {"$gt": updated_at}},
+                {"updated_at": updated_at, "_id": {"$gt": last_id}}
+            ]
+        elif since is not None:
+            filter_dict["updated_at"] = {"$gte": since}
+        cursor = get_collection("products").find(filter_dict, {"name": 1, "price": 1, "updated_at": 1})
+        return await cursor.sort([("updated_at", 1), ("_id", 1)]).limit(SCAN_BATCH).to_list(length=None)
+
+    @staticmethod
+    async def _price_drops(products: List[Dict]) -> List[Dict]:
+        """Products in the page now cheaper than their recorded price; unpriced products are skipped"""
+        ids = [encode_id(product["_id"]) for product in products]
+        state = {
+            doc["_id"]: doc["price"]
+            for doc in await get_collection(PRICE_STATE_COLLECTION).find({"_id": {"$in": ids}}).to_list(length=None)
+        }
+        drops = []
+        for product_id, product in zip(ids, products):
+            previous = state.get(product_id)
+            price = numeric_price(product)
+            if previous is not None and price is not None and round(price, 2) < round(previous, 2):
+                drops.append({
+                    "product_id": product_id,
+                    "product_name": product.get("name", ""),
+                    "old_price": previous,
+                    "new_price": price
+                })
+        return drops
+
+    @staticmethod
+    async def _with_emails(entries: List[Dict]) -> List[Tuple[str, str]]:
+        """(product_id, email) for the wishlist entries whose user is verified"""
+        users = get_collection("users").find(
+            {"_id": {"$in": decode_ids(entry["user_id"] for entry in entries)}, "is_verified": True}, {"email": 1}
+        )
+        emails = {encode_id(user["_id"]): user["email"] for user in await users.to_list(length=None)}
+        return [(entry["product_id"], emails[entry["user_id"]]) for entry in entries if entry["user_id"] in emails]
+
+    async def recipients(self, product_ids: List[str], batch_size: int) -> AsyncIterator[Tuple[str, str]]:
+        """(product_id, email) for verified users whose wishlist holds one of `product_ids`"""
+        cursor = get_collection("wishlist_items").find(
+            {"product_id": {"$in": product_ids}}, {"_id": 0, "product_id": 1, "user_id": 1}
+        ).batch_size(batch_size)
+        entries: List[Dict] = []
+        async for entry in cursor:
+            entries.append(entry)
+            if len(entries) >= batch_size:
+                for recipient in await self._with_emails(entries):
+                    yield recipient
+                entries = []
+        if entries:
+            for recipient in await self._with_emails(entries):
+                yield recipient
+
+    async def _fan_out(self, drops: List[Dict], next_slot: datetime) -> datetime:
+        """Queue one email per wishlist entry; returns the next free send slot"""
+        batch_size = int(os.getenv("PRICE_ALERT_BATCH", "500"))
+        interval = timedelta(seconds=float(os.getenv("PRICE_ALERT_BATCH_INTERVAL", "60")))
+        by_product = {drop["product_id"]: drop for drop in drops}
+
+        slot = max(next_slot, datetime.utcnow())
+        batch: List[Dict] = []
+        async for product_id, email in self.recipients(list(by_product), batch_size):
+            drop = by_product[product_id]
+            batch.append(build_message("price_drop", email, {
+                "product_id": drop["product_id"],
+                "product_name": drop["product_name"],
+                "old_price": drop["old_price"],
+                "new_price": drop["new_price"]
+            }, not_before=slot))
+            if len(batch) >= batch_size:
+                self.counters["alerts_enqueued"] += await email_outbox.enqueue_many(batch)
+                batch = []
+                slot += interval
+        if batch:
+            self.counters["alerts_enqueued"] += await email_outbox.enqueue_many(batch)
+            slot += interval
+        return slot
+
+    async def run_once(self) -> int:
+        """Process every product changed since the checkpoint; returns how many were scanned"""
+        owner = uuid.uuid4().hex
+        checkpoint = await self._acquire(owner)
+        if checkpoint is None:
+            self.counters["skipped_locked"] += 1
+            return 0
+        self.counters["runs"] += 1
+
+        since = checkpoint.get("scanned_until")
+        next_slot = checkpoint.get("next_slot") or datetime.utcnow()
+        after = None
+        scanned = 0
+        try:
+            while True:
+                products = await self._changed_products(since - SCAN_OVERLAP if since else None, after)
+                if not products:
+                    break
+                drops = await self._price_drops(products)
+                if drops:
+                    self.counters["price_drops"] += len(drops)
+                    next_slot = await self._fan_out(drops, next_slot)
+
+                # Unpriced products record nothing, so the next drop compares against the last real price
+                priced = [product for product in products if numeric_price(product) is not None]
+                if priced:
+                    await get_collection(PRICE_STATE_COLLECTION).bulk_write([
+                        UpdateOne(
+                            {"_id": encode_id(product["_id"])},
+                            {"$set": {"price": product["price"], "updated_at": product["updated_at"]}},
+                            upsert=True
+                        )
+                        for product in priced
+                    ], ordered=False)
+
+                last = products[-1]
+                after = (last["updated_at"], last["_id"])
+                scanned += len(products)
+                self.counters["products_scanned"] += len(products)
+                self.last_checkpoint = max(since or last["updated_at"], last["updated_at"])
+                await self._save(owner, {"scanned_until": self.last_checkpoint, "next_slot": next_slot})
+                if len(products) < SCAN_BATCH:
+                    break
+        finally:
+            await self._save(owner, {"locked_until": datetime.utcnow()})
+        return scanned
+
+    async def run(self):
+        """Run now and then every PRICE_ALERTS_INTERVAL_SECONDS"""
+        interval = float(os.getenv("PRICE_ALERTS_INTERVAL_SECONDS", "60"))
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.counters["errors"] += 1
+                logger.error(f"Error processing price alerts: {e}")
+            await asyncio.sleep(interval)
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters and the last checkpoint reached"""
+        return {**self.counters, "checkpoint": self.last_checkpoint}
+
+# Create engine instance
+price_alert_engine = PriceAlertEngine()
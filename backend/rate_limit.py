@@ -0,0 +1,120 @@
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+import math
+import os
+import time
+
+from hashing import BoundedPool, PoolSaturated, password_pool
+
+class RateLimited(Exception):
+    """Raised when a caller has used up its request budget"""
+
+    def __init__(self, scope: str, retry_after: int):
+        super().__init__(f"Rate limit exceeded for {scope}; retry after {retry_after}s")
+        self.scope = scope
+        self.retry_after = retry_after
+
+class TokenBucketLimiter:
+    """Per-key token buckets: `burst` requests at once, refilled at `per_minute`
+
+    Buckets live in an LRU bounded by `max_keys`, so a flood of distinct keys
+    can't grow memory without limit; an evicted key simply starts over full.
+    """
+
+    def __init__(self, name: str, per_minute: float, burst: int, max_keys: int = 100_000):
+        self.name = name
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.max_keys = max_keys
+        # key -> (tokens, last refill time)
+        self._buckets: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.counters = {"allowed": 0, "limited": 0, "evictions": 0}
+
+    def acquire(self, key: Hashable) -> float:
+        """Take one token for `key`; returns 0 if allowed, else seconds until one is available"""
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (float(self.burst), now))
+        tokens = min(float(self.burst), tokens + (now - updated) * self.rate)
+
+        if tokens >= 1:
+            tokens -= 1
+            wait = 0.0
+            self.counters["allowed"] += 1
+        else:
+            wait = (1 - tokens) / self.rate
+            self.counters["limited"] += 1
+
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+            self.counters["evictions"] += 1
+        return wait
+
+    def check(self, key: Hashable):
+        """Take one token for `key` or raise `RateLimited`"""
+        wait = self.acquire(key)
+        if wait:
+            raise RateLimited(self.name, max(1, math.ceil(wait)))
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters and tracked keys"""
+        return {**self.counters, "keys": len(self._buckets), "per_minute": self.rate * 60, "burst": self.burst}
+
+class AuthAdmission:
+    """Admission control for the bcrypt-heavy login and signup routes
+
+    Requests are checked cheapest first: a token bucket per client IP, one per
+    (client IP, email) pair for logins, and finally whether the password pool
+    has room. The email bucket is shared only within one IP, so nobody can
+    lock a user out by spending their email's budget from elsewhere.
+    All of it happens before the user lookup and before any hashing, so a
+    credential-stuffing burst is turned away for the cost of a dict lookup.
+    """
+
+    def __init__(self, pool: BoundedPool):
+        self.pool = pool
+        self.login_ip = TokenBucketLimiter("login_ip", per_minute=30, burst=10)
+        self.login_email = TokenBucketLimiter("login_email", per_minute=5, burst=5)
+        self.signup_ip = TokenBucketLimiter("signup_ip", per_minute=5, burst=5)
+        self.counters = {"admitted": 0, "rate_limited": 0, "shed_busy": 0}
+
+    def admit_login(self, client_ip: str, email: str):
+        """Raise `RateLimited` or `PoolSaturated` unless a login may proceed"""
+        self._admit((self.login_ip, client_ip), (self.login_email, (client_ip, email.strip().lower())))
+
+    def admit_signup(self, client_ip: str):
+        """Raise `RateLimited` or `PoolSaturated` unless a signup may proceed"""
+        self._admit((self.signup_ip, client_ip))
+
+    def _admit(self, *checks):
+        try:
+            for limiter, key in checks:
+                limiter.check(key)
+        except RateLimited:
+            self.counters["rate_limited"] += 1
+            raise
+        if not self.pool.has_capacity():
+            self.counters["shed_busy"] += 1
+            raise PoolSaturated(self.pool.retry_after())
+        self.counters["admitted"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters for admission and each limiter"""
+        return {
+            **self.counters,
+            "login_ip": self.login_ip.stats(),
+            "login_email": self.login_email.stats(),
+            "signup_ip": self.signup_ip.stats()
+        }
+
+def client_ip(headers: Dict[str, str], peer: Optional[str]) -> str:
+    """The caller's address; X-Forwarded-For is only trusted when TRUST_PROXY_HEADERS is set"""
+    if os.getenv("TRUST_PROXY_HEADERS", "false").lower() == "true":
+        forwarded = headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return peer or "unknown"
+
+# Create admission instance
+auth_admission = AuthAdmission(password_pool)
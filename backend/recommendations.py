@@ -0,0 +1,238 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+from itertools import combinations
+from typing import Dict, List, Optional, Sequence, Tuple
+import asyncio
+import logging
+import math
+import os
+import time
+
+import numpy as np
+
+from database import aggregate, estimated_document_count, find_many
+
+logger = logging.getLogger(__name__)
+
+# Neighbours precomputed per product; requests can ask for up to this many
+TOP_K = 20
+
+# How much each signal counts in the blended score
+ATTRIBUTE_WEIGHT = 0.6
+CO_PURCHASE_WEIGHT = 0.4
+
+# Feature weights inside the attribute vector
+CATEGORY_WEIGHT = 2.0
+COLOR_WEIGHT = 1.0
+MATERIAL_WEIGHT = 1.0
+PRICE_WEIGHT = 1.0
+
+# Price bands; a product also gets half weight in the neighbouring bands
+PRICE_BANDS = [0, 100, 200, 300, 400, 500]
+
+# Orders older than this don't count towards co-purchases
+CO_PURCHASE_WINDOW_DAYS = 180
+
+# Bytes of float32 scores per block; a block holds as many rows as fit against the whole catalog
+BLOCK_BYTES = 64 * 1024 * 1024
+
+# Scoring is all-pairs, so build time grows with the square of the catalog;
+# above this many products the build is refused and the previous table is kept
+MAX_PRODUCTS = int(os.getenv("RECOMMENDATIONS_MAX_PRODUCTS", "200000"))
+
+def _price_band(price: float) -> int:
+    band = 0
+    for index, lower in enumerate(PRICE_BANDS):
+        if price >= lower:
+            band = index
+    return band
+
+class RecommendationEngine:
+    """Precomputed item-to-item recommendations
+
+    Every product gets an attribute vector (category, colours, materials and a
+    softened price band), L2-normalized so a matrix product gives cosine
+    similarity. That is blended with co-purchase affinity from recent orders,
+    normalized by how often each product sells. Only the TOP_K neighbours per
+    product are kept, so serving recommendations is a dict lookup. Scores are
+    computed a block of rows at a time, sized so a block stays within
+    BLOCK_BYTES however large the catalog. Catalogs over MAX_PRODUCTS are
+    refused, since the all-pairs scoring would take too long. Builds run in a
+    worker thread and swap the neighbour table in atomically.
+    """
+
+    def __init__(self):
+        self.ready = False
+        self.neighbours: Dict[str, List[Tuple[str, float]]] = {}
+        self.counters = {"builds": 0, "lookups": 0, "misses": 0}
+        self.last_build_ms = 0.0
+        self.last_built_at: Optional[datetime] = None
+
+    @staticmethod
+    def attribute_matrix(products: Sequence[Dict]) -> np.ndarray:
+        """One L2-normalized attribute vector per product"""
+        vocabulary: Dict[Tuple[str, str], int] = {}
+        for product in products:
+            vocabulary.setdefault(("category", str(product.get("category"))), len(vocabulary))
+            for color in product.get("colors") or []:
+                vocabulary.setdefault(("color", color), len(vocabulary))
+            for material in product.get("materials") or []:
+                vocabulary.setdefault(("material", material), len(vocabulary))
+        price_offset = len(vocabulary)
+
+        matrix = np.zeros((len(products), price_offset + len(PRICE_BANDS)), dtype=np.float32)
+        for row, product in enumerate(products):
+            matrix[row, vocabulary[("category", str(product.get("category")))]] = CATEGORY_WEIGHT
+            colors = product.get("colors") or []
+            for color in colors:
+                matrix[row, vocabulary[("color", color)]] = COLOR_WEIGHT / math.sqrt(len(colors))
+            materials = product.get("materials") or []
+            for material in materials:
+                matrix[row, vocabulary[("material", material)]] = MATERIAL_WEIGHT / math.sqrt(len(materials))
+            if product.get("price") is not None:
+                band = _price_band(float(product["price"]))
+                matrix[row, price_offset + band] = PRICE_WEIGHT
+                for neighbour in (band - 1, band + 1):
+                    if 0 <= neighbour < len(PRICE_BANDS):
+                        matrix[row, price_offset + neighbour] = PRICE_WEIGHT / 2
+
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    @staticmethod
+    def co_purchase_affinity(baskets: Sequence[Sequence[str]], index: Dict[str, int]) -> Dict[int, Dict[int, float]]:
+        """Pairwise co-purchase counts scaled by sqrt(sales_a * sales_b), as {row: {row: score}}"""
+        sales = defaultdict(int)
+        pairs = defaultdict(int)
+        for basket in baskets:
+            rows = sorted({index[product_id] for product_id in basket if product_id in index})
+            for row in rows:
+                sales[row] += 1
+            for a, b in combinations(rows, 2):
+                pairs[(a, b)] += 1
+
+        affinity: Dict[int, Dict[int, float]] = defaultdict(dict)
+        for (a, b), count in pairs.items():
+            score = count / math.sqrt(sales[a] * sales[b])
+            affinity[a][b] = score
+            affinity[b][a] = score
+        return affinity
+
+    def build(self, products: Sequence[Dict], baskets: Sequence[Sequence[str]]):
+        """Recompute every product's neighbours (CPU-bound; call from a worker thread)"""
+        if len(products) > MAX_PRODUCTS:
+            raise ValueError(f"{len(products)} products exceeds RECOMMENDATIONS_MAX_PRODUCTS ({MAX_PRODUCTS})")
+        started = time.perf_counter()
+        ids = [product["id"] for product in products]
+        index = {product_id: row for row, product_id in enumerate(ids)}
+        matrix = self.attribute_matrix(products)
+        affinity = self.co_purchase_affinity(baskets, index)
+        k = min(TOP_K, len(ids) - 1)
+        block_rows = max(1, BLOCK_BYTES // (4 * max(1, len(ids))))
+
+        neighbours: Dict[str, List[Tuple[str, float]]] = {}
+        for start in range(0, len(ids), block_rows):
+            stop = min(start + block_rows, len(ids))
+            scores = ATTRIBUTE_WEIGHT * (matrix[start:stop] @ matrix.T)
+            for row in range(start, stop):
+                for other, score in affinity.get(row, {}).items():
+                    scores[row - start, other] += CO_PURCHASE_WEIGHT * score
+                scores[row - start, row] = -np.inf
+
+            if k <= 0:
+                break
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            for offset, columns in enumerate(top):
+                row_scores = scores[offset, columns]
+                order = np.argsort(-row_scores, kind="stable")
+                neighbours[ids[start + offset]] = [
+                    (ids[columns[position]], float(row_scores[position])) for position in order
+                ]
+
+        self.neighbours = neighbours
+        self.ready = True
+        self.counters["builds"] += 1
+        self.last_build_ms = (time.perf_counter() - started) * 1000
+        self.last_built_at = datetime.utcnow()
+        logger.info(f"Built recommendations for {len(ids)} products in {self.last_build_ms:.1f}ms")
+
+    def lookup(self, product_id: str, limit: int) -> Optional[List[str]]:
+        """Neighbour IDs for a product, or None if it wasn't in the last build"""
+        self.counters["lookups"] += 1
+        neighbours = self.neighbours.get(product_id)
+        if neighbours is None:
+            self.counters["misses"] += 1
+            return None
+        return [neighbour_id for neighbour_id, _ in neighbours[:limit]]
+
+    def lookup_many(self, product_ids: Sequence[str], limit: int) -> Tuple[List[str], List[str]]:
+        """Merged neighbours of several products, excluding the products themselves
+
+        A neighbour's scores are summed over every input it appears for, so items
+        related to more of the basket rank higher. Returns the ranked IDs and
+        the inputs that weren't in the last build.
+        """
+        exclude = set(product_ids)
+        merged: Dict[str, float] = defaultdict(float)
+        missing = []
+        for product_id in dict.fromkeys(product_ids):
+            self.counters["lookups"] += 1
+            neighbours = self.neighbours.get(product_id)
+            if neighbours is None:
+                self.counters["misses"] += 1
+                missing.append(product_id)
+                continue
+            for neighbour_id, score in neighbours:
+                if neighbour_id not in exclude:
+                    merged[neighbour_id] += score
+        ranked = sorted(merged.items(), key=lambda item: (-item[1], item[0]))
+        return [neighbour_id for neighbour_id, _ in ranked[:limit]], missing
+
+    def stats(self) -> Dict:
+        """Counters and table size"""
+        return {
+            **self.counters,
+            "ready": self.ready,
+            "products": len(self.neighbours),
+            "last_build_ms": round(self.last_build_ms, 2),
+            "last_built_at": self.last_built_at
+        }
+
+# Create engine instance
+recommendation_engine = RecommendationEngine()
+
+async def load_baskets() -> List[List[str]]:
+    """Product IDs of each recent order"""
+    since = datetime.utcnow() - timedelta(days=CO_PURCHASE_WINDOW_DAYS)
+    pipeline = [
+        {"$match": {"created_at": {"$gte": since}}},
+        {"$project": {"_id": 0, "products": "$items.product_id"}}
+    ]
+    return [order["products"] for order in await aggregate("orders", pipeline) if order.get("products")]
+
+async def refresh_recommendations():
+    """Rebuild the neighbour table from the current catalog and orders"""
+    total = await estimated_document_count("products")
+    if total > MAX_PRODUCTS:
+        logger.warning(
+            f"Skipping recommendations build: {total} products exceeds RECOMMENDATIONS_MAX_PRODUCTS ({MAX_PRODUCTS})"
+        )
+        return
+    products = await find_many(
+        "products", {}, projection={"category": 1, "colors": 1, "materials": 1, "price": 1}
+    )
+    baskets = await load_baskets()
+    await asyncio.to_thread(recommendation_engine.build, products, baskets)
+
+async def run_recommendation_refresher():
+    """Rebuild recommendations now and then every RECOMMENDATIONS_REFRESH_SECONDS"""
+    interval = float(os.getenv("RECOMMENDATIONS_REFRESH_SECONDS", "900"))
+    while True:
+        try:
+            await refresh_recommendations()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error refreshing recommendations: {e}")
+        await asyncio.sleep(interval)
@@ -0,0 +1,110 @@
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+import asyncio
+import calendar
+import logging
+import os
+import time
+
+from database import get_collection
+
+logger = logging.getLogger(__name__)
+
+# Re-read entries this far behind the newest one seen, to pick up writes from other workers' clocks
+SYNC_OVERLAP = timedelta(seconds=5)
+
+def _epoch(moment: datetime) -> int:
+    """Seconds since the epoch for a naive UTC datetime, as stored by Mongo"""
+    return calendar.timegm(moment.utctimetuple())
+
+class RevocationList:
+    """In-memory view of the `revoked_tokens` collection
+
+    Two kinds of entries are stored: a single token by its `jti` (logout), and
+    a per-user `not_before` that revokes every token issued before it (password
+    change, account lock). Every API worker keeps the whole list in memory and
+    pulls new entries every few seconds, so checking a token never touches
+    Mongo. Entries expire with the tokens they revoke through a TTL index.
+    """
+
+    def __init__(self):
+        self._jtis: Dict[str, float] = {}
+        # user_id -> (cutoff as a JWT `iat`, expiry timestamp)
+        self._not_before: Dict[str, Tuple[int, float]] = {}
+        self._last_seen: Optional[datetime] = None
+        self.counters = {"checks": 0, "revoked_hits": 0, "syncs": 0, "sync_errors": 0}
+
+    def is_revoked(self, jti: Optional[str], user_id: str, issued_at: Optional[int]) -> bool:
+        """Whether a token was logged out, or issued before its user's cutoff"""
+        self.counters["checks"] += 1
+        revoked = jti is not None and jti in self._jtis
+        if not revoked and user_id in self._not_before:
+            # `iat` and the cutoff are both whole seconds, so a token issued in the
+            # same second as the cutoff can't be ordered against it; revoke it too
+            revoked = (issued_at or 0) <= self._not_before[user_id][0]
+        if revoked:
+            self.counters["revoked_hits"] += 1
+        return revoked
+
+    def _apply(self, entry: Dict):
+        expires_at = _epoch(entry["expires_at"]) if entry.get("expires_at") else float("inf")
+        if entry.get("jti"):
+            self._jtis[entry["jti"]] = expires_at
+        elif entry.get("user_id") and entry.get("not_before"):
+            cutoff = _epoch(entry["not_before"])
+            current = self._not_before.get(entry["user_id"])
+            if current is None or cutoff > current[0]:
+                self._not_before[entry["user_id"]] = (cutoff, expires_at)
+        if self._last_seen is None or entry["created_at"] > self._last_seen:
+            self._last_seen = entry["created_at"]
+
+    async def revoke_token(self, jti: str, user_id: str, expires_at: datetime):
+        """Revoke one token until it would have expired anyway"""
+        entry = {"jti": jti, "user_id": user_id, "expires_at": expires_at, "created_at": datetime.utcnow()}
+        await get_collection("revoked_tokens").insert_one(dict(entry))
+        self._apply(entry)
+
+    async def revoke_user(self, user_id: str, token_lifetime: timedelta):
+        """Revoke every token of a user issued until now"""
+        now = datetime.utcnow()
+        entry = {"user_id": user_id, "not_before": now, "expires_at": now + token_lifetime, "created_at": now}
+        await get_collection("revoked_tokens").insert_one(dict(entry))
+        self._apply(entry)
+
+    async def sync(self):
+        """Pull entries added since the last sync and forget expired ones"""
+        filter_dict = {}
+        if self._last_seen is not None:
+            filter_dict["created_at"] = {"$gte": self._last_seen - SYNC_OVERLAP}
+        cursor = get_collection("revoked_tokens").find(filter_dict, {"_id": 0}).sort("created_at", 1)
+        for entry in await cursor.to_list(length=None):
+            self._apply(entry)
+
+        now = time.time()
+        self._jtis = {jti: expires_at for jti, expires_at in self._jtis.items() if expires_at > now}
+        self._not_before = {user_id: entry for user_id, entry in self._not_before.items() if entry[1] > now}
+        self.counters["syncs"] += 1
+
+    async def run_sync(self):
+        """Sync now and then every REVOCATION_SYNC_SECONDS"""
+        interval = float(os.getenv("REVOCATION_SYNC_SECONDS", "5"))
+        while True:
+            try:
+                await self.sync()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.counters["sync_errors"] += 1
+                logger.error(f"Error syncing revoked tokens: {e}")
+            await asyncio.sleep(interval)
+
+    def stats(self) -> Dict:
+        """Counters and list size"""
+        return {
+            **self.counters,
+            "revoked_tokens": len(self._jtis),
+            "revoked_users": len(self._not_before)
+        }
+
+# Create revocation list instance
+revocation_list = RevocationList()
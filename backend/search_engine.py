@@ -0,0 +1,298 @@
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import logging
+import math
+import re
+import time
+import unicodedata
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Searchable fields and how much a match in each counts towards the score
+FIELD_BOOSTS = {"name": 3.0, "category": 1.5, "colors": 1.0, "materials": 1.0, "description": 1.0}
+
+# BM25 saturation and length-normalization parameters
+K1 = 1.2
+B = 0.75
+
+# Fuzzy matches score lower than exact ones
+TYPO_PENALTY = 0.6
+
+# Average field lengths are refreshed after this share of the index has changed
+AVERAGE_REFRESH_RATIO = 0.05
+
+STOPWORDS = frozenset(
+    "a an and are as at be by for from in into is it of on or the this to with".split()
+)
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+def stem(token: str) -> str:
+    """Light English suffix stripping so plurals and simple inflections share a term"""
+    if len(token) <= 3 or token.isdigit():
+        return token
+    for suffix, replacement in (("ies", "y"), ("sses", "ss"), ("ing", ""), ("ed", ""), ("es", ""), ("s", "")):
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+            if suffix == "s" and token.endswith("ss"):
+                return token
+            return token[:-len(suffix)] + replacement
+    return token
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase, strip accents, split into words, drop stopwords and stem"""
+    normalized = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode().lower()
+    return [stem(token) for token in _TOKEN_RE.findall(normalized) if token not in STOPWORDS]
+
+def _deletes(term: str, distance: int) -> Set[str]:
+    """Every string reachable from `term` by deleting up to `distance` characters"""
+    variants = {term}
+    frontier = {term}
+    for _ in range(distance):
+        frontier = {word[:i] + word[i + 1:] for word in frontier for i in range(len(word))}
+        variants |= frontier
+    return variants
+
+def _edit_distance(a: str, b: str, limit: int) -> int:
+    """Damerau-Levenshtein distance, giving up early once it exceeds `limit`"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if previous2 is not None and i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+def max_typos(term: str) -> int:
+    """Allowed edit distance grows with word length; short words must match exactly"""
+    if len(term) < 4:
+        return 0
+    if len(term) < 8:
+        return 1
+    return 2
+
+class SearchEngine:
+    """In-process inverted index over products with BM25F ranking
+
+    Each searchable field is tokenized and stemmed into postings of per-field
+    term frequencies. Scores combine the fields with `FIELD_BOOSTS` and
+    per-field length normalization (BM25F). Query terms missing from the
+    vocabulary are matched to terms within a small edit distance through a
+    symmetric-delete index. Documents can be added, replaced or removed one at
+    a time.
+
+    Each term's per-document BM25 contribution (its "impact") is computed once
+    into NumPy arrays and reused until that term's postings change, so a query
+    is a handful of vectorized adds plus a partial sort. Average field lengths
+    are only refreshed once enough of the index has changed, which keeps
+    single-product updates from invalidating every cached impact.
+    """
+
+    def __init__(self):
+        self.ready = False
+        self.counters = {"queries": 0, "upserts": 0, "removals": 0, "typo_expansions": 0}
+        self.last_load_ms = 0.0
+        self._loading = False
+        self._reset()
+
+    def _reset(self):
+        self._postings: Dict[str, Dict[str, Dict[str, int]]] = defaultdict(dict)
+        self._doc_terms: Dict[str, Set[str]] = {}
+        self._field_lengths: Dict[str, Dict[str, int]] = {}
+        self._total_lengths = {field: 0 for field in FIELD_BOOSTS}
+        self._delete_index: Dict[str, Set[str]] = defaultdict(set)
+        # Dense row numbers for the score arrays; removed rows are left empty
+        self._row_of: Dict[str, int] = {}
+        self._ids: List[Optional[str]] = []
+        self._impacts: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._average_lengths = {field: 1.0 for field in FIELD_BOOSTS}
+        self._changes_since_average = 0
+
+    # ------------------------------------------------------------------
+    # Indexing
+    # ------------------------------------------------------------------
+
+    def load(self, documents: Iterable[Dict]):
+        """Replace the whole index with `documents` (serialized, with string `id`)"""
+        started = time.perf_counter()
+        self._reset()
+        self._loading = True
+        count = 0
+        try:
+            for document in documents:
+                self._upsert(document)
+                count += 1
+        finally:
+            self._loading = False
+        self._refresh_averages()
+        self.ready = True
+        self.last_load_ms = (time.perf_counter() - started) * 1000
+        logger.info(f"Search engine indexed {count} products in {self.last_load_ms:.1f}ms")
+
+    def upsert(self, document: Dict):
+        """Index or re-index one product"""
+        self._upsert(document)
+        self.counters["upserts"] += 1
+
+    def remove(self, product_id: str) -> bool:
+        """Drop one product from the index"""
+        if product_id not in self._doc_terms:
+            return False
+        self._remove(product_id)
+        self._ids[self._row_of.pop(product_id)] = None
+        self.counters["removals"] += 1
+        return True
+
+    def _upsert(self, document: Dict):
+        product_id = document["id"]
+        if product_id in self._doc_terms:
+            self._remove(product_id)
+        if product_id not in self._row_of:
+            self._row_of[product_id] = len(self._ids)
+            self._ids.append(product_id)
+
+        lengths = {}
+        terms = set()
+        for field in FIELD_BOOSTS:
+            value = document.get(field)
+            if isinstance(value, (list, tuple)):
+                value = " ".join(str(item) for item in value)
+            tokens = tokenize(str(value)) if value else []
+            lengths[field] = len(tokens)
+            self._total_lengths[field] += len(tokens)
+            for token in tokens:
+                postings = self._postings[token]
+                if not postings:
+                    self._add_to_vocabulary(token)
+                field_counts = postings.setdefault(product_id, {})
+                field_counts[field] = field_counts.get(field, 0) + 1
+                terms.add(token)
+                self._impacts.pop(token, None)
+
+        self._doc_terms[product_id] = terms
+        self._field_lengths[product_id] = lengths
+        self._note_change()
+
+    def _remove(self, product_id: str):
+        for token in self._doc_terms.pop(product_id):
+            postings = self._postings[token]
+            postings.pop(product_id, None)
+            self._impacts.pop(token, None)
+            if not postings:
+                del self._postings[token]
+                self._remove_from_vocabulary(token)
+        for field, length in self._field_lengths.pop(product_id).items():
+            self._total_lengths[field] -= length
+        self._note_change()
+
+    def _note_change(self):
+        """Refresh average field lengths once enough documents have changed"""
+        self._changes_since_average += 1
+        if self._loading:
+            return
+        if self.ready and self._changes_since_average > AVERAGE_REFRESH_RATIO * len(self._doc_terms):
+            self._refresh_averages()
+
+    def _refresh_averages(self):
+        """Recompute average field lengths and every term's impacts against them"""
+        documents = len(self._doc_terms) or 1
+        self._average_lengths = {field: (total / documents) or 1.0 for field, total in self._total_lengths.items()}
+        self._changes_since_average = 0
+        self._impacts.clear()
+        for term in self._postings:
+            self._impact(term)
+
+    def _impact(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Rows containing `term` and its saturated, boosted BM25F term frequency in each"""
+        cached = self._impacts.get(term)
+        if cached is not None:
+            return cached
+
+        postings = self._postings[term]
+        rows = np.empty(len(postings), dtype=np.int64)
+        impacts = np.empty(len(postings))
+        for index, (product_id, field_counts) in enumerate(postings.items()):
+            lengths = self._field_lengths[product_id]
+            tf = sum(
+                FIELD_BOOSTS[field] * count / (1 - B + B * lengths[field] / self._average_lengths[field])
+                for field, count in field_counts.items()
+            )
+            rows[index] = self._row_of[product_id]
+            impacts[index] = tf * (K1 + 1) / (tf + K1)
+        self._impacts[term] = (rows, impacts)
+        return rows, impacts
+
+    def _add_to_vocabulary(self, term: str):
+        for variant in _deletes(term, max_typos(term)):
+            self._delete_index[variant].add(term)
+
+    def _remove_from_vocabulary(self, term: str):
+        for variant in _deletes(term, max_typos(term)):
+            terms = self._delete_index.get(variant)
+            if terms is not None:
+                terms.discard(term)
+                if not terms:
+                    del self._delete_index[variant]
+
+    # ------------------------------------------------------------------
+    # Querying
+    # ------------------------------------------------------------------
+
+    def expand(self, term: str) -> List[Tuple[str, float]]:
+        """Vocabulary terms to look up for a query term, with their weight"""
+        if term in self._postings:
+            return [(term, 1.0)]
+
+        distance = max_typos(term)
+        if not distance:
+            return []
+        candidates = set()
+        for variant in _deletes(term, distance):
+            candidates |= self._delete_index.get(variant, set())
+        matches = [(candidate, TYPO_PENALTY) for candidate in candidates if _edit_distance(term, candidate, distance) <= distance]
+        if matches:
+            self.counters["typo_expansions"] += 1
+        return matches
+
+    def search(self, query: str, limit: Optional[int] = None) -> List[Tuple[str, float]]:
+        """Return (product_id, score) pairs, best first, for any matching query term"""
+        self.counters["queries"] += 1
+        documents = len(self._doc_terms)
+        if not documents:
+            return []
+
+        scores = np.zeros(len(self._ids))
+        for term in dict.fromkeys(tokenize(query)):
+            for match, weight in self.expand(term):
+                rows, impacts = self._impact(match)
+                idf = math.log(1 + (documents - len(rows) + 0.5) / (len(rows) + 0.5))
+                scores[rows] += (weight * idf) * impacts
+
+        hits = np.flatnonzero(scores)
+        if limit is not None and len(hits) > limit:
+            hits = hits[np.argpartition(-scores[hits], limit - 1)[:limit]]
+        ranked = [(self._ids[row], float(scores[row])) for row in hits]
+        ranked.sort(key=lambda item: (-item[1], item[0]))
+        return ranked
+
+    def stats(self) -> Dict:
+        """Counters and index size"""
+        return {
+            **self.counters,
+            "ready": self.ready,
+            "products": len(self._doc_terms),
+            "terms": len(self._postings),
+            "last_load_ms": round(self.last_load_ms, 2)
+        }
+
+# Create engine instance
+search_engine = SearchEngine()
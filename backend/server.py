@@ -1,19 +1,42 @@
-from fastapi import FastAPI, APIRouter, HTTPException, status, Depends, Query
+from fastapi import FastAPI, APIRouter, HTTPException, status, Depends, Header, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPAuthorizationCredentials
 from contextlib import asynccontextmanager
 from typing import List, Optional, Dict, Any
 import os
+import asyncio
 import logging
 from pathlib import Path
 from datetime import datetime, timedelta
 import random
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
 
 # Import models and services
 from models import *
 from database import *
-from auth import auth_service
-from email_service import send_order_confirmation_email
+from auth import auth_service, security
+from rate_limit import auth_admission, client_ip
+from revocation import revocation_list
+from hashing import password_pool
+from outbox import email_outbox
+import cart_store
+from cart_store import cart_summaries, get_cart_store
+from guest_cart import GuestCart, InvalidGuestCart, merge_guest_cart
+from inventory import InsufficientStock, ReservationInProgress, inventory
+from waiting_room import NotAdmitted, TicketRequired, parse_tickets, waiting_room
+from price_alerts import price_alert_engine
+import catalog
+from catalog import (
+    MAX_BATCH_IDS, WISHLIST_PRODUCT_PROJECTION, InvalidFields, get_product_by_id, get_products_by_ids,
+    catalog_flights, invalidate_all_products, list_categories, list_products, listing_cache, parse_fields,
+    RELEVANCE_SORT, product_cache, seek_products, start_product_indexes
+)
+from catalog_engine import catalog_engine
+from search_engine import search_engine
+from suggestions import suggest_index
+from recommendations import recommendation_engine, run_recommendation_refresher
+from pagination import InvalidCursor, build_keyset_filter, build_sort, decode_cursor, next_cursor, resolve_sort
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -28,8 +51,19 @@ async def lifespan(app: FastAPI):
     # Startup
     await connect_to_mongo()
     await seed_initial_data()
+    await start_product_indexes()
+    recommendation_refresher = asyncio.create_task(run_recommendation_refresher())
+    revocation_sync = asyncio.create_task(revocation_list.run_sync())
+    email_outbox.start()
+    price_alerts = asyncio.create_task(price_alert_engine.run())
+    stock_sweeper = asyncio.create_task(inventory.run_sweeper())
     yield
     # Shutdown
+    stock_sweeper.cancel()
+    price_alerts.cancel()
+    email_outbox.stop()
+    recommendation_refresher.cancel()
+    revocation_sync.cancel()
     await close_mongo_connection()
 
 # Create the main app
@@ -52,9 +86,10 @@ app.add_middleware(
 # ========================================
 
 @api_router.post("/auth/signup", response_model=SuccessResponse)
-async def signup(user_create: UserCreate):
+async def signup(user_create: UserCreate, request: Request):
     """Register a new user and send verification email"""
     try:
+        auth_service.admit_signup(client_ip(request.headers, request.client and request.client.host))
         user = await auth_service.create_user(user_create)
         return SuccessResponse(
             message="Account created successfully! Please check your email for verification code.",
@@ -79,9 +114,10 @@ async def verify_email(verification: EmailVerification):
         raise HTTPException(status_code=500, detail="Internal server error")
 
 @api_router.post("/auth/login")
-async def login(user_login: UserLogin):
-    """Login user and return access token"""
+async def login(user_login: UserLogin, request: Request, x_guest_cart: Optional[str] = Header(None)):
+    """Login user and return access token, merging in the guest cart sent in X-Guest-Cart"""
     try:
+        auth_service.admit_login(client_ip(request.headers, request.client and request.client.host), user_login.email)
         user = await auth_service.authenticate_user(user_login.email, user_login.password)
         if not user:
             raise HTTPException(
@@ -95,10 +131,19 @@ async def login(user_login: UserLogin):
                 detail="Please verify your email address before logging in"
             )
         
-        access_token = auth_service.create_access_token(data={"sub": user.id})
+        access_token = auth_service.create_user_token(user)
+        
+        # A guest cart that can't be merged is dropped rather than failing the login
+        guest_cart_merged = 0
+        try:
+            guest_cart_merged = await merge_guest_cart(user.id, x_guest_cart)
+        except Exception as e:
+            logger.warning(f"Guest cart not merged for {user.email}: {e}")
+        
         return {
             "access_token": access_token,
             "token_type": "bearer",
+            "guest_cart_merged": guest_cart_merged,
             "user": UserResponse(
                 id=user.id,
                 email=user.email,
@@ -113,8 +158,20 @@ async def login(user_login: UserLogin):
         logger.error(f"Login error: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@api_router.post("/auth/logout", response_model=SuccessResponse)
+async def logout(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """Revoke the access token used for this request"""
+    try:
+        await auth_service.revoke_token(credentials.credentials)
+        return SuccessResponse(message="Logged out successfully")
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        logger.error(f"Logout error: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
 @api_router.get("/auth/me", response_model=UserResponse)
-async def get_current_user_profile(current_user: User = Depends(auth_service.get_current_user)):
+async def get_current_user_profile(current_user: User = Depends(auth_service.get_current_user_record)):
     """Get current user profile"""
     return UserResponse(
         id=current_user.id,
@@ -139,11 +196,23 @@ async def get_products(
     on_sale: Optional[bool] = None,
     featured: Optional[bool] = None,
     search: Optional[str] = None,
-    sort_by: str = "name",
+    sort_by: Optional[str] = None,
     page: int = Query(1, ge=1),
-    limit: int = Query(20, ge=1, le=100)
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    facets: bool = False,
+    total_mode: str = Query("exact", pattern="^(exact|cached)$"),
+    fields: Optional[str] = None
 ):
-    """Get products with filtering, sorting, and pagination"""
+    """Get products with filtering, sorting, and pagination
+
+    Pass `page` for offset pagination with totals, or `cursor` (empty for the
+    first page, then each response's `next_cursor`) for keyset pagination.
+    In page mode `facets=true` adds colour, size, material and price-range
+    counts, and `total_mode=cached` reuses recent totals for the same filter.
+    `fields` (comma-separated) limits which product fields are returned.
+    Searches are ordered by relevance unless another `sort_by` is given.
+    """
     try:
         # Build filter
         filter_dict = {}
@@ -170,46 +239,149 @@ async def get_products(
         if search:
             filter_dict["$text"] = {"$search": search}
 
-        # Build sort
-        sort_dict = {}
-        if sort_by == "price-low":
-            sort_dict["price"] = 1
-        elif sort_by == "price-high":
-            sort_dict["price"] = -1
-        elif sort_by == "rating":
-            sort_dict["rating"] = -1
-        elif sort_by == "newest":
-            sort_dict["created_at"] = -1
+        # Build sort (with an _id tiebreaker so pages never overlap)
+        if search and sort_by in (None, "relevance"):
+            if cursor is not None:
+                raise HTTPException(status_code=400, detail="Cursor pagination is not available for relevance sort")
+            sort_by, sort_dict = "relevance", RELEVANCE_SORT
+            projection = parse_fields(fields)
         else:
-            sort_dict["name"] = 1
+            sort_by, sort_field, _ = resolve_sort(sort_by)
+            sort_dict = build_sort(sort_by)
+
+            # Keep the sort key in sparse responses so the next cursor can be built
+            projection = parse_fields(fields, required=(sort_field,))
+
+        if cursor is not None:
+            # Keyset mode: seek past the last seen (sort value, _id) instead of
+            # skipping, so every page costs the same regardless of depth
+            page_filter = filter_dict
+            if cursor:
+                value, last_id = decode_cursor(cursor, sort_by)
+                keyset_filter = build_keyset_filter(sort_by, value, last_id)
+                page_filter = {"$and": [filter_dict, keyset_filter]} if filter_dict else keyset_filter
+
+            products = await seek_products(page_filter, sort_dict, limit + 1, projection)
+            has_more = len(products) > limit
+            products = products[:limit]
+
+            return {
+                "products": products,
+                "limit": limit,
+                "sort_by": sort_by,
+                "has_more": has_more,
+                "next_cursor": next_cursor(sort_by, products[-1]) if has_more else None
+            }
 
         # Calculate skip
         skip = (page - 1) * limit
 
-        # Get products
-        products = await find_many("products", filter_dict, sort_dict, skip, limit)
-        total_count = await count_documents("products", filter_dict)
+        # Get the page, total and facet counts in a single aggregation
+        listing = await list_products(
+            filter_dict, sort_dict, skip, limit,
+            include_facets=facets,
+            total_mode=total_mode,
+            projection=projection
+        )
+        total_count = listing["total"]
 
-        return {
-            "products": products,
+        response = {
+            "products": listing["products"],
             "total": total_count,
             "page": page,
             "limit": limit,
             "total_pages": (total_count + limit - 1) // limit
         }
+        if facets:
+            response["facets"] = listing["facets"]
+        return response
+    except (InvalidCursor, InvalidFields) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException as e:
+        raise e
     except Exception as e:
         logger.error(f"Get products error: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@api_router.get("/products/suggest")
+async def suggest_products(
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(8, ge=1, le=10)
+):
+    """Get typeahead suggestions for the search box"""
+    try:
+        return {"suggestions": suggest_index.suggest(q, limit)}
+    except Exception as e:
+        logger.error(f"Suggest products error: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@api_router.get("/products/recommendations")
+async def get_batch_recommendations(
+    ids: str = Query(..., min_length=1),
+    limit: int = Query(8, ge=1, le=20),
+    fields: Optional[str] = None
+):
+    """Get merged recommendations for several products, e.g. a cart or wishlist"""
+    try:
+        product_ids = list(dict.fromkeys(i.strip() for i in ids.split(",") if i.strip()))
+        if len(product_ids) > MAX_BATCH_IDS:
+            raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_IDS} ids are allowed")
+
+        projection = parse_fields(fields)
+        neighbour_ids, missing = recommendation_engine.lookup_many(product_ids, limit)
+        recommendations = await get_products_by_ids(neighbour_ids, projection)
+
+        # Products not in the precomputed table: top rated items from their categories, in one query
+        if missing and len(recommendations) < limit:
+            missing_products = await get_products_by_ids(missing, {"category": 1})
+            categories = list({product["category"] for product in missing_products})
+            if categories:
+                exclude = product_ids + [product["id"] for product in recommendations]
+                filter_dict = {"category": {"$in": categories}, "_id": {"$nin": decode_ids(exclude)}}
+                recommendations += await find_many(
+                    "products", filter_dict, {"rating": -1}, 0, limit - len(recommendations), projection
+                )
+
+        return {"recommendations": recommendations}
+
+    except InvalidFields as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        logger.error(f"Get batch recommendations error: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@api_router.get("/products/batch")
+async def get_products_batch(ids: str = Query(..., min_length=1), fields: Optional[str] = None):
+    """Get several products by ID in one request, in the order requested"""
+    try:
+        product_ids = list(dict.fromkeys(i.strip() for i in ids.split(",") if i.strip()))
+        if len(product_ids) > MAX_BATCH_IDS:
+            raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_IDS} ids are allowed")
+
+        products = await get_products_by_ids(product_ids, parse_fields(fields))
+        found = {product["id"] for product in products}
+        return {"products": products, "missing": [product_id for product_id in product_ids if product_id not in found]}
+    except InvalidFields as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        logger.error(f"Get products batch error: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
 @api_router.get("/products/{product_id}")
-async def get_product(product_id: str):
+async def get_product(product_id: str, fields: Optional[str] = None):
     """Get a single product by ID"""
     try:
-        product = await find_one("products", {"_id": product_id})
+        product = await get_product_by_id(product_id, parse_fields(fields))
         if not product:
             raise HTTPException(status_code=404, detail="Product not found")
         
         return product
+    except InvalidFields as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except HTTPException as e:
         raise e
     except Exception as e:
@@ -217,23 +389,30 @@ async def get_product(product_id: str):
         raise HTTPException(status_code=500, detail="Internal server error")
 
 @api_router.get("/products/{product_id}/recommendations")
-async def get_product_recommendations(product_id: str, limit: int = 4):
+async def get_product_recommendations(product_id: str, limit: int = 4, fields: Optional[str] = None):
     """Get recommended products based on current product"""
     try:
         # Get current product to find similar items
-        current_product = await find_one("products", {"_id": product_id})
+        current_product = await get_product_by_id(product_id)
         if not current_product:
             raise HTTPException(status_code=404, detail="Product not found")
         
-        # Find products in same category, excluding current product
+        projection = parse_fields(fields)
+        neighbour_ids = recommendation_engine.lookup(product_id, limit)
+        if neighbour_ids:
+            return {"recommendations": await get_products_by_ids(neighbour_ids, projection)}
+        
+        # Not in the precomputed table yet: find products in same category, excluding current product
         filter_dict = {
             "category": current_product["category"],
-            "_id": {"$ne": product_id}
+            "_id": {"$ne": decode_id(product_id)}
         }
         
-        recommendations = await find_many("products", filter_dict, {"rating": -1}, 0, limit)
+        recommendations = await find_many("products", filter_dict, {"rating": -1}, 0, limit, projection)
         return {"recommendations": recommendations}
         
+    except InvalidFields as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except HTTPException as e:
         raise e
     except Exception as e:
@@ -245,23 +424,7 @@ async def get_categories():
     """Get all product categories"""
     try:
         # Get categories with product counts
-        pipeline = [
-            {"$group": {"_id": "$category", "count": {"$sum": 1}}},
-            {"$sort": {"_id": 1}}
-        ]
-        
-        collection = get_collection("products")
-        result = await collection.aggregate(pipeline).to_list(length=None)
-        
-        categories = []
-        for item in result:
-            category_name = item["_id"]
-            categories.append({
-                "name": category_name.title(),
-                "slug": category_name,
-                "product_count": item["count"]
-            })
-        
+        categories = await list_categories()
         return {"categories": categories}
     except Exception as e:
         logger.error(f"Get categories error: {e}")
@@ -271,92 +434,79 @@ async def get_categories():
 # CART ENDPOINTS
 # ========================================
 
+def build_cart_response(lines: List[Dict]) -> CartResponse:
+    """Add line subtotals and cart totals to cart lines"""
+    items = []
+    total_items = 0
+    subtotal = 0.0
+    
+    for line in lines:
+        cart_item = {**line, "subtotal": line["price"] * line["quantity"]}
+        items.append(cart_item)
+        total_items += line["quantity"]
+        subtotal += cart_item["subtotal"]
+    
+    return CartResponse(items=items, total_items=total_items, subtotal=subtotal)
+
 @api_router.get("/cart", response_model=CartResponse)
 async def get_cart(current_user: User = Depends(auth_service.get_current_user)):
     """Get user's cart items"""
     try:
         # Get cart items with product details
-        pipeline = [
-            {"$match": {"user_id": current_user.id}},
-            {"$lookup": {
-                "from": "products",
-                "localField": "product_id",
-                "foreignField": "_id",
-                "as": "product"
-            }},
-            {"$unwind": "$product"},
-            {"$sort": {"added_at": -1}}
-        ]
-        
-        collection = get_collection("cart_items")
-        cart_items = await collection.aggregate(pipeline).to_list(length=None)
-        
-        # Process cart items and calculate totals
-        items = []
-        total_items = 0
-        subtotal = 0.0
-        
-        for item in cart_items:
-            product = item["product"]
-            cart_item = {
-                "id": str(item["_id"]),
-                "product_id": str(product["_id"]),
-                "name": product["name"],
-                "price": product["price"],
-                "image": product["images"][0] if product["images"] else "",
-                "quantity": item["quantity"],
-                "selected_size": item.get("selected_size"),
-                "selected_color": item.get("selected_color"),
-                "subtotal": product["price"] * item["quantity"]
-            }
-            items.append(cart_item)
-            total_items += item["quantity"]
-            subtotal += cart_item["subtotal"]
-        
-        return CartResponse(items=items, total_items=total_items, subtotal=subtotal)
+        return build_cart_response(await get_cart_store().lines(current_user.id))
         
     except Exception as e:
         logger.error(f"Get cart error: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+def enforce_waiting_room(product: Dict, user_id: str, x_waiting_room_ticket: Optional[str]):
+    """Let a waiting-room product through only with an admitted ticket"""
+    if not product.get("waiting_room"):
+        return
+    try:
+        waiting_room.check(product["id"], user_id, parse_tickets(x_waiting_room_ticket))
+    except TicketRequired:
+        raise HTTPException(status_code=403, detail=f"{product['name']} requires a waiting room ticket")
+    except NotAdmitted as e:
+        raise HTTPException(
+            status_code=429,
+            detail=f"You are number {e.position} in the waiting room for {product['name']}",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+async def enforce_cart_waiting_room(lines: List[Dict], user_id: str, x_waiting_room_ticket: Optional[str]):
+    """Check the waiting room for every flagged product among cart lines"""
+    for product in await get_products_by_ids(
+        [line["product_id"] for line in lines], {"name": 1, "waiting_room": 1}
+    ):
+        enforce_waiting_room(product, user_id, x_waiting_room_ticket)
+
+@api_router.get("/cart/summary")
+async def get_cart_summary(current_user: User = Depends(auth_service.get_current_user)):
+    """Get the cart item count and subtotal, e.g. for the navbar badge"""
+    try:
+        return await cart_store.get_cart_summary(current_user.id)
+        
+    except Exception as e:
+        logger.error(f"Get cart summary error: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
 @api_router.post("/cart/items", response_model=SuccessResponse)
 async def add_to_cart(
     item: CartItemCreate,
-    current_user: User = Depends(auth_service.get_current_user)
+    current_user: User = Depends(auth_service.get_current_user),
+    x_waiting_room_ticket: Optional[str] = Header(None)
 ):
     """Add item to cart"""
     try:
         # Check if product exists
-        product = await find_one("products", {"_id": item.product_id})
+        product = await get_product_by_id(item.product_id)
         if not product:
             raise HTTPException(status_code=404, detail="Product not found")
+        enforce_waiting_room(product, current_user.id, x_waiting_room_ticket)
         
-        # Check if item already exists in cart
-        existing_item = await find_one("cart_items", {
-            "user_id": current_user.id,
-            "product_id": item.product_id,
-            "selected_size": item.selected_size,
-            "selected_color": item.selected_color
-        })
-        
-        if existing_item:
-            # Update quantity
-            new_quantity = existing_item["quantity"] + item.quantity
-            await update_one("cart_items", {"_id": existing_item["id"]}, {
-                "quantity": new_quantity
-            })
-        else:
-            # Create new cart item
-            cart_item = CartItem(
-                user_id=current_user.id,
-                product_id=item.product_id,
-                quantity=item.quantity,
-                selected_size=item.selected_size,
-                selected_color=item.selected_color
-            )
-            cart_dict = cart_item.dict()
-            cart_dict.pop('id', None)
-            await insert_one("cart_items", cart_dict)
+        # Add to the matching cart line, creating it if needed
+        await get_cart_store().add(current_user.id, product, item.quantity, item.selected_size, item.selected_color)
         
         return SuccessResponse(message="Item added to cart successfully")
         
@@ -374,14 +524,10 @@ async def update_cart_item(
 ):
     """Update cart item quantity"""
     try:
-        # Check if item exists and belongs to user
-        item = await find_one("cart_items", {"_id": item_id, "user_id": current_user.id})
-        if not item:
+        # Update quantity, only if the item belongs to the user
+        if not await get_cart_store().set_quantity(current_user.id, item_id, update_data.quantity):
             raise HTTPException(status_code=404, detail="Cart item not found")
         
-        # Update quantity
-        await update_one("cart_items", {"_id": item_id}, {"quantity": update_data.quantity})
-        
         return SuccessResponse(message="Cart item updated successfully")
         
     except HTTPException as e:
@@ -397,14 +543,10 @@ async def remove_from_cart(
 ):
     """Remove item from cart"""
     try:
-        # Check if item exists and belongs to user
-        item = await find_one("cart_items", {"_id": item_id, "user_id": current_user.id})
-        if not item:
+        # Delete item, only if it belongs to the user
+        if not await get_cart_store().remove(current_user.id, item_id):
             raise HTTPException(status_code=404, detail="Cart item not found")
         
-        # Delete item
-        await delete_one("cart_items", {"_id": item_id})
-        
         return SuccessResponse(message="Item removed from cart successfully")
         
     except HTTPException as e:
@@ -417,13 +559,119 @@ async def remove_from_cart(
 async def clear_cart(current_user: User = Depends(auth_service.get_current_user)):
     """Clear all items from cart"""
     try:
-        deleted_count = await delete_many("cart_items", {"user_id": current_user.id})
+        deleted_count = await get_cart_store().clear(current_user.id)
         return SuccessResponse(message=f"Cart cleared successfully. {deleted_count} items removed.")
         
     except Exception as e:
         logger.error(f"Clear cart error: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+# ========================================
+# GUEST CART ENDPOINTS
+# ========================================
+
+def load_guest_cart(x_guest_cart: Optional[str] = Header(None)) -> GuestCart:
+    """Decode the guest cart token from the X-Guest-Cart header"""
+    try:
+        return GuestCart.decode(x_guest_cart)
+    except InvalidGuestCart as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def guest_cart_response(cart: GuestCart) -> Dict[str, Any]:
+    """The priced guest cart together with its re-signed token"""
+    return {**build_cart_response(await cart.priced_lines()).dict(), "token": cart.encode()}
+
+@api_router.get("/guest-cart")
+async def get_guest_cart(cart: GuestCart = Depends(load_guest_cart)):
+    """Get the guest cart held in the X-Guest-Cart token"""
+    try:
+        return await guest_cart_response(cart)
+        
+    except Exception as e:
+        logger.error(f"Get guest cart error: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@api_router.post("/guest-cart/items")
+async def add_to_guest_cart(item: CartItemCreate, cart: GuestCart = Depends(load_guest_cart)):
+    """Add item to the guest cart and return the new token"""
+    try:
+        product = await get_product_by_id(item.product_id)
+        if not product:
+            raise HTTPException(status_code=404, detail="Product not found")
+        if product.get("waiting_room"):
+            raise HTTPException(status_code=403, detail=f"Sign in and join the waiting room to buy {product['name']}")
+        
+        cart.add(item.product_id, item.quantity, item.selected_size, item.selected_color)
+        return await guest_cart_response(cart)
+        
+    except InvalidGuestCart as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        logger.error(f"Add to guest cart error: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@api_router.put("/guest-cart/items/{item_id}")
+async def update_guest_cart_item(item_id: str, update_data: CartItemUpdate, cart: GuestCart = Depends(load_guest_cart)):
+    """Update guest cart item quantity and return the new token"""
+    try:
+        if not cart.set_quantity(item_id, update_data.quantity):
+            raise HTTPException(status_code=404, detail="Cart item not found")
+        return await guest_cart_response(cart)
+        
+    except InvalidGuestCart as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        logger.error(f"Update guest cart item error: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@api_router.delete("/guest-cart/items/{item_id}")
+async def remove_from_guest_cart(item_id: str, cart: GuestCart = Depends(load_guest_cart)):
+    """Remove item from the guest cart and return the new token"""
+    try:
+        if not cart.remove(item_id):
+            raise HTTPException(status_code=404, detail="Cart item not found")
+        return await guest_cart_response(cart)
+        
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        logger.error(f"Remove from guest cart error: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+# ========================================
+# WAITING ROOM ENDPOINTS
+# ========================================
+
+@api_router.post("/waiting-room/{product_id}/join")
+async def join_waiting_room(product_id: str, current_user: User = Depends(auth_service.get_current_user)):
+    """Take a ticket for a waiting-room product"""
+    try:
+        product = await get_product_by_id(product_id, {"waiting_room": 1})
+        if not product:
+            raise HTTPException(status_code=404, detail="Product not found")
+        if not product.get("waiting_room"):
+            raise HTTPException(status_code=400, detail="This product has no waiting room")
+        
+        return waiting_room.join(product_id, current_user.id)
+        
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        logger.error(f"Join waiting room error: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@api_router.get("/waiting-room/{product_id}")
+async def get_waiting_room_status(product_id: str, x_waiting_room_ticket: str = Header(...)):
+    """Queue position of the ticket in X-Waiting-Room-Ticket; cheap enough to poll"""
+    status_info = waiting_room.status(product_id, x_waiting_room_ticket)
+    if status_info is None:
+        raise HTTPException(status_code=404, detail="Ticket not valid, please join again")
+    return status_info
+
 # ========================================
 # WISHLIST ENDPOINTS  
 # ========================================
@@ -435,12 +683,7 @@ async def get_wishlist(current_user: User = Depends(auth_service.get_current_use
         # Get wishlist items with product details
         pipeline = [
             {"$match": {"user_id": current_user.id}},
-            {"$lookup": {
-                "from": "products", 
-                "localField": "product_id",
-                "foreignField": "_id",
-                "as": "product"
-            }},
+            lookup_by_id("products", "product_id", "product", WISHLIST_PRODUCT_PROJECTION),
             {"$unwind": "$product"},
             {"$sort": {"added_at": -1}}
         ]
@@ -452,9 +695,9 @@ async def get_wishlist(current_user: User = Depends(auth_service.get_current_use
         for item in wishlist_items:
             product = item["product"]
             wishlist_item = {
-                "id": str(item["_id"]),
+                "id": encode_id(item["_id"]),
                 "product": {
-                    "id": str(product["_id"]),
+                    "id": encode_id(product["_id"]),
                     "name": product["name"],
                     "price": product["price"],
                     "original_price": product.get("original_price"),
@@ -481,27 +724,21 @@ async def add_to_wishlist(
     """Add item to wishlist"""
     try:
         # Check if product exists
-        product = await find_one("products", {"_id": item.product_id})
+        product = await get_product_by_id(item.product_id)
         if not product:
             raise HTTPException(status_code=404, detail="Product not found")
         
-        # Check if already in wishlist
-        existing_item = await find_one("wishlist_items", {
-            "user_id": current_user.id,
-            "product_id": item.product_id
-        })
-        
-        if existing_item:
-            raise HTTPException(status_code=400, detail="Item already in wishlist")
-        
-        # Add to wishlist
+        # Add to wishlist; the unique (user_id, product_id) index rejects duplicates
         wishlist_item = WishlistItem(
             user_id=current_user.id,
             product_id=item.product_id
         )
         wishlist_dict = wishlist_item.dict()
         wishlist_dict.pop('id', None)
-        await insert_one("wishlist_items", wishlist_dict)
+        try:
+            await insert_one("wishlist_items", wishlist_dict)
+        except DuplicateKeyError:
+            raise HTTPException(status_code=400, detail="Item already in wishlist")
         
         return SuccessResponse(message="Item added to wishlist successfully")
         
@@ -518,17 +755,9 @@ async def remove_from_wishlist(
 ):
     """Remove item from wishlist"""
     try:
-        # Check if item exists
-        item = await find_one("wishlist_items", {
-            "user_id": current_user.id,
-            "product_id": product_id
-        })
-        
-        if not item:
-            raise HTTPException(status_code=404, detail="Item not found in wishlist")
-        
         # Delete item
-        await delete_one("wishlist_items", {"_id": item["id"]})
+        if not await delete_one("wishlist_items", {"user_id": current_user.id, "product_id": product_id}):
+            raise HTTPException(status_code=404, detail="Item not found in wishlist")
         
         return SuccessResponse(message="Item removed from wishlist successfully")
         
@@ -542,15 +771,74 @@ async def remove_from_wishlist(
 # ORDER ENDPOINTS
 # ========================================
 
+def insufficient_stock_error(error: InsufficientStock, lines: List[Dict]) -> HTTPException:
+    """409 naming the cart lines that are out of stock"""
+    names = {line["product_id"]: line["name"] for line in lines}
+    return HTTPException(
+        status_code=409,
+        detail=f"Not enough stock for {', '.join(names.get(product_id, product_id) for product_id in error.product_ids)}"
+    )
+
+def reservation_in_progress_error() -> HTTPException:
+    """409 for a checkout racing another checkout of the same user"""
+    return HTTPException(status_code=409, detail="Another checkout is already reserving stock, please try again")
+
+@api_router.post("/checkout/reserve", response_model=SuccessResponse)
+async def reserve_checkout(
+    current_user: User = Depends(auth_service.get_current_user),
+    x_waiting_room_ticket: Optional[str] = Header(None)
+):
+    """Hold stock for the cart while the user checks out, replacing any earlier hold"""
+    try:
+        lines = await get_cart_store().checkout_lines(current_user.id)
+        if not lines:
+            raise HTTPException(status_code=400, detail="Cart is empty")
+        await enforce_cart_waiting_room(lines, current_user.id, x_waiting_room_ticket)
+        
+        try:
+            reservation = await inventory.reserve(current_user.id, lines)
+        except InsufficientStock as e:
+            raise insufficient_stock_error(e, lines)
+        except ReservationInProgress:
+            raise reservation_in_progress_error()
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        return SuccessResponse(
+            message="Stock reserved",
+            data={"reservation_id": reservation["_id"], "expires_at": reservation["expires_at"]}
+        )
+        
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        logger.error(f"Reserve checkout error: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@api_router.delete("/checkout/reserve/{reservation_id}", response_model=SuccessResponse)
+async def release_checkout(reservation_id: str, current_user: User = Depends(auth_service.get_current_user)):
+    """Give back stock held for an abandoned checkout"""
+    try:
+        if not await inventory.release(reservation_id, {"user_id": current_user.id}):
+            raise HTTPException(status_code=404, detail="Reservation not found")
+        return SuccessResponse(message="Reservation released")
+        
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        logger.error(f"Release checkout error: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
 @api_router.post("/orders", response_model=SuccessResponse)
 async def create_order(
     order_create: OrderCreate,
-    current_user: User = Depends(auth_service.get_current_user)
+    current_user: User = Depends(auth_service.get_current_user),
+    x_waiting_room_ticket: Optional[str] = Header(None)
 ):
     """Create a new order from cart items"""
     try:
-        # Get cart items
-        cart_response = await get_cart(current_user)
+        # Get cart items, priced from the current catalog
+        cart_response = build_cart_response(await get_cart_store().checkout_lines(current_user.id))
         if not cart_response.items:
             raise HTTPException(status_code=400, detail="Cart is empty")
         
@@ -568,6 +856,26 @@ async def create_order(
             )
             order_items.append(order_item)
         
+        # Waiting-room products can only be ordered with an admitted ticket
+        await enforce_cart_waiting_room(cart_response.items, current_user.id, x_waiting_room_ticket)
+        
+        # Hold stock for every line, reusing the checkout reservation if it still matches the cart
+        reservation = None
+        if order_create.reservation_id:
+            reservation = await inventory.get_reservation(order_create.reservation_id, current_user.id)
+            if reservation and not inventory.covers(reservation, cart_response.items):
+                await inventory.release(reservation["_id"])
+                reservation = None
+        try:
+            if reservation is None:
+                reservation = await inventory.reserve(current_user.id, cart_response.items)
+        except InsufficientStock as e:
+            raise insufficient_stock_error(e, cart_response.items)
+        except ReservationInProgress:
+            raise reservation_in_progress_error()
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
         # Calculate totals
         subtotal = cart_response.subtotal
         shipping_cost = 15.0 if subtotal < 200 else 0.0
@@ -587,21 +895,27 @@ async def create_order(
             payment_method=order_create.payment_method
         )
         
-        # Save order
+        # Commit the stock to the order, then save it; the stock goes back if saving fails
         order_dict = order.dict()
         order_dict.pop('id', None)
-        # Convert OrderItem objects to dicts
-        order_dict['items'] = [item.dict() for item in order_dict['items']]
-        order_id = await insert_one("orders", order_dict)
+        order_dict["_id"] = ObjectId()
+        order_id = encode_id(order_dict["_id"])
+        if not await inventory.commit(reservation["_id"], order_id):
+            raise HTTPException(status_code=409, detail="Stock reservation expired, please try again")
+        try:
+            await insert_one("orders", order_dict)
+        except Exception:
+            await inventory.release(reservation["_id"], status="committed")
+            raise
         
         # Clear cart after successful order
         await clear_cart(current_user)
         
-        # Send order confirmation email
+        # Queue order confirmation email
         try:
-            await send_order_confirmation_email(current_user.email, order_id, total)
+            await email_outbox.enqueue("order_confirmation", current_user.email, order_id=order_id, total=total)
         except Exception as e:
-            logger.error(f"Failed to send order confirmation email: {e}")
+            logger.error(f"Failed to queue order confirmation email: {e}")
         
         return SuccessResponse(
             message="Order placed successfully!",
@@ -632,7 +946,7 @@ async def get_order(
 ):
     """Get specific order details"""
     try:
-        order = await find_one("orders", {"_id": order_id, "user_id": current_user.id})
+        order = await find_one("orders", {"_id": decode_id(order_id), "user_id": current_user.id})
         if not order:
             raise HTTPException(status_code=404, detail="Order not found")
         
@@ -644,6 +958,32 @@ async def get_order(
         logger.error(f"Get order error: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+# ========================================
+# METRICS ENDPOINTS
+# ========================================
+
+@api_router.get("/metrics")
+async def get_metrics(admin: User = Depends(auth_service.get_current_admin)):
+    """Get in-process cache and performance counters (admins only)"""
+    return {
+        "product_cache": product_cache.stats(),
+        "listing_cache": {**listing_cache.stats(), "generation": catalog.catalog_generation},
+        "catalog_flights": catalog_flights.stats(),
+        "catalog_engine": catalog_engine.stats(),
+        "search_engine": search_engine.stats(),
+        "suggest_index": suggest_index.stats(),
+        "recommendations": recommendation_engine.stats(),
+        "password_pool": password_pool.stats(),
+        "auth_admission": auth_admission.stats(),
+        "principal_cache": auth_service.principal_cache.stats(),
+        "revocation_list": revocation_list.stats(),
+        "email_outbox": email_outbox.stats(),
+        "price_alerts": price_alert_engine.stats(),
+        "cart_summaries": cart_summaries.stats(),
+        "inventory": inventory.stats(),
+        "waiting_room": waiting_room.stats()
+    }
+
 # ========================================
 # SEED DATA FUNCTION
 # ========================================
@@ -709,7 +1049,8 @@ async def seed_initial_data():
                 "on_sale": False,
                 "rating": 4.9,
                 "reviews_count": 203,
-                "stock_quantity": 15
+                "stock_quantity": 15,
+                "waiting_room": True
             },
             {
                 "name": "Minimalist Court Classic",
@@ -833,8 +1174,10 @@ async def seed_initial_data():
         ]
         
         # Insert all products
+        now = datetime.utcnow()
         for product_data in mock_products:
-            await insert_one("products", product_data)
+            await insert_one("products", {**product_data, "created_at": now, "updated_at": now})
+        invalidate_all_products()
         
         logger.info(f"Seeded {len(mock_products)} products successfully")
         
@@ -0,0 +1,57 @@
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Hashable
+import asyncio
+
+class SingleFlight:
+    """Coalesce concurrent identical async calls into one in-flight call
+
+    The first caller for a key starts the call; everyone else arriving before it
+    finishes awaits the same result (or exception). The call runs as its own
+    task, so a leader whose request is cancelled doesn't fail its followers.
+    """
+
+    def __init__(self, recent_flights: int = 20):
+        self._inflight: Dict[Hashable, list] = {}
+        self.counters = {
+            "flights": 0,
+            "absorbed": 0,
+            "max_absorbed": 0,
+            "errors": 0
+        }
+        # The most recent flights that absorbed at least one duplicate call
+        self.recent = deque(maxlen=recent_flights)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Run `fn` for `key`, or join the call already in flight for it"""
+        flight = self._inflight.get(key)
+        if flight is None:
+            task = asyncio.ensure_future(fn())
+            flight = [task, 0]
+            self._inflight[key] = flight
+            self.counters["flights"] += 1
+            task.add_done_callback(lambda done: self._finish(key, flight))
+        else:
+            flight[1] += 1
+            self.counters["absorbed"] += 1
+
+        return await asyncio.shield(flight[0])
+
+    def _finish(self, key: Hashable, flight: list):
+        """Record how many callers a completed flight served"""
+        if self._inflight.get(key) is flight:
+            del self._inflight[key]
+
+        task, absorbed = flight
+        if task.cancelled() or task.exception() is not None:
+            self.counters["errors"] += 1
+        if absorbed:
+            self.counters["max_absorbed"] = max(self.counters["max_absorbed"], absorbed)
+            self.recent.append({"key": str(key)[:120], "absorbed": absorbed})
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters plus the calls currently in flight and recent coalesced flights"""
+        return {
+            **self.counters,
+            "in_flight": len(self._inflight),
+            "recent": list(self.recent)
+        }
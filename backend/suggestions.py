@@ -0,0 +1,238 @@
+from collections import defaultdict
+from typing import Dict, Hashable, Iterable, List, Optional, Set, Tuple
+import heapq
+import logging
+import math
+import re
+import time
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+# Product attributes offered as suggestions alongside product names
+FACET_KINDS = {"category": "category", "colors": "color", "materials": "material"}
+
+# Suggestions kept per trie node, i.e. the largest `limit` a query can ask for
+TOP_K = 10
+
+# Trie depth; longer prefixes are answered by filtering the entries under the deepest node
+MAX_DEPTH = 16
+
+_SPACE_RE = re.compile(r"[^a-z0-9]+")
+
+def normalize(text: str) -> str:
+    """Lowercase, strip accents and collapse punctuation to single spaces"""
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode().lower()
+    return _SPACE_RE.sub(" ", text).strip()
+
+def product_weight(product: Dict) -> float:
+    """Rank products by rating, scaled by how many reviews back it up"""
+    rating = float(product.get("rating") or 0)
+    reviews = int(product.get("reviews_count") or 0)
+    return 1.0 + rating * math.log1p(reviews)
+
+class _Node:
+    __slots__ = ("children", "entries", "top")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        # Entries whose key ends here, or is cut off here by MAX_DEPTH
+        self.entries: Set[Hashable] = set()
+        # Best TOP_K (negative weight, entry) pairs in this subtree; None when stale
+        self.top: Optional[List[Tuple[float, Hashable]]] = None
+
+class SuggestIndex:
+    """Weighted prefix index for search-box typeahead
+
+    Product names, categories, colours and materials are inserted into a trie
+    under every word-start suffix, so "gold" finds "Executive Gold Series".
+    Each node caches the best TOP_K entries of its subtree. An insert, removal
+    or weight change marks only the nodes on the affected paths stale, and they
+    are rebuilt from their children's lists the next time a query reaches them.
+    """
+
+    def __init__(self):
+        self.ready = False
+        self.counters = {"queries": 0, "upserts": 0, "removals": 0}
+        self.last_load_ms = 0.0
+        self._reset()
+
+    def _reset(self):
+        self._root = _Node()
+        # entry -> (label, kind, product_id or None, weight, keys)
+        self._entries: Dict[Hashable, Tuple[str, str, Optional[str], float, Tuple[str, ...]]] = {}
+        self._products: Dict[str, Dict] = {}
+        self._facet_weights: Dict[Tuple[str, str], float] = defaultdict(float)
+        self._facet_labels: Dict[Tuple[str, str], str] = {}
+
+    # ------------------------------------------------------------------
+    # Indexing
+    # ------------------------------------------------------------------
+
+    def load(self, documents: Iterable[Dict]):
+        """Replace the whole index with `documents` (serialized, with string `id`)"""
+        started = time.perf_counter()
+        self._reset()
+        for document in documents:
+            self._upsert(document)
+        self._top(self._root)
+        self.ready = True
+        self.last_load_ms = (time.perf_counter() - started) * 1000
+        logger.info(f"Suggest index built with {len(self._entries)} entries in {self.last_load_ms:.1f}ms")
+
+    def upsert(self, document: Dict):
+        """Add or replace one product and adjust the weights of its attributes"""
+        self._upsert(document)
+        self.counters["upserts"] += 1
+
+    def remove(self, product_id: str) -> bool:
+        """Drop one product and its contribution to attribute weights"""
+        if product_id not in self._products:
+            return False
+        self._remove(product_id)
+        self.counters["removals"] += 1
+        return True
+
+    def _upsert(self, document: Dict):
+        product_id = document["id"]
+        if product_id in self._products:
+            self._remove(product_id)
+
+        name = str(document.get("name") or "")
+        weight = product_weight(document)
+        self._products[product_id] = {
+            "weight": weight,
+            "facets": [(kind, str(value)) for field, kind in FACET_KINDS.items() for value in self._values(document.get(field))]
+        }
+        if name:
+            self._set_entry(("product", product_id), name, "product", product_id, weight)
+        for facet in self._products[product_id]["facets"]:
+            self._facet_labels.setdefault(facet, facet[1].title() if facet[0] == "category" else facet[1])
+            self._facet_weights[facet] += weight
+            self._set_entry(facet, self._facet_labels[facet], facet[0], None, self._facet_weights[facet])
+
+    def _remove(self, product_id: str):
+        product = self._products.pop(product_id)
+        self._drop_entry(("product", product_id))
+        for facet in product["facets"]:
+            self._facet_weights[facet] -= product["weight"]
+            if self._facet_weights[facet] <= 1e-9:
+                del self._facet_weights[facet]
+                self._drop_entry(facet)
+            else:
+                self._set_entry(facet, self._facet_labels[facet], facet[0], None, self._facet_weights[facet])
+
+    @staticmethod
+    def _values(value) -> Iterable:
+        if value is None:
+            return ()
+        if isinstance(value, (list, tuple, set)):
+            return value
+        return (value,)
+
+    @staticmethod
+    def _keys(label: str) -> Tuple[str, ...]:
+        """The label plus every suffix starting at a later word"""
+        words = normalize(label).split()
+        return tuple(dict.fromkeys(" ".join(words[index:]) for index in range(len(words))))
+
+    def _set_entry(self, entry: Hashable, label: str, kind: str, product_id: Optional[str], weight: float):
+        existing = self._entries.get(entry)
+        keys = existing[4] if existing and existing[0] == label else self._keys(label)
+        if existing and existing[4] != keys:
+            self._drop_entry(entry)
+            existing = None
+        self._entries[entry] = (label, kind, product_id, weight, keys)
+        for key in keys:
+            node = self._root
+            node.top = None
+            for char in key[:MAX_DEPTH]:
+                node = node.children.setdefault(char, _Node())
+                node.top = None
+            node.entries.add(entry)
+
+    def _drop_entry(self, entry: Hashable):
+        existing = self._entries.pop(entry, None)
+        if existing is None:
+            return
+        for key in existing[4]:
+            path = [self._root]
+            for char in key[:MAX_DEPTH]:
+                child = path[-1].children.get(char)
+                if child is None:
+                    break
+                path.append(child)
+            path[-1].entries.discard(entry)
+            for node in path:
+                node.top = None
+            # Prune branches that no longer lead to any entry
+            for depth in range(len(path) - 1, 0, -1):
+                node = path[depth]
+                if node.entries or node.children:
+                    break
+                del path[depth - 1].children[key[depth - 1]]
+
+    # ------------------------------------------------------------------
+    # Querying
+    # ------------------------------------------------------------------
+
+    def _top(self, node: _Node) -> List[Tuple[float, Hashable]]:
+        """The node's cached best entries, rebuilt from its children if stale"""
+        if node.top is None:
+            candidates = {entry: -self._entries[entry][3] for entry in node.entries}
+            for child in node.children.values():
+                for negative_weight, entry in self._top(child):
+                    candidates[entry] = negative_weight
+            node.top = heapq.nsmallest(TOP_K, ((weight, entry) for entry, weight in candidates.items()), key=lambda item: (item[0], str(item[1])))
+        return node.top
+
+    def _subtree_entries(self, node: _Node) -> Set[Hashable]:
+        entries = set(node.entries)
+        for child in node.children.values():
+            entries |= self._subtree_entries(child)
+        return entries
+
+    def suggest(self, query: str, limit: int = TOP_K) -> List[Dict]:
+        """Best entries whose label, or a word suffix of it, starts with `query`"""
+        self.counters["queries"] += 1
+        prefix = normalize(query)
+        if not prefix:
+            return []
+
+        node = self._root
+        for char in prefix[:MAX_DEPTH]:
+            node = node.children.get(char)
+            if node is None:
+                return []
+
+        if len(prefix) <= MAX_DEPTH:
+            ranked = self._top(node)[:limit]
+        else:
+            matches = [
+                (-self._entries[entry][3], entry)
+                for entry in self._subtree_entries(node)
+                if any(key.startswith(prefix) for key in self._entries[entry][4])
+            ]
+            ranked = heapq.nsmallest(limit, matches, key=lambda item: (item[0], str(item[1])))
+
+        suggestions = []
+        for _, entry in ranked:
+            label, kind, product_id, _, _ = self._entries[entry]
+            suggestion = {"text": label, "type": kind}
+            if product_id:
+                suggestion["product_id"] = product_id
+            suggestions.append(suggestion)
+        return suggestions
+
+    def stats(self) -> Dict:
+        """Counters and index size"""
+        return {
+            **self.counters,
+            "ready": self.ready,
+            "products": len(self._products),
+            "entries": len(self._entries),
+            "last_load_ms": round(self.last_load_ms, 2)
+        }
+
+# Create index instance
+suggest_index = SuggestIndex()
@@ -0,0 +1,156 @@
+from typing import Any, Dict, Iterable, List, Optional
+import math
+import os
+import time
+import uuid
+
+from cache import TTLCache
+from signing import InvalidSignature, sign_payload, verify_payload
+
+SIGNING_PURPOSE = "waiting-room"
+
+# An admitted ticket stays usable this long after it was issued
+TICKET_TTL = 2 * 60 * 60
+
+# Tickets remembered per (product, user), so joining again hands back the same place
+MAX_HELD_TICKETS = 200000
+
+class TicketRequired(Exception):
+    """Raised when a waiting-room product is bought without a valid ticket"""
+
+class NotAdmitted(Exception):
+    """Raised when a ticket is valid but still waiting"""
+
+    def __init__(self, position: int, retry_after: int):
+        super().__init__(f"Still in the waiting room at position {position}")
+        self.position = position
+        self.retry_after = retry_after
+
+class _Queue:
+    """Admission state of one product: two counters, however many people wait"""
+
+    __slots__ = ("issued", "admitted", "updated")
+
+    def __init__(self):
+        self.issued = 0
+        self.admitted = 0.0
+        self.updated = time.monotonic()
+
+class WaitingRoom:
+    """In-process admission queue for products flagged `waiting_room`
+
+    Joining hands out a signed ticket carrying the next sequence number for
+    the product; a user who joins again gets their existing ticket back, so
+    repeated joins can't push later arrivals further back. Tickets are
+    admitted in order at WAITING_ROOM_ADMIT_PER_SECOND
+    (per process): the admitted count advances with time while anyone waits,
+    and never past the number of tickets issued, so an idle queue doesn't
+    bank a burst. A ticket is admitted once its number is within the admitted
+    count. Admission is two counters per product and checking a ticket is an
+    HMAC and some arithmetic, so the polling endpoint costs the same however
+    large the crowd grows, and only admitted users reach the cart and checkout.
+    The only per-user state is the bounded map of issued tickets used by `join`.
+
+    Tickets are bound to the user and to this process's queue (`epoch`), so a
+    restart sends everyone back to rejoin rather than letting old numbers
+    collide with new ones. With several workers, launches need sticky routing
+    or a single worker.
+    """
+
+    def __init__(self):
+        self.epoch = uuid.uuid4().hex[:8]
+        self._queues: Dict[str, _Queue] = {}
+        self._tickets = TTLCache(maxsize=MAX_HELD_TICKETS, ttl=TICKET_TTL)
+        self.counters = {"joined": 0, "rejoined": 0, "admitted_checks": 0, "rejected_waiting": 0, "rejected_no_ticket": 0}
+
+    @staticmethod
+    def rate() -> float:
+        return float(os.getenv("WAITING_ROOM_ADMIT_PER_SECOND", "2"))
+
+    def _advance(self, product_id: str) -> _Queue:
+        queue = self._queues.setdefault(product_id, _Queue())
+        now = time.monotonic()
+        queue.admitted = min(float(queue.issued), queue.admitted + (now - queue.updated) * self.rate())
+        queue.updated = now
+        return queue
+
+    def _status(self, queue: _Queue, number: int) -> Dict[str, Any]:
+        position = max(0, number - math.floor(queue.admitted))
+        return {
+            "position": position,
+            "admitted": position == 0,
+            "retry_after": math.ceil(position / self.rate()) if position else 0
+        }
+
+    def join(self, product_id: str, user_id: str) -> Dict[str, Any]:
+        """Take the next ticket for a product, or the user's current one; returns it with its status"""
+        queue = self._advance(product_id)
+        held = self._tickets.get((product_id, user_id))
+        if held is not None:
+            ticket, number = held
+            self.counters["rejoined"] += 1
+            return {"ticket": ticket, **self._status(queue, number)}
+
+        queue.issued += 1
+        self.counters["joined"] += 1
+        ticket = sign_payload(
+            {"p": product_id, "u": user_id, "n": queue.issued, "e": self.epoch, "iat": int(time.time())},
+            SIGNING_PURPOSE
+        )
+        self._tickets.set((product_id, user_id), (ticket, queue.issued))
+        return {"ticket": ticket, **self._status(queue, queue.issued)}
+
+    def _number(self, ticket: str, product_id: str, user_id: Optional[str] = None) -> Optional[int]:
+        """The ticket's sequence number if it is genuine, current and for this product and user"""
+        try:
+            data = verify_payload(ticket, SIGNING_PURPOSE)
+        except InvalidSignature:
+            return None
+        if data.get("p") != product_id or data.get("e") != self.epoch:
+            return None
+        if user_id is not None and data.get("u") != user_id:
+            return None
+        if data.get("iat", 0) + TICKET_TTL < time.time():
+            return None
+        return data.get("n")
+
+    def status(self, product_id: str, ticket: str) -> Optional[Dict[str, Any]]:
+        """Queue position of a ticket, or None if it isn't valid here"""
+        number = self._number(ticket, product_id)
+        if number is None:
+            return None
+        return self._status(self._advance(product_id), number)
+
+    def check(self, product_id: str, user_id: str, tickets: Iterable[str]):
+        """Raise unless one of `tickets` admits the user to the product"""
+        for ticket in tickets:
+            number = self._number(ticket, product_id, user_id)
+            if number is None:
+                continue
+            status = self._status(self._advance(product_id), number)
+            if not status["admitted"]:
+                self.counters["rejected_waiting"] += 1
+                raise NotAdmitted(status["position"], status["retry_after"])
+            self.counters["admitted_checks"] += 1
+            return
+        self.counters["rejected_no_ticket"] += 1
+        raise TicketRequired(product_id)
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters and each product's queue"""
+        queues = {}
+        for product_id in list(self._queues):
+            queue = self._advance(product_id)
+            queues[product_id] = {
+                "issued": queue.issued,
+                "admitted": math.floor(queue.admitted),
+                "waiting": queue.issued - math.floor(queue.admitted)
+            }
+        return {**self.counters, "rate_per_second": self.rate(), "queues": queues}
+
+def parse_tickets(header: Optional[str]) -> List[str]:
+    """Tickets from an X-Waiting-Room-Ticket header, which may hold several separated by commas"""
+    return [ticket.strip() for ticket in (header or "").split(",") if ticket.strip()]
+
+# Create waiting room instance
+waiting_room = WaitingRoom()
@@ -0,0 +1,46 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "backend"))
+os.environ.setdefault("JWT_SECRET_KEY", "test-secret-key")
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+@pytest.fixture
+async def mongo():
+    """A fresh in-memory database behind the `database` module, with the app's indexes"""
+    from mongomock_motor import AsyncMongoMockClient
+
+    import catalog
+    import database
+
+    database.db.client = AsyncMongoMockClient()
+    database.db.database = database.db.client["luxuryline_test"]
+    await database.create_indexes()
+    catalog.product_cache.clear()
+    yield database.db.database
+    catalog.product_cache.clear()
+    database.db.client = None
+    database.db.database = None
+
+@pytest.fixture
+def make_product(mongo):
+    """Insert a product and return its API ID"""
+    import database
+
+    async def make(name: str = "Premium Serving Tray", price: float = 120.0, stock_quantity: int = 10, **fields) -> str:
+        return await database.insert_one("products", {
+            "name": name,
+            "category": "crockery",
+            "price": price,
+            "images": [],
+            "stock_quantity": stock_quantity,
+            **fields
+        })
+
+    return make
@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+
+import cache as cache_module
+from cache import ReadThroughCache
+
+pytestmark = pytest.mark.anyio
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache_module.time, "monotonic", clock)
+    return clock
+
+class Loader:
+    """Returns "v1", "v2", ... and counts calls; `fail` makes the next call raise"""
+
+    def __init__(self):
+        self.calls = 0
+        self.fail = False
+
+    async def __call__(self):
+        self.calls += 1
+        if self.fail:
+            raise ConnectionError("database down")
+        return f"v{self.calls}"
+
+@pytest.fixture
+def cache(clock):
+    return ReadThroughCache(ttl=30, stale_ttl=300, max_stale=3600, load_timeout=1)
+
+async def test_fresh_entries_are_served_without_loading(cache):
+    loader = Loader()
+    assert await cache.get("tray", loader) == "v1"
+    assert await cache.get("tray", loader) == "v1"
+    assert loader.calls == 1
+    assert cache.stats()["hit_rate"] == 0.5
+
+async def test_peek_counts_misses(cache, clock):
+    assert cache.peek("tray") is None
+    cache.set("tray", "v1")
+    assert cache.peek("tray") == "v1"
+    clock.now += 31
+    assert cache.peek("tray") is None
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 2, pytest.approx(1 / 3, abs=1e-4))
+
+async def test_stale_entries_are_served_while_they_reload(cache, clock):
+    loader = Loader()
+    await cache.get("tray", loader)
+    clock.now += 60
+
+    assert await cache.get("tray", loader) == "v1"
+    assert await cache.get("tray", loader) == "v1"
+    await cache._refreshing["tray"]
+    assert loader.calls == 2
+    assert await cache.get("tray", loader) == "v2"
+    assert cache.stats()["stale_hits"] == 2
+    assert cache.stats()["refreshes"] == 1
+
+async def test_a_stale_entry_is_served_when_the_loader_fails(cache, clock):
+    loader = Loader()
+    await cache.get("tray", loader)
+    clock.now += 600
+    loader.fail = True
+
+    assert await cache.get("tray", loader) == "v1"
+    assert cache.stats()["stale_on_error"] == 1
+
+    # Too old to fall back on: the error reaches the caller
+    clock.now += 3600
+    with pytest.raises(ConnectionError):
+        await cache.get("tray", loader)
+
+async def test_an_invalidation_during_a_load_is_not_undone(cache):
+    started, release = asyncio.Event(), asyncio.Event()
+
+    async def slow_loader():
+        started.set()
+        await release.wait()
+        return "old"
+
+    load = asyncio.ensure_future(cache.get("tray", slow_loader))
+    await started.wait()
+    cache.invalidate("tray")
+    release.set()
+
+    assert await load == "old"
+    assert cache.peek("tray") is None
@@ -0,0 +1,189 @@
+import asyncio
+
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+import cart_store
+import database
+from cart_store import cart_summaries, embedded_cart_store, item_cart_store
+
+pytestmark = pytest.mark.anyio
+
+def product(product_id: str, price: float = 100.0):
+    return {"id": product_id, "name": "Premium Serving Tray", "price": price, "images": ["tray.jpg"]}
+
+async def cart_items(mongo, user_id: str):
+    return await mongo.cart_items.find({"user_id": user_id}).sort("added_at", 1).to_list(length=None)
+
+@pytest.fixture(autouse=True)
+def clear_summaries():
+    cart_summaries.cache.clear()
+
+async def test_adds_of_the_same_line_increment_one_document(mongo, make_product):
+    tray = await make_product()
+    await item_cart_store.add("user-1", product(tray), 2, "L", "Gold")
+    await item_cart_store.add("user-1", product(tray), 3, "L", "Gold")
+    await item_cart_store.add("user-1", product(tray), 1, "L", "Silver")
+
+    lines = await cart_items(mongo, "user-1")
+    assert [(line["selected_color"], line["quantity"]) for line in lines] == [("Gold", 5), ("Silver", 1)]
+
+async def test_concurrent_adds_never_duplicate_a_line(mongo, make_product):
+    tray = await make_product()
+    await asyncio.gather(*(item_cart_store.add("user-1", product(tray), 1, None, None) for _ in range(20)))
+
+    lines = await cart_items(mongo, "user-1")
+    assert len(lines) == 1
+    assert lines[0]["quantity"] == 20
+
+async def test_add_that_loses_the_upsert_race_increments_the_winner(mongo, make_product, monkeypatch):
+    tray = await make_product()
+    real_apply_update = cart_store.apply_update
+
+    async def racing_apply_update(collection_name, filter_dict, update, upsert=False):
+        if upsert:
+            # Another request creates the line between our match and our insert
+            await mongo.cart_items.insert_one({**filter_dict, "quantity": 4})
+            raise DuplicateKeyError("E11000 duplicate key error")
+        return await real_apply_update(collection_name, filter_dict, update, upsert)
+
+    monkeypatch.setattr(cart_store, "apply_update", racing_apply_update)
+    await item_cart_store.add("user-1", product(tray), 3, None, None)
+
+    lines = await cart_items(mongo, "user-1")
+    assert [line["quantity"] for line in lines] == [7]
+
+async def test_unique_index_rejects_a_second_copy_of_a_line(mongo):
+    line = {"user_id": "user-1", "product_id": "p1", "selected_size": None, "selected_color": None, "quantity": 1}
+    await mongo.cart_items.insert_one(dict(line))
+    with pytest.raises(DuplicateKeyError):
+        await mongo.cart_items.insert_one(dict(line))
+
+async def test_startup_merges_lines_duplicated_before_the_unique_index(mongo):
+    await mongo.cart_items.drop_indexes()
+    await mongo.cart_items.insert_many([
+        {"user_id": "user-1", "product_id": "p1", "selected_size": "L", "quantity": 2},
+        {"user_id": "user-1", "product_id": "p1", "selected_size": "L", "selected_color": None, "quantity": 3},
+        {"user_id": "user-1", "product_id": "p1", "selected_size": "M", "quantity": 1},
+        {"user_id": "user-2", "product_id": "p1", "selected_size": "L", "quantity": 4}
+    ])
+
+    await database.create_indexes()
+
+    lines = await mongo.cart_items.find({}, {"_id": 0, "user_id": 1, "selected_size": 1, "quantity": 1}).to_list(length=None)
+    assert sorted((line["user_id"], line["selected_size"], line["quantity"]) for line in lines) == [
+        ("user-1", "L", 5), ("user-1", "M", 1), ("user-2", "L", 4)
+    ]
+    with pytest.raises(DuplicateKeyError):
+        await mongo.cart_items.insert_one({"user_id": "user-2", "product_id": "p1", "selected_size": "L", "quantity": 1})
+    assert await database.merge_duplicate_cart_lines() == 0
+
+async def test_lines_can_only_be_changed_by_their_owner(mongo, make_product):
+    tray = await make_product()
+    await item_cart_store.add("user-1", product(tray), 1, None, None)
+    line_id = str((await cart_items(mongo, "user-1"))[0]["_id"])
+
+    assert not await item_cart_store.set_quantity("user-2", line_id, 9)
+    assert not await item_cart_store.remove("user-2", line_id)
+    assert await item_cart_store.set_quantity("user-1", line_id, 9)
+    assert (await cart_items(mongo, "user-1"))[0]["quantity"] == 9
+    assert await item_cart_store.remove("user-1", line_id)
+    assert await cart_items(mongo, "user-1") == []
+
+async def test_merge_adds_to_existing_lines_in_one_pass(mongo, make_product):
+    tray, cups = await make_product(), await make_product(name="Midnight Ceramic Cup Set")
+    await item_cart_store.add("user-1", product(tray), 1, None, None)
+
+    merged = await item_cart_store.merge("user-1", [
+        {"product": product(tray), "quantity": 2, "selected_size": None, "selected_color": None},
+        {"product": product(cups), "quantity": 1, "selected_size": None, "selected_color": "Black"}
+    ])
+
+    assert merged == 2
+    quantities = {line["product_id"]: line["quantity"] for line in await cart_items(mongo, "user-1")}
+    assert quantities == {tray: 3, cups: 1}
+
+async def test_embedded_cart_keeps_one_line_per_identity(mongo, make_product):
+    tray = await make_product()
+    await embedded_cart_store.add("user-1", product(tray, price=80.0), 1, "M", None)
+    await asyncio.gather(*(embedded_cart_store.add("user-1", product(tray, price=80.0), 1, "M", None) for _ in range(5)))
+    await embedded_cart_store.add("user-1", product(tray, price=80.0), 2, "L", None)
+
+    lines = await embedded_cart_store.lines("user-1")
+    assert [(line["selected_size"], line["quantity"]) for line in lines] == [("L", 2), ("M", 6)]
+    assert await embedded_cart_store.summarize("user-1") == {"total_items": 8, "subtotal": 640.0}
+
+async def test_embedded_merge_adds_to_existing_lines(mongo, make_product):
+    tray, cups = await make_product(), await make_product(name="Midnight Ceramic Cup Set")
+    await embedded_cart_store.add("user-1", product(tray), 1, None, None)
+
+    merged = await embedded_cart_store.merge("user-1", [
+        {"product": product(tray), "quantity": 2, "selected_size": None, "selected_color": None},
+        {"product": product(cups), "quantity": 1, "selected_size": None, "selected_color": "Black"},
+        {"product": product(cups), "quantity": 4, "selected_size": None, "selected_color": "Black"}
+    ])
+    assert merged == 3
+    assert {line["product_id"]: line["quantity"] for line in await embedded_cart_store.lines("user-1")} == {tray: 3, cups: 5}
+
+    await embedded_cart_store.merge("user-2", [{"product": product(tray), "quantity": 2, "selected_size": "L", "selected_color": None}])
+    assert [line["quantity"] for line in await embedded_cart_store.lines("user-2")] == [2]
+
+async def test_migration_builds_embedded_carts_from_cart_items(mongo, make_product):
+    tray, cups = await make_product(price=80.0, images=["tray.jpg"]), await make_product(name="Cups", price=20.0)
+    await item_cart_store.add("user-1", product(tray), 1, "M", None)
+    await item_cart_store.add("user-1", product(cups), 2, None, "Black")
+    await item_cart_store.add("user-2", product(tray), 3, "L", None)
+    # A line for a deleted product is left behind
+    await item_cart_store.add("user-2", product("5f0000000000000000000000"), 1, None, None)
+
+    assert await cart_store.migrate_cart_items() == 2
+
+    lines = await embedded_cart_store.lines("user-1")
+    assert [(line["name"], line["price"], line["image"], line["quantity"]) for line in lines] == [
+        ("Cups", 20.0, "", 2), ("Premium Serving Tray", 80.0, "tray.jpg", 1)
+    ]
+    item_ids = {str(item["_id"]) for item in await cart_items(mongo, "user-1")}
+    assert {line["id"] for line in lines} == item_ids
+    assert await embedded_cart_store.summarize("user-2") == {"total_items": 3, "subtotal": 240.0}
+
+    # A second run creates nothing and leaves carts changed since alone
+    await embedded_cart_store.add("user-1", product(tray), 1, "M", None)
+    assert await cart_store.migrate_cart_items() == 0
+    assert (await embedded_cart_store.summarize("user-1"))["total_items"] == 4
+    assert await mongo.carts.count_documents({}) == 2
+
+async def test_summary_cache_is_dropped_by_writes(mongo, make_product):
+    tray = await make_product()
+    await embedded_cart_store.add("user-1", product(tray), 1, None, None)
+    assert (await cart_summaries.get("user-1", embedded_cart_store))["total_items"] == 1
+
+    await embedded_cart_store.add("user-1", product(tray), 2, None, None)
+    assert (await cart_summaries.get("user-1", embedded_cart_store))["total_items"] == 3
+    assert len(cart_summaries._versions) == 0
+
+async def test_a_summary_computed_across_a_write_is_not_cached(mongo, make_product):
+    tray = await make_product()
+    await embedded_cart_store.add("user-1", product(tray), 1, None, None)
+
+    class PausedStore:
+        """Reads the cart, then waits to be released before answering"""
+
+        def __init__(self):
+            self.read, self.release = asyncio.Event(), asyncio.Event()
+
+        async def summarize(self, user_id):
+            summary = await embedded_cart_store.summarize(user_id)
+            self.read.set()
+            await self.release.wait()
+            return summary
+
+    store = PausedStore()
+    pending = asyncio.ensure_future(cart_summaries.get("user-1", store))
+    await store.read.wait()
+    await embedded_cart_store.add("user-1", product(tray), 2, None, None)
+    store.release.set()
+
+    assert (await pending)["total_items"] == 1
+    assert cart_summaries.cache.get("user-1") is None
+    assert (await cart_summaries.get("user-1", embedded_cart_store))["total_items"] == 3
+    assert len(cart_summaries._versions) == 0
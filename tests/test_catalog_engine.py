@@ -0,0 +1,61 @@
+import random
+from datetime import datetime, timedelta
+
+from catalog_engine import CatalogEngine
+from pagination import build_sort
+
+SORTS = ["name", "price-low", "price-high", "rating", "newest"]
+FILTERS = [{}, {"category": "sneakers"}, {"price": {"$lte": 40.0}}, {"price": {"$gte": 30.0, "$lte": 60.0}}]
+
+def make_products(count: int, rng: random.Random):
+    return [
+        {
+            "id": f"{index:024x}",
+            "name": rng.choice(["Gold Runner", "Court Classic", "Tea Set"]),
+            "category": rng.choice(["sneakers", "crockery"]),
+            "price": float(rng.randint(20, 60)),
+            "rating": rng.choice([4.0, 4.5, 5.0]),
+            "created_at": datetime(2024, 1, 1) + timedelta(minutes=rng.randint(0, 30))
+        }
+        for index in range(count)
+    ]
+
+def listing_ids(engine: CatalogEngine, filter_dict, sort_by: str):
+    result = engine.query(filter_dict, build_sort(sort_by), 0, 1000)
+    return [item["id"] for item in result["items"]], result["total"]
+
+def test_incremental_writes_order_like_a_fresh_load():
+    rng = random.Random(3)
+    products = make_products(300, rng)
+    engine = CatalogEngine()
+    engine.load(products[:200])
+    live = {product["id"]: product for product in products[:200]}
+
+    for product in products[200:]:
+        engine.upsert(product)
+        live[product["id"]] = product
+    for product_id in rng.sample(sorted(live), 40):
+        engine.remove(product_id)
+        del live[product_id]
+    for product_id in rng.sample(sorted(live), 120):
+        edited = {**live[product_id], "price": float(rng.randint(20, 60)), "name": rng.choice(["Gold Runner", "Zen Cup"])}
+        if rng.random() < 0.1:
+            del edited["price"]
+        engine.upsert(edited)
+        live[product_id] = edited
+
+    fresh = CatalogEngine()
+    fresh.load(list(live.values()))
+    for filter_dict in FILTERS:
+        for sort_by in SORTS:
+            assert listing_ids(engine, filter_dict, sort_by) == listing_ids(fresh, filter_dict, sort_by)
+    assert engine.stats()["rebuilds"] == 1
+
+def test_a_stock_only_write_keeps_the_sort_order():
+    products = make_products(50, random.Random(5))
+    engine = CatalogEngine()
+    engine.load(products)
+    before = listing_ids(engine, {}, "price-low")
+
+    engine.upsert({**products[7], "stock_quantity": 3})
+    assert listing_ids(engine, {}, "price-low") == before
@@ -0,0 +1,59 @@
+from html import escape
+from string import Formatter
+
+import pytest
+
+from email_service import EMAIL_TEMPLATES, render_email, render_emails
+from email_templates import Template, TemplateError
+
+ROWS = {
+    "verification": [{"email": f"user{index}@example.com", "verification_code": f"{index:06d}"} for index in range(5)],
+    "order_confirmation": [{"email": "ada@example.com", "order_id": f"{index:024x}", "total": index * 1.37} for index in range(5)],
+    "price_drop": [
+        {"email": "ada@example.com", "product_name": f"Product {index}", "old_price": 100 + index, "new_price": 80.25 + index}
+        for index in range(5)
+    ]
+}
+
+class EscapingFormatter(Formatter):
+    """`str.format` that HTML-escapes every formatted value"""
+
+    def format_field(self, value, format_spec):
+        return escape(super().format_field(value, format_spec))
+
+@pytest.mark.parametrize("kind", sorted(ROWS))
+def test_compiled_templates_render_like_str_format(kind):
+    # str.format on the source is how the bodies were built before they were compiled
+    subject, html = EMAIL_TEMPLATES[kind]
+    rows = ROWS[kind]
+    assert html.render_many(rows) == [html.source.format_map(row) for row in rows]
+    assert subject.render_many(rows) == [subject.source.format_map(row) for row in rows]
+    assert render_emails(kind, rows) == [render_email(kind, row) for row in rows]
+
+def test_every_email_kind_has_sample_rows():
+    assert set(ROWS) == set(EMAIL_TEMPLATES)
+
+def test_values_are_html_escaped_in_bodies_only():
+    row = {
+        "email": "a&b@example.com",
+        "product_name": "<script>alert('x')</script>",
+        "old_price": 120,
+        "new_price": 99.5
+    }
+    subject, html = render_email("price_drop", row)
+
+    assert "<script>" not in html
+    assert "&lt;script&gt;alert(&#x27;x&#x27;)&lt;/script&gt;" in html
+    assert "a&amp;b@example.com" in html
+    assert "$99.50" in html
+    assert html == EscapingFormatter().vformat(EMAIL_TEMPLATES["price_drop"][1].source, (), row)
+    assert subject == "Price drop: <script>alert('x')</script> is now $99.50 - LuxuryLine"
+
+def test_literal_braces_and_unsupported_placeholders():
+    assert Template("css", "a {{ color: red }} {name}").render(name="<b>") == "a { color: red } &lt;b&gt;"
+    with pytest.raises(TemplateError):
+        Template("attribute", "{user.name}")
+    with pytest.raises(TemplateError):
+        Template("conversion", "{name!r}")
+    with pytest.raises(KeyError):
+        Template("missing", "{name}").render()
@@ -0,0 +1,90 @@
+import time
+
+import pytest
+
+import guest_cart
+from guest_cart import MAX_GUEST_LINES, GuestCart, InvalidGuestCart, line_id, merge_guest_cart
+from signing import InvalidSignature, sign_payload, verify_payload
+
+def test_signed_payload_round_trips():
+    token = sign_payload({"l": [["p1", None, "Gold", 2]]}, "guest-cart")
+    assert verify_payload(token, "guest-cart") == {"l": [["p1", None, "Gold", 2]]}
+
+def test_tampered_or_foreign_tokens_are_rejected():
+    token = sign_payload({"n": 1}, "waiting-room")
+    signature = token.split(".")[1]
+    forged = sign_payload({"n": 999}, "waiting-room").split(".")[0] + "." + signature
+
+    with pytest.raises(InvalidSignature):
+        verify_payload(forged, "waiting-room")
+    with pytest.raises(InvalidSignature):
+        verify_payload(token, "guest-cart")
+    with pytest.raises(InvalidSignature):
+        verify_payload("junk", "guest-cart")
+
+def test_cart_survives_encode_and_decode():
+    cart = GuestCart()
+    cart.add("p1", 2, "M", None)
+    cart.add("p1", 1, "M", None)
+    cart.add("p2", 1, None, "Black")
+
+    decoded = GuestCart.decode(cart.encode())
+    assert decoded.cart_id == cart.cart_id
+    assert [(line["product_id"], line["quantity"]) for line in decoded.lines] == [("p1", 3), ("p2", 1)]
+    assert decoded.set_quantity(line_id("p2", None, "Black"), 500)
+    assert decoded.lines[1]["quantity"] == guest_cart.MAX_LINE_QUANTITY
+    assert decoded.remove(line_id("p1", "M", None))
+    assert not decoded.remove(line_id("p1", "M", None))
+
+def test_cart_limits():
+    cart = GuestCart()
+    with pytest.raises(InvalidGuestCart):
+        cart.add("p1", 0, None, None)
+    for index in range(MAX_GUEST_LINES):
+        cart.add(f"p{index}", 1, None, None)
+    with pytest.raises(InvalidGuestCart):
+        cart.add("one-too-many", 1, None, None)
+
+def test_expired_or_tampered_cart_is_rejected(monkeypatch):
+    token = GuestCart().encode()
+    with pytest.raises(InvalidGuestCart):
+        GuestCart.decode(token[:-2] + ("AA" if not token.endswith("AA") else "BB"))
+
+    real_time = time.time
+    monkeypatch.setattr(guest_cart.time, "time", lambda: real_time() + guest_cart.GUEST_CART_TTL.total_seconds() + 60)
+    with pytest.raises(InvalidGuestCart):
+        GuestCart.decode(token)
+
+@pytest.mark.anyio
+async def test_merge_adds_lines_once(mongo, make_product):
+    tray = await make_product()
+    cart = GuestCart()
+    cart.add(tray, 2, None, "Gold")
+    cart.add("ffffffffffffffffffffffff", 1, None, None)
+    token = cart.encode()
+
+    assert await merge_guest_cart("user-1", token) == 1
+    # A replay, and an older token of the same cart, merge nothing
+    assert await merge_guest_cart("user-1", token) == 0
+    cart.add(tray, 1, None, None)
+    assert await merge_guest_cart("user-1", cart.encode()) == 0
+
+    lines = await mongo.cart_items.find({"user_id": "user-1"}).to_list(length=None)
+    assert [(line["product_id"], line["selected_color"], line["quantity"]) for line in lines] == [(tray, "Gold", 2)]
+
+@pytest.mark.anyio
+async def test_failed_merge_can_be_retried(mongo, make_product, monkeypatch):
+    tray = await make_product()
+    cart = GuestCart()
+    cart.add(tray, 1, None, None)
+    store = guest_cart.get_cart_store()
+
+    async def failing_merge(user_id, entries):
+        raise RuntimeError("database unavailable")
+
+    monkeypatch.setattr(store, "merge", failing_merge)
+    with pytest.raises(RuntimeError):
+        await merge_guest_cart("user-1", cart.encode())
+    monkeypatch.undo()
+
+    assert await merge_guest_cart("user-1", cart.encode()) == 1
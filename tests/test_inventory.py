@@ -0,0 +1,140 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from pydantic import ValidationError
+
+import catalog
+from catalog import get_product_by_id, get_products_by_ids
+from database import decode_id
+from inventory import SHARDS_COLLECTION, InsufficientStock, InventoryService, ReservationInProgress
+from models import CartItemCreate, CartItemUpdate
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+def service():
+    return InventoryService()
+
+async def stock_of(mongo, product_id: str) -> int:
+    return (await mongo.products.find_one({"_id": decode_id(product_id)}))["stock_quantity"]
+
+async def test_concurrent_checkouts_never_oversell(mongo, make_product, service):
+    tray = await make_product(stock_quantity=3)
+
+    async def checkout(index):
+        try:
+            return await service.reserve(f"user-{index}", [{"product_id": tray, "quantity": 1}])
+        except InsufficientStock:
+            return None
+
+    reservations = await asyncio.gather(*(checkout(index) for index in range(10)))
+    assert sum(1 for reservation in reservations if reservation) == 3
+    assert await stock_of(mongo, tray) == 0
+
+async def test_failed_reservation_gives_back_the_lines_it_took(mongo, make_product, service):
+    tray, cups = await make_product(stock_quantity=5), await make_product(name="Cups", stock_quantity=1)
+
+    with pytest.raises(InsufficientStock) as error:
+        await service.reserve("user-1", [{"product_id": tray, "quantity": 2}, {"product_id": cups, "quantity": 2}])
+
+    assert error.value.product_ids == [cups]
+    assert (await stock_of(mongo, tray), await stock_of(mongo, cups)) == (5, 1)
+    assert await mongo.stock_reservations.count_documents({}) == 0
+
+async def test_release_returns_stock_once(mongo, make_product, service):
+    tray = await make_product(stock_quantity=5)
+    reservation = await service.reserve("user-1", [{"product_id": tray, "quantity": 2}])
+    assert await stock_of(mongo, tray) == 3
+
+    assert await service.release(reservation["_id"])
+    assert not await service.release(reservation["_id"])
+    assert await stock_of(mongo, tray) == 5
+
+async def test_committed_stock_stays_sold(mongo, make_product, service):
+    tray = await make_product(stock_quantity=5)
+    reservation = await service.reserve("user-1", [{"product_id": tray, "quantity": 2}])
+
+    assert await service.commit(reservation["_id"], "order-1")
+    assert not await service.release(reservation["_id"])
+    assert await stock_of(mongo, tray) == 3
+
+async def test_a_new_reservation_replaces_the_users_hold(mongo, make_product, service):
+    tray = await make_product(stock_quantity=10)
+    for _ in range(5):
+        await service.reserve("user-1", [{"product_id": tray, "quantity": 4}])
+
+    assert await stock_of(mongo, tray) == 6
+    assert await mongo.stock_reservations.count_documents({"user_id": "user-1", "status": "held"}) == 1
+
+async def test_concurrent_reservations_of_one_user_hold_once(mongo, make_product, service):
+    tray = await make_product(stock_quantity=10)
+    results = await asyncio.gather(
+        *(service.reserve("user-1", [{"product_id": tray, "quantity": 1}]) for _ in range(5)),
+        return_exceptions=True
+    )
+
+    held = [result for result in results if isinstance(result, dict)]
+    assert len(held) == 1
+    assert all(isinstance(result, ReservationInProgress) for result in results if not isinstance(result, dict))
+    assert await stock_of(mongo, tray) == 9
+
+async def test_quantities_below_one_are_rejected(make_product, service):
+    tray = await make_product(stock_quantity=10)
+    with pytest.raises(ValueError):
+        await service.reserve("user-1", [{"product_id": tray, "quantity": 40}, {"product_id": tray, "quantity": -30}])
+    with pytest.raises(ValidationError):
+        CartItemCreate(product_id=tray, quantity=0)
+    with pytest.raises(ValidationError):
+        CartItemUpdate(quantity=-1)
+
+async def test_reserving_a_deleted_product_leaves_no_ghost_document(mongo, make_product, service):
+    tray = await make_product(stock_quantity=10)
+    await get_products_by_ids([tray])
+    await mongo.products.delete_one({"_id": decode_id(tray)})
+
+    with pytest.raises(InsufficientStock):
+        await service.reserve("user-1", [{"product_id": tray, "quantity": 1}])
+    assert await mongo.products.count_documents({}) == 0
+
+async def test_expired_holds_are_swept(mongo, make_product, service):
+    tray = await make_product(stock_quantity=5)
+    reservation = await service.reserve("user-1", [{"product_id": tray, "quantity": 2}], ttl=timedelta(minutes=5))
+    await mongo.stock_reservations.update_one(
+        {"_id": reservation["_id"]}, {"$set": {"expires_at": datetime.utcnow() - timedelta(seconds=1)}}
+    )
+
+    assert await service.sweep_expired() == 1
+    assert await stock_of(mongo, tray) == 5
+
+async def test_sharded_stock_is_reserved_and_folded_back(mongo, make_product, service):
+    tray = await make_product(stock_quantity=10)
+    await service.shard_product(tray, 4)
+    shards = await mongo[SHARDS_COLLECTION].find({"product_id": tray}).to_list(length=None)
+    assert sorted(shard["stock"] for shard in shards) == [2, 2, 3, 3]
+
+    await asyncio.gather(*(service.reserve(f"user-{index}", [{"product_id": tray, "quantity": 1}]) for index in range(6)))
+    assert await service.available(tray) == 4
+
+    assert await service.unshard_product(tray) == 4
+    assert await stock_of(mongo, tray) == 4
+
+async def test_cached_product_sees_stock_writes(make_product, service):
+    tray = await make_product(stock_quantity=5)
+    assert (await get_product_by_id(tray))["stock_quantity"] == 5
+
+    reservation = await service.reserve("user-1", [{"product_id": tray, "quantity": 2}])
+    assert (await get_product_by_id(tray))["stock_quantity"] == 3
+    await service.release(reservation["_id"])
+    assert (await get_product_by_id(tray))["stock_quantity"] == 5
+
+async def test_stock_writes_keep_the_listing_generation(make_product, service):
+    tray = await make_product(stock_quantity=5)
+    generation = catalog.catalog_generation
+
+    reservation = await service.reserve("user-1", [{"product_id": tray, "quantity": 2}])
+    await service.release(reservation["_id"])
+    assert catalog.catalog_generation == generation
+
+    catalog.invalidate_product(tray)
+    assert catalog.catalog_generation == generation + 1
@@ -0,0 +1,30 @@
+import httpx
+import pytest
+
+import database
+from auth import auth_service
+from models import User
+
+pytestmark = pytest.mark.anyio
+
+async def token_for(email: str, is_admin: bool) -> str:
+    user_id = await database.insert_one("users", {
+        "email": email, "password_hash": "", "is_verified": True, "is_admin": is_admin
+    })
+    return auth_service.create_user_token(User(id=user_id, email=email, password_hash="", is_verified=True))
+
+async def test_metrics_are_for_admins_only(mongo):
+    from server import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        assert (await client.get("/api/metrics")).status_code in (401, 403)
+
+        customer = await token_for("ada@example.com", is_admin=False)
+        response = await client.get("/api/metrics", headers={"Authorization": f"Bearer {customer}"})
+        assert response.status_code == 403
+
+        admin = await token_for("ops@example.com", is_admin=True)
+        response = await client.get("/api/metrics", headers={"Authorization": f"Bearer {admin}"})
+        assert response.status_code == 200
+        assert "product_cache" in response.json()
@@ -0,0 +1,99 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+import outbox as outbox_module
+from database import decode_id
+from email_service import InMemoryEmailTransport
+from outbox import MAX_ATTEMPTS, OUTBOX_COLLECTION, EmailOutbox
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+def outbox(mongo, monkeypatch):
+    # No jitter, so retry times are exact
+    monkeypatch.setattr(outbox_module.random, "uniform", lambda low, high: 1.0)
+    outbox = EmailOutbox()
+    outbox.transport = InMemoryEmailTransport()
+    return outbox
+
+async def enqueue(outbox: EmailOutbox, to: str = "ada@example.com") -> str:
+    return await outbox.enqueue("verification", to, verification_code="123456")
+
+async def message(mongo, message_id: str):
+    return await mongo[OUTBOX_COLLECTION].find_one({"_id": decode_id(message_id)})
+
+async def make_due(mongo):
+    await mongo[OUTBOX_COLLECTION].update_many({}, {"$set": {"next_attempt_at": datetime.utcnow() - timedelta(seconds=1)}})
+
+async def test_a_successful_send_marks_the_message_sent(mongo, outbox):
+    message_id = await enqueue(outbox)
+
+    assert await outbox.process_batch() == 1
+    stored = await message(mongo, message_id)
+    assert stored["status"] == "sent"
+    assert stored["attempts"] == 1
+    assert "claim" not in stored
+    assert [sent["to"] for sent in outbox.transport.sent] == ["ada@example.com"]
+    assert "123456" in outbox.transport.sent[0]["html"]
+
+async def test_a_failed_send_is_retried_after_backoff(mongo, outbox):
+    message_id = await enqueue(outbox)
+    outbox.transport.fail_next()
+
+    before = datetime.utcnow()
+    await outbox.process_batch()
+    stored = await message(mongo, message_id)
+    assert stored["status"] == "pending"
+    assert "Simulated transport failure" in stored["last_error"]
+    delay = (stored["next_attempt_at"] - before).total_seconds()
+    assert round(delay) == 2
+
+    # Not due yet, then sent once the backoff has passed
+    assert await outbox.process_batch() == 0
+    await make_due(mongo)
+    await outbox.process_batch()
+    assert (await message(mongo, message_id))["status"] == "sent"
+    assert (await message(mongo, message_id))["attempts"] == 2
+
+async def test_a_message_is_dead_lettered_after_max_attempts(mongo, outbox):
+    message_id = await enqueue(outbox)
+    outbox.transport.fail_next(MAX_ATTEMPTS)
+
+    for _ in range(MAX_ATTEMPTS):
+        assert await outbox.process_batch() == 1
+        await make_due(mongo)
+
+    stored = await message(mongo, message_id)
+    assert stored["status"] == "dead"
+    assert stored["attempts"] == MAX_ATTEMPTS
+    assert await outbox.process_batch() == 0
+    assert outbox.transport.sent == []
+    assert outbox.stats()["dead"] == 1
+
+async def test_an_expired_lease_is_claimed_by_another_worker(mongo, outbox):
+    message_id = await enqueue(outbox)
+    first = await outbox.claim_batch()
+    assert await EmailOutbox().claim_batch() == []
+
+    # The first worker died mid-send and its lease ran out
+    await mongo[OUTBOX_COLLECTION].update_many({}, {"$set": {"locked_until": datetime.utcnow() - timedelta(seconds=1)}})
+    second = EmailOutbox()
+    second.transport = InMemoryEmailTransport()
+    assert await second.process_batch() == 1
+
+    stored = await message(mongo, message_id)
+    assert first[0]["claim"] != stored.get("claim")
+    assert stored["status"] == "sent"
+    assert stored["attempts"] == 2
+    assert len(second.transport.sent) == 1
+
+async def test_concurrent_claimers_never_share_a_message(mongo, outbox):
+    for index in range(30):
+        await enqueue(outbox, f"user-{index}@example.com")
+
+    batches = await asyncio.gather(*(EmailOutbox().claim_batch(limit=20) for _ in range(4)))
+    claimed = [doc["_id"] for batch in batches for doc in batch]
+    assert len(claimed) == len(set(claimed)) == 30
+    assert all(len({doc["claim"] for doc in batch}) <= 1 for batch in batches)
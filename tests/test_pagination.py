@@ -0,0 +1,79 @@
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+
+from pagination import (
+    InvalidCursor, build_keyset_filter, build_sort, decode_cursor, encode_cursor, next_cursor, resolve_sort
+)
+
+def test_cursor_round_trips_value_and_id():
+    document_id = str(ObjectId())
+    cursor = encode_cursor("price-low", 129.5, document_id)
+
+    assert "=" not in cursor
+    assert decode_cursor(cursor, "price-low") == (129.5, ObjectId(document_id))
+
+def test_cursor_keeps_dates_and_nulls():
+    created_at = datetime(2024, 5, 1, 12, 30)
+    document_id = str(ObjectId())
+
+    assert decode_cursor(encode_cursor("newest", created_at, document_id), "newest")[0] == created_at
+    assert decode_cursor(encode_cursor("rating", None, document_id), "rating")[0] is None
+
+def test_cursor_for_another_sort_is_rejected():
+    cursor = encode_cursor("name", "Gold", str(ObjectId()))
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor, "price-high")
+
+@pytest.mark.parametrize("cursor", ["", "not-a-cursor!", "bm90IGpzb24"])
+def test_malformed_cursor_is_rejected(cursor):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor, "name")
+
+def test_unknown_sort_falls_back_to_default():
+    assert resolve_sort("bogus") == ("name", "name", 1)
+    assert build_sort("price-high") == {"price": -1, "_id": -1}
+
+def test_keyset_filter_ascending():
+    document_id = ObjectId()
+    assert build_keyset_filter("price-low", 50.0, document_id) == {"$or": [
+        {"price": {"$gt": 50.0}},
+        {"price": 50.0, "_id": {"$gt": document_id}}
+    ]}
+
+def test_keyset_filter_descending_keeps_missing_values_last():
+    document_id = ObjectId()
+    assert build_keyset_filter("rating", 4.5, document_id) == {"$or": [
+        {"rating": {"$lt": 4.5}},
+        {"rating": 4.5, "_id": {"$lt": document_id}},
+        {"rating": None}
+    ]}
+
+def test_keyset_filter_after_a_null():
+    document_id = ObjectId()
+    assert build_keyset_filter("name", None, document_id) == {"$or": [
+        {"name": None, "_id": {"$gt": document_id}},
+        {"name": {"$ne": None}}
+    ]}
+    assert build_keyset_filter("rating", None, document_id) == {"rating": None, "_id": {"$lt": document_id}}
+
+@pytest.mark.anyio
+async def test_keyset_pages_cover_every_product_once(make_product):
+    import database
+
+    for index, price in enumerate([30.0, 10.0, 20.0, 10.0, None, 20.0, 40.0]):
+        await make_product(name=f"Product {index}", price=price)
+
+    seen = []
+    filter_dict = {}
+    while True:
+        page = await database.find_many("products", filter_dict, build_sort("price-low"), 0, 3)
+        seen.extend(product["id"] for product in page)
+        if len(page) < 3:
+            break
+        value, last_id = decode_cursor(next_cursor("price-low", page[-1]), "price-low")
+        filter_dict = build_keyset_filter("price-low", value, last_id)
+
+    everything = await database.find_many("products", {}, build_sort("price-low"), 0, 100)
+    assert seen == [product["id"] for product in everything]
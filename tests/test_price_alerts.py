@@ -0,0 +1,92 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import database
+from database import decode_id
+from price_alerts import CHECKPOINT_COLLECTION, CHECKPOINT_ID, PriceAlertEngine
+
+pytestmark = pytest.mark.anyio
+
+class Catalog:
+    """Products whose writes move `updated_at` forward, like `database.update_one` does"""
+
+    def __init__(self, mongo, make_product):
+        self.mongo = mongo
+        self.make_product = make_product
+        self.now = datetime.utcnow() - timedelta(hours=1)
+
+    async def add(self, name: str, price: float) -> str:
+        product_id = await self.make_product(name=name, price=price)
+        await self.set_price(product_id, price)
+        return product_id
+
+    async def set_price(self, product_id: str, price: float):
+        self.now += timedelta(minutes=1)
+        await self.mongo.products.update_one({"_id": decode_id(product_id)}, {"$set": {"price": price, "updated_at": self.now}})
+
+async def user(email: str, verified: bool = True) -> str:
+    return await database.insert_one("users", {"email": email, "is_verified": verified})
+
+async def wish(mongo, user_id: str, *product_ids: str):
+    await mongo.wishlist_items.insert_many([{"user_id": user_id, "product_id": product_id} for product_id in product_ids])
+
+async def alerts(mongo):
+    messages = await mongo.email_outbox.find({"kind": "price_drop"}).sort("_id", 1).to_list(length=None)
+    return [(message["to"], message["params"]["product_name"], message["params"]["new_price"]) for message in messages]
+
+@pytest.fixture
+def catalog(mongo, make_product):
+    return Catalog(mongo, make_product)
+
+async def test_an_alert_fires_once_when_the_price_drops(mongo, catalog):
+    tray = await catalog.add("Serving Tray", 120.0)
+    await wish(mongo, await user("ada@example.com"), tray)
+    await wish(mongo, await user("unverified@example.com", verified=False), tray)
+    engine = PriceAlertEngine()
+
+    # The first sighting only records the price
+    assert await engine.run_once() == 1
+    assert await alerts(mongo) == []
+
+    await catalog.set_price(tray, 130.0)
+    await engine.run_once()
+    await catalog.set_price(tray, 99.0)
+    await engine.run_once()
+    await engine.run_once()
+    assert await alerts(mongo) == [("ada@example.com", "Serving Tray", 99.0)]
+
+    # Same price again, or a rise, sends nothing
+    await catalog.set_price(tray, 99.0)
+    await catalog.set_price(tray, 110.0)
+    await engine.run_once()
+    assert len(await alerts(mongo)) == 1
+
+async def test_a_restarted_job_resumes_from_its_checkpoint(mongo, catalog):
+    await catalog.add("Plates", 60.0)
+    tray, cups = await catalog.add("Serving Tray", 120.0), await catalog.add("Cups", 40.0)
+    await wish(mongo, await user("ada@example.com"), tray, cups)
+    assert await PriceAlertEngine().run_once() == 3
+    await catalog.set_price(tray, 100.0)
+    await PriceAlertEngine().run_once()
+
+    checkpoint = await mongo[CHECKPOINT_COLLECTION].find_one({"_id": CHECKPOINT_ID})
+    assert abs(checkpoint["scanned_until"] - catalog.now) < timedelta(milliseconds=1)
+    assert checkpoint["locked_until"] <= datetime.utcnow()
+
+    # A fresh process reads only from the checkpoint on: the tray again, which the
+    # overlap window re-reads, and the cups, without re-sending the tray alert
+    await catalog.set_price(cups, 35.0)
+    restarted = PriceAlertEngine()
+    assert await restarted.run_once() == 2
+    assert await alerts(mongo) == [("ada@example.com", "Serving Tray", 100.0), ("ada@example.com", "Cups", 35.0)]
+
+async def test_a_run_holding_the_lease_blocks_others(mongo, catalog):
+    await catalog.add("Serving Tray", 120.0)
+    await mongo[CHECKPOINT_COLLECTION].insert_one(
+        {"_id": CHECKPOINT_ID, "owner": "elsewhere", "locked_until": datetime.utcnow() + timedelta(minutes=1)}
+    )
+
+    engine = PriceAlertEngine()
+    assert await engine.run_once() == 0
+    assert engine.stats()["skipped_locked"] == 1
@@ -0,0 +1,61 @@
+import httpx
+import pytest
+
+import auth
+import rate_limit
+from hashing import password_pool
+from rate_limit import AuthAdmission, RateLimited, TokenBucketLimiter
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit.time, "monotonic", clock)
+    return clock
+
+def test_a_bucket_refills_at_its_rate(clock):
+    limiter = TokenBucketLimiter("test", per_minute=60, burst=3)
+    assert [limiter.acquire("key") for _ in range(3)] == [0, 0, 0]
+    assert limiter.acquire("key") == pytest.approx(1.0)
+    assert limiter.acquire("other") == 0
+
+    clock.now += 1.0
+    assert limiter.acquire("key") == 0
+    with pytest.raises(RateLimited) as error:
+        limiter.check("key")
+    assert error.value.retry_after == 1
+
+    # An idle bucket fills back up to `burst`, no further
+    clock.now += 3600
+    assert [limiter.acquire("key") for _ in range(4)][-1] > 0
+
+def test_another_ip_cannot_spend_a_users_login_budget(clock):
+    admission = AuthAdmission(password_pool)
+    for _ in range(5):
+        admission.admit_login("203.0.113.9", "Ada@Example.com")
+    with pytest.raises(RateLimited) as error:
+        admission.admit_login("203.0.113.9", "ada@example.com ")
+    assert error.value.scope == "login_email"
+
+    admission.admit_login("198.51.100.7", "ada@example.com")
+
+@pytest.mark.anyio
+async def test_login_answers_429_with_retry_after(mongo, clock, monkeypatch):
+    from server import app
+
+    monkeypatch.setattr(auth, "auth_admission", AuthAdmission(password_pool))
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        credentials = {"email": "nobody@example.com", "password": "wrong-password"}
+        statuses = [(await client.post("/api/auth/login", json=credentials)).status_code for _ in range(5)]
+        assert statuses == [401] * 5
+
+        response = await client.post("/api/auth/login", json=credentials)
+        assert response.status_code == 429
+        assert int(response.headers["Retry-After"]) >= 1
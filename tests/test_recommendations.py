@@ -0,0 +1,48 @@
+import pytest
+
+import recommendations
+from recommendations import RecommendationEngine
+
+def product(product_id: str, category: str, price: float, colors=()):
+    return {"id": product_id, "category": category, "price": price, "colors": list(colors), "materials": []}
+
+PRODUCTS = [
+    product("tray", "serveware", 120.0, ["Gold"]),
+    product("platter", "serveware", 130.0, ["Gold"]),
+    product("bowl", "serveware", 480.0, ["White"]),
+    product("cup", "crockery", 40.0, ["White"]),
+    product("saucer", "crockery", 30.0, ["White"]),
+]
+
+def test_neighbours_blend_attributes_and_co_purchases():
+    engine = RecommendationEngine()
+    engine.build(PRODUCTS, [["tray", "cup"], ["tray", "cup"]])
+
+    assert engine.lookup("platter", 1) == ["tray"]
+    assert engine.lookup("saucer", 1) == ["cup"]
+    # Bought together often enough to outrank the same-category bowl
+    assert engine.lookup("tray", 2) == ["platter", "cup"]
+    assert engine.lookup("missing", 2) is None
+    assert all(len(neighbours) == len(PRODUCTS) - 1 for neighbours in engine.neighbours.values())
+
+def test_small_blocks_give_the_same_table(monkeypatch):
+    whole = RecommendationEngine()
+    whole.build(PRODUCTS, [["tray", "cup"]])
+
+    # Room for a single row of scores per block
+    monkeypatch.setattr(recommendations, "BLOCK_BYTES", 4 * len(PRODUCTS))
+    blocked = RecommendationEngine()
+    blocked.build(PRODUCTS, [["tray", "cup"]])
+    for product_id, neighbours in whole.neighbours.items():
+        assert [other for other, _ in blocked.neighbours[product_id]] == [other for other, _ in neighbours]
+        assert [score for _, score in blocked.neighbours[product_id]] == pytest.approx([score for _, score in neighbours])
+
+def test_catalogs_over_the_limit_are_refused(monkeypatch):
+    engine = RecommendationEngine()
+    engine.build(PRODUCTS, [])
+    monkeypatch.setattr(recommendations, "MAX_PRODUCTS", len(PRODUCTS) - 1)
+
+    with pytest.raises(ValueError):
+        engine.build(PRODUCTS, [])
+    assert engine.counters["builds"] == 1
+    assert engine.lookup("platter", 1) == ["tray"]
@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from revocation import RevocationList, _epoch
+
+pytestmark = pytest.mark.anyio
+
+LIFETIME = timedelta(minutes=30)
+
+async def test_a_token_issued_in_the_cutoff_second_is_revoked(mongo):
+    revocations = RevocationList()
+    await revocations.revoke_user("user-1", LIFETIME)
+    cutoff = _epoch((await mongo.revoked_tokens.find_one({"user_id": "user-1"}))["not_before"])
+
+    assert revocations.is_revoked(None, "user-1", cutoff - 1)
+    assert revocations.is_revoked(None, "user-1", cutoff)
+    assert not revocations.is_revoked(None, "user-1", cutoff + 1)
+    assert not revocations.is_revoked(None, "user-2", cutoff)
+
+async def test_other_workers_pick_up_revocations_on_sync(mongo):
+    here, elsewhere = RevocationList(), RevocationList()
+    await here.revoke_token("jti-1", "user-1", datetime.utcnow() + LIFETIME)
+    assert not elsewhere.is_revoked("jti-1", "user-1", None)
+
+    await elsewhere.sync()
+    assert elsewhere.is_revoked("jti-1", "user-1", None)
+    assert not elsewhere.is_revoked("jti-2", "user-1", None)
+
+    # Later syncs only need what was added since
+    await here.revoke_user("user-2", LIFETIME)
+    await elsewhere.sync()
+    assert elsewhere.is_revoked("jti-3", "user-2", 0)
+    assert elsewhere.stats()["revoked_tokens"] == 1
+    assert elsewhere.stats()["revoked_users"] == 1
+
+async def test_sync_forgets_expired_entries(mongo):
+    now = datetime.utcnow()
+    await mongo.revoked_tokens.insert_many([
+        {"jti": "old", "user_id": "user-1", "expires_at": now - timedelta(seconds=1), "created_at": now - LIFETIME},
+        {"jti": "live", "user_id": "user-1", "expires_at": now + LIFETIME, "created_at": now}
+    ])
+
+    revocations = RevocationList()
+    await revocations.sync()
+    assert not revocations.is_revoked("old", "user-1", None)
+    assert revocations.is_revoked("live", "user-1", None)
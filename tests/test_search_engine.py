@@ -0,0 +1,52 @@
+import pytest
+
+from search_engine import SearchEngine
+
+def product(product_id: str, name: str, description: str = "", **fields):
+    return {"id": product_id, "name": name, "description": description, "category": "crockery", **fields}
+
+@pytest.fixture
+def engine():
+    engine = SearchEngine()
+    engine.load([
+        product("tray", "Walnut Serving Tray", "A tray for breakfast in bed"),
+        product("teapot", "Porcelain Teapot", "Pairs with the walnut serving tray"),
+        product("cups", "Espresso Cups", "Set of four porcelain cups"),
+        product("plates", "Dinner Plates", "Stoneware plates for everyday dining"),
+    ])
+    return engine
+
+def ids(results):
+    return [product_id for product_id, _ in results]
+
+def test_a_title_match_outranks_a_description_only_match(engine):
+    assert ids(engine.search("walnut")) == ["tray", "teapot"]
+    assert ids(engine.search("porcelain")) == ["teapot", "cups"]
+
+def test_a_one_letter_typo_still_matches(engine):
+    assert engine.expand("walnat") == [("walnut", pytest.approx(0.6))]
+    assert ids(engine.search("walnat")) == ["tray", "teapot"]
+    assert ids(engine.search("porcelian")) == ["teapot", "cups"]
+
+    exact, = (score for product_id, score in engine.search("walnut") if product_id == "tray")
+    fuzzy, = (score for product_id, score in engine.search("walnat") if product_id == "tray")
+    assert fuzzy < exact
+
+def test_short_words_must_match_exactly(engine):
+    assert engine.search("cip") == []
+
+def test_upserts_and_removals_show_in_later_searches(engine):
+    engine.upsert(product("board", "Walnut Cheese Board"))
+    assert set(ids(engine.search("walnut"))) == {"tray", "teapot", "board"}
+
+    engine.upsert(product("tray", "Bamboo Serving Tray", "A tray for breakfast in bed"))
+    assert "tray" not in ids(engine.search("walnut"))
+    assert ids(engine.search("bamboo")) == ["tray"]
+
+    assert engine.remove("teapot")
+    assert not engine.remove("teapot")
+    assert ids(engine.search("walnut")) == ["board"]
+    assert ids(engine.search("porcelain")) == ["cups"]
+
+def test_limit_keeps_the_best_hits(engine):
+    assert ids(engine.search("porcelain tray", limit=2)) == ids(engine.search("porcelain tray"))[:2]
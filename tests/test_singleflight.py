@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight
+
+pytestmark = pytest.mark.anyio
+
+async def test_concurrent_calls_share_one_flight():
+    flights = SingleFlight()
+    release = asyncio.Event()
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await release.wait()
+        return "rows"
+
+    waiting = [asyncio.ensure_future(flights.do("listing", fetch)) for _ in range(5)]
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await asyncio.gather(*waiting) == ["rows"] * 5
+    assert calls == 1
+    stats = flights.stats()
+    assert (stats["flights"], stats["absorbed"], stats["in_flight"]) == (1, 4, 0)
+
+async def test_a_failed_flight_fails_every_caller_and_the_next_call_retries():
+    flights = SingleFlight()
+    release = asyncio.Event()
+
+    async def broken():
+        await release.wait()
+        raise ConnectionError("database down")
+
+    waiting = [asyncio.ensure_future(flights.do("listing", broken)) for _ in range(3)]
+    await asyncio.sleep(0)
+    release.set()
+    results = await asyncio.gather(*waiting, return_exceptions=True)
+    assert all(isinstance(result, ConnectionError) for result in results)
+    assert flights.stats()["errors"] == 1
+
+    async def fixed():
+        return "rows"
+
+    assert await flights.do("listing", fixed) == "rows"
+
+async def test_a_cancelled_leader_does_not_fail_its_followers():
+    flights = SingleFlight()
+    release = asyncio.Event()
+
+    async def fetch():
+        await release.wait()
+        return "rows"
+
+    leader = asyncio.ensure_future(flights.do("listing", fetch))
+    follower = asyncio.ensure_future(flights.do("listing", fetch))
+    await asyncio.sleep(0)
+    leader.cancel()
+    release.set()
+
+    assert await follower == "rows"
+    with pytest.raises(asyncio.CancelledError):
+        await leader
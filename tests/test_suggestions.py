@@ -0,0 +1,50 @@
+import pytest
+
+from suggestions import SuggestIndex, normalize
+
+def product(product_id: str, name: str, rating: float, reviews: int, category: str, colors=()):
+    return {"id": product_id, "name": name, "rating": rating, "reviews_count": reviews, "category": category, "colors": list(colors)}
+
+@pytest.fixture
+def index():
+    index = SuggestIndex()
+    index.load([
+        product("runner", "Gold Runner", 5.0, 100, "sneakers", ["Gold"]),
+        product("teapot", "Golden Teapot", 4.0, 10, "crockery", ["White"]),
+        product("cup", "Gilded Gold Cup", 3.0, 0, "crockery"),
+        product("set", "Porcelain Teapot Collection", 4.5, 20, "crockery"),
+    ])
+    return index
+
+def texts(suggestions):
+    return [suggestion["text"] for suggestion in suggestions]
+
+def test_suggestions_are_ordered_by_weight(index):
+    suggestions = index.suggest("gol")
+    assert texts(suggestions) == ["Gold", "Gold Runner", "Golden Teapot", "Gilded Gold Cup"]
+    assert [suggestion["type"] for suggestion in suggestions] == ["color", "product", "product", "product"]
+    assert suggestions[1]["product_id"] == "runner"
+    assert texts(index.suggest("gol", limit=2)) == ["Gold", "Gold Runner"]
+
+def test_queries_are_normalized_like_labels(index):
+    assert normalize("  GÓLD--Run!! ") == "gold run"
+    assert texts(index.suggest("  GÓLD--Run ")) == ["Gold Runner"]
+    assert texts(index.suggest("CROCK")) == ["Crockery"]
+    assert index.suggest("!!!") == []
+    assert index.suggest("silver") == []
+
+def test_prefixes_longer_than_the_trie_still_match(index):
+    assert texts(index.suggest("porcelain teapot co")) == ["Porcelain Teapot Collection"]
+    assert index.suggest("porcelain teapot cx") == []
+
+def test_product_changes_update_weights(index):
+    index.upsert(product("teapot", "Golden Teapot", 4.0, 10000, "crockery", ["White"]))
+    assert texts(index.suggest("gol")) == ["Golden Teapot", "Gold", "Gold Runner", "Gilded Gold Cup"]
+
+    index.remove("runner")
+    assert texts(index.suggest("gol")) == ["Golden Teapot", "Gilded Gold Cup"]
+    assert index.suggest("sneak") == []
+
+    index.upsert(product("cup", "Gilded Silver Cup", 3.0, 0, "crockery", ["Silver"]))
+    assert texts(index.suggest("gol")) == ["Golden Teapot"]
+    assert texts(index.suggest("silv")) == ["Silver", "Gilded Silver Cup"]
@@ -0,0 +1,81 @@
+import pytest
+
+import waiting_room as waiting_room_module
+from waiting_room import NotAdmitted, TicketRequired, WaitingRoom, parse_tickets
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(waiting_room_module.time, "monotonic", clock)
+    monkeypatch.setenv("WAITING_ROOM_ADMIT_PER_SECOND", "2")
+    return clock
+
+@pytest.fixture
+def room(clock):
+    return WaitingRoom()
+
+def test_tickets_are_admitted_in_order_at_the_configured_rate(room, clock):
+    tickets = [room.join("gold", f"user-{index}") for index in range(5)]
+    assert [ticket["position"] for ticket in tickets] == [1, 2, 3, 4, 5]
+    assert tickets[4]["retry_after"] == 3
+
+    clock.now += 1.0
+    statuses = [room.status("gold", ticket["ticket"]) for ticket in tickets]
+    assert [status["admitted"] for status in statuses] == [True, True, False, False, False]
+    assert statuses[4]["position"] == 3
+
+    clock.now += 1.5
+    assert room.status("gold", tickets[4]["ticket"])["admitted"]
+
+def test_an_idle_queue_does_not_bank_admissions(room, clock):
+    clock.now += 3600
+    first, _, third = (room.join("gold", f"user-{index}") for index in range(3))
+    assert first["position"] == 1
+    assert third["position"] == 3
+
+def test_joining_again_keeps_the_same_place(room):
+    first = room.join("gold", "user-1")
+    room.join("gold", "user-2")
+    again = room.join("gold", "user-1")
+
+    assert again["ticket"] == first["ticket"]
+    assert again["position"] == 1
+    assert room.join("gold", "user-3")["position"] == 3
+    assert room.join("other", "user-1")["position"] == 1
+
+def test_check_enforces_admission(room, clock):
+    ticket = room.join("gold", "user-1")["ticket"]
+    room.join("gold", "user-2")
+    waiting = room.join("gold", "user-3")["ticket"]
+
+    with pytest.raises(TicketRequired):
+        room.check("gold", "user-1", [])
+    with pytest.raises(NotAdmitted):
+        room.check("gold", "user-1", [ticket])
+
+    clock.now += 0.5
+    room.check("gold", "user-1", ["junk", ticket])
+    with pytest.raises(TicketRequired):
+        room.check("gold", "user-2", [ticket])
+    with pytest.raises(TicketRequired):
+        room.check("other", "user-1", [ticket])
+    with pytest.raises(NotAdmitted) as error:
+        room.check("gold", "user-3", [waiting])
+    assert error.value.position == 2
+    assert error.value.retry_after == 1
+
+def test_tickets_from_another_process_are_invalid(room):
+    ticket = room.join("gold", "user-1")["ticket"]
+    assert WaitingRoom().status("gold", ticket) is None
+    assert room.status("gold", "junk") is None
+
+def test_parse_tickets():
+    assert parse_tickets(None) == []
+    assert parse_tickets(" a.b , ,c.d") == ["a.b", "c.d"]